@@ -2,7 +2,7 @@
 from dotenv import load_dotenv
 load_dotenv()
 
-import os, time, glob, wave, csv, joblib
+import os, time, glob, wave
 
 def is_free_mode() -> bool:
     # 環境変数 APP_FREE_MODE=1 で「常に無料」
@@ -10,29 +10,18 @@ def is_free_mode() -> bool:
 
 BILLING_ENABLED = os.getenv("BILLING_ENABLED", "0").lower() in ("1", "true", "yes")
 
-if BILLING_ENABLED:
-    import stripe
-    stripe.api_key = os.environ["STRIPE_API_KEY"]
-else:
-    stripe = None  # 参照されてもエラーにしないためのダミー
+# stripe は課金ルート内で import する（起動時に読まない）
 
 import shutil
-import numpy as np
-import python_speech_features
-import librosa
-import boto3
 import ipaddress
 import hashlib, secrets, urllib.parse
 import click
 import requests
 import redis as real_redis
 from utils.subscription_utils import sync_subscription_from_stripe
-from pydub import AudioSegment
-import imageio_ffmpeg
-AudioSegment.converter = imageio_ffmpeg.get_ffmpeg_exe()
 
 import datetime as dt
-from datetime import datetime, date, time as dt_time, timedelta, timezone as _tz
+from datetime import datetime, date, timedelta, timezone as _tz
 
 UTC = _tz.utc
 JST = _tz(timedelta(hours=9))
@@ -45,7 +34,9 @@ mimetypes.add_type('audio/mpeg', '.mp3')
 mimetypes.add_type('audio/mp4',  '.m4a')   # AAC(m4a) はこれ
 
 def s3():
-    return boto3.client("s3", region_name=S3_REGION)
+    # プロセスで 1 つの接続プール付きクライアント（s3_utils で遅延生成）
+    from s3_utils import s3 as _pooled_s3
+    return _pooled_s3()
 
 def s3_exists(key: str) -> bool:
     try:
@@ -100,37 +91,31 @@ def soft_delete_user(user, reason: str = "user_request"):
     user.stripe_customer_id = None
 
 from functools import wraps
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, Response, make_response, render_template_string, abort
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, Response, make_response, render_template_string, abort, g, stream_with_context
 from flask_cors import CORS
 from redis import Redis
 from rq import Queue
 from app_instance import app, db, login_manager
-from tasks import enqueue_detailed_analysis, redis_conn
+from tasks import enqueue_detailed_analysis, enqueue_recording_processing, redis_conn
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from flask.cli import with_appcontext
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_mailman import Mail, EmailMessage
 from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
-from io import StringIO
-from scipy.signal import butter, lfilter
-from pyAudioAnalysis import audioBasicIO, MidTermFeatures
-from models import User, ScoreLog, ScoreFeedback
+from models import User, ScoreLog, ScoreFeedback, jst_date
+from utils import derived_assets, diary_index, url_cache, blob_store, scratch, score_summary, score_pages, recordings
 from flask_migrate import Migrate
-from utils.audio_utils import convert_m4a_to_wav, convert_webm_to_wav, normalize_volume, is_valid_wav, light_analyze
-from sqlalchemy.sql import cast, func, text
-from sqlalchemy import Date
+# 音声処理（numpy / soundfile / librosa）は録音系ルートの中で import する
+from sqlalchemy.sql import text
 import json
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
 from os.path import basename
 
 # ↓↓↓ ③ 定数はインポートしない（必要なら関数だけ）
-from s3_utils import upload_to_s3, signed_url
+from s3_utils import upload_to_s3, presigned_put, presigned_post, s3_head, copy_object, delete_object
+from s3_utils import begin_request_stats, request_stats, upload_batch
 from werkzeug.utils import secure_filename
 from utils.log_utils import add_action_log
 from rq.job import Job
-from routes.iap import iap_bp
-app.register_blueprint(iap_bp, url_prefix="/api/iap")
 
 from server.mailers import send_contact_via_sendgrid as send_contact, send_password_reset_email
 from flask import get_flashed_messages
@@ -153,6 +138,35 @@ def _block_paid_routes_in_free_mode():
             flash("現在は全機能を無料開放中のため購入は不要です。")
             return redirect(url_for('dashboard'))
 
+@app.before_request
+def _begin_s3_stats():
+    begin_request_stats()
+
+@app.after_request
+def _report_s3_stats(resp):
+    # このリクエストで叩いた S3 API の回数（署名付き URL の生成は通信しないので数えない）
+    calls = request_stats()
+    if calls:
+        n = sum(calls.values())
+        resp.headers['X-S3-Calls'] = str(n)
+        app.logger.info(f"[s3] {request.method} {request.path} calls={n} {calls}")
+    return resp
+
+def request_scratch(prefix="req"):
+    """
+    このリクエスト用の作業ディレクトリ（utils.scratch.Workspace）。
+    リクエストの終わりに消える（hold した Future があればその完了後）。
+    """
+    if 'scratch' not in g:
+        g.scratch = scratch.workspace(prefix)
+    return g.scratch
+
+@app.teardown_request
+def _close_request_scratch(exc=None):
+    ws = g.pop('scratch', None)
+    if ws is not None:
+        ws.close()
+
 app.jinja_env.globals['date'] = date
 app.jinja_env.globals['datetime'] = datetime
 
@@ -200,10 +214,6 @@ app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
 # ✅ DBとアプリを紐付け
 migrate = Migrate(app, db)
 
-# 👇この位置に追加
-from admin import init_admin
-init_admin(app, db)
-
 # ✅ そのほか
 app.permanent_session_lifetime = timedelta(days=30)
 serializer = URLSafeTimedSerializer(app.secret_key)
@@ -270,10 +280,6 @@ def unauthorized():
 
 FREE_DAYS = int(os.getenv("FREE_TRIAL_DAYS", "5"))
 
-# パスワードリセット用Blueprint
-from server.routes.password import bp as password_bp
-app.register_blueprint(password_bp, url_prefix="/api")
-
 # Web側のベースURL（メールに入れるリンク用）
 app.config["WEB_BASE_URL"] = os.getenv("WEB_BASE_URL") \
     or os.getenv("DOMAIN_URL") or "https://koekarte.com"
@@ -350,103 +356,9 @@ def api_music():
     return jsonify({"error":"This endpoint was removed."}), 410
 
 # ======== 音声処理 =========
-def bandpass_filter(signal, sr, lowcut=80, highcut=4000, order=5):
-    nyq = 0.5 * sr
-    b, a = butter(order, [lowcut/nyq, highcut/nyq], btype='band')
-    return lfilter(b, a, signal).astype(np.float32)
+# bandpass_filter / extract_advanced_features は utils/feature_engine.py へ移動（旧名 app.xxx でも引けるように残す）
+from utils.feature_engine import bandpass_filter, extract_advanced_features  # noqa: F401
 
-def extract_advanced_features(signal, sr):
-    """
-    低メモリ＆学習なし想定：
-      - 16kHz/mono化、無音トリム
-      - ピッチ: YIN（1D）
-      - 統計量は「平均＋標準偏差」中心（固定次元）
-      - 発話/無音は適応しきい値
-    返り値: dict（固定キー）
-    """
-    # --- 安全キャスト＆モノラル化 ---
-    y = np.asarray(signal, dtype=np.float32)
-    if y.ndim > 1:
-        y = y.mean(axis=1)
-
-    # --- サンプリング周波数統一 ---
-    if sr != 16000:
-        y = librosa.resample(y, orig_sr=sr, target_sr=16000, res_type='kaiser_fast')
-        sr = 16000
-
-    # --- 無音区間トリム（前後） ---
-    intervals = librosa.effects.split(y, top_db=30, frame_length=1024, hop_length=256)
-    if len(intervals):
-        y = np.concatenate([y[s:e] for s, e in intervals])
-    if y.size < sr // 2:  # 0.5秒未満はダミーで返す
-        return {
-            'pitch_med': 0.0, 'pitch_iqr': 0.0,
-            'rms_mean': 0.0, 'rms_std': 0.0,
-            'zcr_mean': 0.0, 'zcr_std': 0.0,
-            'centroid_mean': 0.0, 'centroid_std': 0.0,
-            'bandwidth_mean': 0.0, 'bandwidth_std': 0.0,
-            **{f'mfcc_{i+1}_mean': 0.0 for i in range(13)},
-            **{f'mfcc_{i+1}_std':  0.0 for i in range(13)},
-            'voiced_ratio': 0.0, 'voiced_rate_fps': 0.0,
-        }
-
-    # --- （必要なら）帯域制限：F0の劣化が嫌なら YIN の前は未フィルタでOK ---
-    y_bp = bandpass_filter(y, sr, 80, 4000, order=5)
-
-    # 共通パラメータ
-    n_fft = 2048
-    hop   = 256
-    win   = 1024
-
-    # --- 1) ピッチ（軽量＆堅牢） ---
-    #    piptrack -> yin に変更（1Dで低メモリ）
-    f0 = librosa.yin(y, fmin=50, fmax=400, sr=sr, frame_length=n_fft, hop_length=hop)
-    f0 = f0[np.isfinite(f0)]
-    if f0.size == 0:
-        f0 = np.array([0.0], dtype=np.float32)
-    pitch_med = float(np.median(f0))
-    pitch_iqr = float(np.percentile(f0, 75) - np.percentile(f0, 25))
-
-    # --- 2) 強度・発話テンポプロキシ ---
-    rms = librosa.feature.rms(y=y_bp, frame_length=win, hop_length=hop)[0]
-    zcr = librosa.feature.zero_crossing_rate(y_bp, frame_length=win, hop_length=hop)[0]
-
-    # 適応しきい値で有声/無声を分ける（中央値ベース）
-    thr = float(np.median(rms) * 1.1 + 1e-6)
-    voiced = rms > thr
-    total_frames = rms.size
-    voiced_frames = int(voiced.sum())
-    voiced_ratio = float(voiced_frames / max(total_frames, 1))
-    # 近似「発話レート」＝1秒あたりの有声フレーム数
-    fps = sr / hop
-    voiced_rate_fps = float(voiced_frames / (total_frames / fps + 1e-6))
-
-    # --- 3) スペクトル特徴 ---
-    sc  = librosa.feature.spectral_centroid(y=y_bp, sr=sr, n_fft=n_fft, hop_length=hop)[0]
-    sbw = librosa.feature.spectral_bandwidth(y=y_bp, sr=sr, n_fft=n_fft, hop_length=hop)[0]
-
-    # --- 4) MFCC（13次）: 平均＆標準偏差のみ（固定次元） ---
-    mfcc = librosa.feature.mfcc(y=y_bp, sr=sr, n_mfcc=13, n_fft=n_fft, hop_length=hop)
-    mfcc_mean = mfcc.mean(axis=1).astype(np.float32)
-    mfcc_std  = mfcc.std(axis=1).astype(np.float32)
-
-    # --- 5) まとめ ---
-    feats = {
-        'pitch_med': pitch_med,
-        'pitch_iqr': pitch_iqr,
-        'rms_mean':  float(rms.mean()), 'rms_std': float(rms.std()),
-        'zcr_mean':  float(zcr.mean()), 'zcr_std': float(zcr.std()),
-        'centroid_mean': float(sc.mean()),  'centroid_std': float(sc.std()),
-        'bandwidth_mean': float(sbw.mean()), 'bandwidth_std': float(sbw.std()),
-        'voiced_ratio': voiced_ratio,
-        'voiced_rate_fps': voiced_rate_fps,
-    }
-    for i in range(13):
-        feats[f'mfcc_{i+1}_mean'] = float(mfcc_mean[i])
-        feats[f'mfcc_{i+1}_std']  = float(mfcc_std[i])
-
-    return feats
-    
 # ======== ルート定義 =========
 @app.route('/send-test-mail')
 def send_test_mail():
@@ -600,21 +512,45 @@ def login():
 @app.route('/export_csv')
 @login_required
 def export_csv():
-    if not can_use_premium(current_user):
-        flash("⚠️ 無料期間は終了しました。有料登録後にご利用ください。")
-        return redirect(url_for('dashboard'))
-    logs = ScoreLog.query.filter_by(user_id=current_user.id).order_by(ScoreLog.timestamp).all()
+    """
+    スコア履歴の CSV（ストリーミング。履歴の長さによらずメモリ一定）
+      ?from=YYYY-MM-DD&to=YYYY-MM-DD … JST の暦日で絞る（両端含む）
+      ?gzip=1                         … .csv.gz で返す
+      ?user_id=<id>|all               … 管理者のみ。他ユーザー／全ユーザー分
+    """
+    from utils import csv_export
+
+    target = request.args.get('user_id')
+    if target:
+        admin_required()
+        if target == 'all':
+            user_id = None
+        elif target.isdigit():
+            user_id = int(target)
+        else:
+            return jsonify({'error': 'user_id は数値か all'}), 400
+    else:
+        if not can_use_premium(current_user):
+            flash("⚠️ 無料期間は終了しました。有料登録後にご利用ください。")
+            return redirect(url_for('dashboard'))
+        user_id = current_user.id
 
-    si = StringIO()
-    cw = csv.writer(si)
-    cw.writerow(['日付', 'スコア'])
-    for log in logs:
-        cw.writerow([log.timestamp.strftime('%Y-%m-%d %H:%M:%S'), log.score])
+    try:
+        start = date.fromisoformat(request.args['from']) if request.args.get('from') else None
+        end   = date.fromisoformat(request.args['to']) if request.args.get('to') else None
+    except ValueError:
+        return jsonify({'error': 'from / to は YYYY-MM-DD'}), 400
+
+    gz = request.args.get('gzip') in ('1', 'true')
+    name = "stress_scores" if target is None else f"stress_scores_{target}"
+    if start or end:
+        name += f"_{start or ''}_{end or ''}"
+    name += ".csv.gz" if gz else ".csv"
 
-    output = si.getvalue()
-    return Response(output,
-                    mimetype="text/csv",
-                    headers={"Content-Disposition": "attachment;filename=stress_scores.csv"})
+    body = csv_export.score_csv(user_id=user_id, start=start, end=end, gzip=gz)
+    return Response(stream_with_context(body),
+                    mimetype="application/gzip" if gz else "text/csv",
+                    headers={"Content-Disposition": f"attachment;filename={name}"})
 
 # ------------------------------------------------------------
 # 共有: サブスク状態の参照
@@ -771,6 +707,8 @@ def _build_android_publisher():
             info = json.loads(raw)
         else:
             info = json.loads(os.popen("python - <<'P'\nimport os,base64,json\nprint(json.dumps(json.loads(base64.b64decode(os.environ['GOOGLE_PLAY_SERVICE_JSON']).decode())))\nP").read())
+        from google.oauth2 import service_account
+        from googleapiclient.discovery import build
         creds = service_account.Credentials.from_service_account_info(
             info, scopes=["https://www.googleapis.com/auth/androidpublisher"]
         )
@@ -841,16 +779,25 @@ def api_score_history():
     if not ok:
         return jsonify(success=False, error='forbidden'), 403
 
-    logs = (ScoreLog.query
-            .filter_by(user_id=current_user.id)
-            .order_by(ScoreLog.timestamp)
-            .all())
+    # ?limit= / ?cursor=（さらに古い分）/ ?since=（その後に追加・更新された分だけ）。utils/score_pages 参照
+    # どれも無ければ従来どおり全件
+    cursor, since = request.args.get('cursor'), request.args.get('since')
+    try:
+        limit = score_pages.parse_limit(request.args.get('limit'), paged=bool(cursor or since))
+        logs, next_cursor, latest_cursor, reset = score_pages.page(
+            ScoreLog.query.filter_by(user_id=current_user.id), limit=limit, cursor=cursor, since=since,
+            deletions=score_summary.get(current_user.id).deletions)
+    except ValueError as e:
+        return jsonify(success=False, error='bad_request', message=str(e)), 400
+
     result = [{
+        'id': log.id,
         'timestamp': log.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
         'score': log.score,
         'is_fallback': log.is_fallback
     } for log in logs]
-    return jsonify({"scores": result}), 200
+    return jsonify({"scores": result, "next_cursor": next_cursor, "latest_cursor": latest_cursor,
+                    "reset": reset}), 200
 
 # --- パスワード再設定メール送信（SendGrid版） ---
 def send_reset_email(user):
@@ -1144,18 +1091,12 @@ def dashboard():
         except Exception as e:
             app.logger.warning("[DASH SYNC] skipped: %s", e)
         
-    # ① detailed / fallback で latest を取るコードはそのまま…
-    latest = (
-        ScoreLog.query
-        .filter_by(user_id=current_user.id)
-        .order_by(ScoreLog.timestamp.desc())
-        .first()
-    )
-    # その最新が detailed なら True
-    detailed_ready = bool(latest and not latest.is_fallback)
+    # ① 要約行（主キー参照 1 回）。最新が detailed なら True
+    summary = score_summary.get(current_user.id)
+    detailed_ready = bool(summary.count and not summary.latest_is_fallback)
 
     # ② ログが一件もないときはダミー値を渡してエラーを防止
-    if not latest:
+    if not summary.count:
         return render_template(
             "dashboard.html",
             user=current_user,
@@ -1170,29 +1111,17 @@ def dashboard():
             detailed_ready=False
         )
 
-    # ★ baseline を統一定義に
-    baseline = compute_score_baseline(current_user.id)
-    baseline = baseline if baseline is not None else latest.score
-    diff = round(latest.score - baseline, 1)
-
-    # ★ 全期間の最初の1件（表示用）
-    earliest = (
-        ScoreLog.query
-        .filter_by(user_id=current_user.id)
-        .order_by(ScoreLog.timestamp.asc())
-        .first()
-    )
-    first_score = earliest.score if earliest else latest.score
-    first_date  = fmt_jst(earliest.timestamp, '%Y-%m-%d') if earliest else fmt_jst(latest.timestamp, '%Y-%m-%d')
-    last_date   = fmt_jst(latest.timestamp, '%Y-%m-%d')
+    # ★ baseline は統一定義（全期間の『最初の最大5回』の平均）
+    baseline = summary.baseline if summary.baseline is not None else summary.latest_score
+    diff = round(summary.latest_score - baseline, 1)
 
     return render_template('dashboard.html',
             user=current_user,
-            first_score=first_score,
-            latest_score=latest.score,
+            first_score=summary.first_score,
+            latest_score=summary.latest_score,
             diff=diff,
-            first_score_date=first_date,
-            last_date=last_date,
+            first_score_date=fmt_jst(summary.first_at, '%Y-%m-%d'),
+            last_date=fmt_jst(summary.latest_at, '%Y-%m-%d'),
             baseline=baseline or 0,
             detailed_ready=detailed_ready
     )
@@ -1200,17 +1129,12 @@ def dashboard():
 @app.route('/api/dashboard')
 @login_required
 def api_dashboard():
-    # 1) 詳細済みの最新
-    latest = (
-        ScoreLog.query
-        .filter_by(user_id=current_user.id)
-        .order_by(ScoreLog.timestamp.desc())
-        .first()
-    )
-    detailed_ready = bool(latest and not latest.is_fallback)
+    # 1) 要約行（主キー参照 1 回）
+    summary = score_summary.get(current_user.id)
+    detailed_ready = bool(summary.count and not summary.latest_is_fallback)
 
     # ログが一件もない場合にも、必ず同じキーを返す
-    if not latest:
+    if not summary.count:
         return jsonify({
             'first_score': None,
             'latest_score': None,
@@ -1221,18 +1145,9 @@ def api_dashboard():
             'detailed_ready': False
         }), 200
 
-    # ★ baseline を統一定義に
-    baseline = compute_score_baseline(current_user.id)
-    baseline = baseline if baseline is not None else latest.score
-    diff = round(latest.score - baseline, 1)
-
-    # ★ 全期間の最初の1件（表示用）
-    earliest = (
-        ScoreLog.query
-        .filter_by(user_id=current_user.id)
-        .order_by(ScoreLog.timestamp.asc())
-        .first()
-    )
+    # ★ baseline は統一定義（全期間の『最初の最大5回』の平均）
+    baseline = summary.baseline if summary.baseline is not None else summary.latest_score
+    diff = round(summary.latest_score - baseline, 1)
 
     def to_jst(dt):
         if dt.tzinfo is None:
@@ -1240,10 +1155,10 @@ def api_dashboard():
         return dt.astimezone(JST).strftime('%Y-%m-%d')
 
     return jsonify({
-        'first_score': earliest.score if earliest else latest.score,
-        'first_score_date': to_jst(earliest.timestamp) if earliest else to_jst(latest.timestamp),
-        'last_date': to_jst(latest.timestamp),
-        'latest_score': latest.score,  
+        'first_score': summary.first_score,
+        'first_score_date': to_jst(summary.first_at),
+        'last_date': to_jst(summary.latest_at),
+        'latest_score': summary.latest_score,
         'baseline': baseline or 0,
         'diff': diff,
         'detailed_ready': detailed_ready
@@ -1287,9 +1202,15 @@ def record_page():
 def record_api():
     return jsonify({"status": "ok"})
 
+def _discard_normalized(future, s3_key):
+    """スコアを登録しなかったアップロードの normalized/… を、送信（Future）が終わったら消す"""
+    future.add_done_callback(lambda _key: delete_object(s3_key))
+
 @app.route('/api/upload', methods=['POST'])
 @login_required
 def upload():
+    from utils.audio_utils import AudioPipeline
+
     # ---------- 入力チェック ----------
     if 'audio_data' not in request.files:
         return jsonify({'error': '音声データが見つかりません'}), 400
@@ -1298,9 +1219,8 @@ def upload():
     if not file.filename:
         return jsonify({'error': 'ファイルが選択されていません'}), 400
 
-    # ---------- 保存先・ファイル名 ----------
-    UPLOAD_FOLDER = '/tmp/uploads'
-    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    # ---------- 保存先・ファイル名（リクエスト用の作業ディレクトリ。終わったら消える） ----------
+    ws = request_scratch("upload")
 
     now_jst = datetime.now(JST)
     today_jst = now_jst.date()
@@ -1308,10 +1228,10 @@ def upload():
 
     original_ext = file.filename.rsplit('.', 1)[-1].lower()
     filename = f"user{current_user.id}_{now.strftime('%Y%m%d_%H%M%S')}.{original_ext}"
-    save_path = os.path.join(UPLOAD_FOLDER, filename)
+    save_path = ws.path(filename)
     file.save(save_path)
 
-    # 元ファイルも S3（任意）
+    # 元ファイルも S3（任意・バックグラウンド。待たない）
     try:
         # 拡張子→MIME の最低限マップ
         mime_map = {
@@ -1320,7 +1240,8 @@ def upload():
             'wav': 'audio/wav',
             'mp3': 'audio/mpeg',
         }
-        upload_to_s3(save_path, f"raw/{filename}", content_type=mime_map.get(original_ext))
+        for fut in upload_batch([(save_path, f"raw/{filename}", mime_map.get(original_ext))]).values():
+            ws.hold(fut)  # アップロードが終わるまで作業ディレクトリを消さない
     except Exception:
         app.logger.exception("upload original to s3 failed")
 
@@ -1333,118 +1254,89 @@ def upload():
     except Exception:
         app.logger.exception("stat failed")
 
-    # ---------- 変換＆正規化 ----------
+    # ---------- きょう既存チェック（JST）。上書きしないなら デコード・正規化WAVの送信の前に返す ----------
+    existing = (
+        ScoreLog.query
+        .filter_by(user_id=current_user.id)
+        .filter(ScoreLog.local_date == today_jst)
+        .first()
+    )
+
+    overwrite = request.args.get('overwrite') == 'true'
+    if existing and not overwrite:
+        return jsonify({
+            'success': False,
+            'already': True,
+            'message': '本日はすでにスコアを記録済みです。再録音して上書きする場合は OK を押してください。'
+        }), 200
+
+    # ---------- デコード（1回だけ）＆正規化 ----------
+    norm_upload = None
     try:
-        wav_path = save_path.rsplit('.', 1)[0] + ".wav"
-        convert_success = False
-        if original_ext == "m4a":
-            convert_success = convert_m4a_to_wav(save_path, wav_path)
-        elif original_ext == "webm":
-            convert_success = convert_webm_to_wav(save_path, wav_path)
-        elif original_ext == "wav":
-            shutil.copy(save_path, wav_path)
-            convert_success = True
-        else:
+        if original_ext not in ("m4a", "webm", "wav"):
             return jsonify({'error': '対応していないファイル形式です（m4a/webm/wav）'}), 400
 
-        if not convert_success or not is_valid_wav(wav_path):
+        # 16kHz/mono/int16 に 1 回だけデコードし、以降はこのバッファを使い回す
+        pipeline = AudioPipeline.decode(save_path)
+        if pipeline is None or pipeline.duration < 1.5:
             return jsonify({'error': '録音が短すぎるか、変換に失敗しました。'}), 400
 
+        wav_path = save_path.rsplit('.', 1)[0] + ".wav"
+
         # デバッグ保存
         raw_debug_path = os.path.join(os.path.dirname(__file__), 'uploads/raw', os.path.basename(wav_path))
         os.makedirs(os.path.dirname(raw_debug_path), exist_ok=True)
-        shutil.copy(wav_path, raw_debug_path)
+        pipeline.write_wav(raw_debug_path)
 
         # 正規化
         normalized_filename = os.path.basename(wav_path).replace(".wav", "_normalized.wav")
-        normalized_path = os.path.join("/tmp", normalized_filename)
-        normalize_volume(wav_path, normalized_path)
-
-        # 軽量スコア
-        from utils.audio_utils import compute_rms, light_analyze
-        raw_rms = compute_rms(wav_path)
-
-        recent = (
-            ScoreLog.query
-            .filter_by(user_id=current_user.id)
-            .filter(ScoreLog.volume_std.isnot(None))
-            .order_by(ScoreLog.timestamp.desc())
-            .limit(5)
-            .all()
-        )
-        baseline_rms = (sum(x.volume_std for x in recent) / len(recent)) if recent else raw_rms
-
-        quick_score, is_fallback = light_analyze(
-            wav_path,
-            raw_rms=raw_rms,
-            rms_baseline=baseline_rms
-        )
+        normalized_path = ws.path(normalized_filename)
+        pipeline.write_wav(normalized_path, normalized=True)
+
+        # 正規化WAVを S3 へ（★これは残す）。ワーカーが読むので enqueue 前に完了を待つが、
+        # 待つのは直前だけにして、下のベースライン計算・DB 保存と重ねる。
+        # ここから先で失敗して返すときは _discard_normalized で消す（孤立した normalized/… を残さない）
+        s3_norm_key = f"normalized/{normalized_filename}"
+        norm_upload = ws.hold(upload_batch([(normalized_path, s3_norm_key, "audio/wav")])[s3_norm_key])
+        # 同じホストのワーカーへはローカルの blob ストアで渡す（ワーカーは S3 を読まずに済む）
+        norm_digest = blob_store.put(normalized_path, pipeline.wav_digest(normalized=True))
+
+        # 軽量スコア（直近の録音の音量を基準に）
+        raw_rms = pipeline.raw_rms
+        quick_score, is_fallback = recordings.quick_score(pipeline, current_user.id)
     except Exception:
         app.logger.exception("audio pipeline failed")
+        if norm_upload is not None:
+            _discard_normalized(norm_upload, s3_norm_key)
         return jsonify({'error': '音声処理に失敗しました'}), 500
 
-    # ---------- きょう既存チェック（JST） ----------
-    existing = (
-        ScoreLog.query
-        .filter_by(user_id=current_user.id)
-        .filter(cast(func.timezone('Asia/Tokyo', ScoreLog.timestamp), Date) == today_jst)
-        .first()
-    )
-
-    overwrite = request.args.get('overwrite') == 'true'
-    if existing and not overwrite:
-        return jsonify({
-            'success': False,
-            'already': True,
-            'message': '本日はすでにスコアを記録済みです。再録音して上書きする場合は OK を押してください。'
-        }), 200
-
-    if existing and overwrite:
-        db.session.delete(existing)
-        db.session.commit()
+    # ---------- DB 保存（上書きなら きょうの行を消して、ScoreLog・要約を 1 トランザクションで） ----------
+    try:
+        recordings.save(current_user.id, now, quick_score, raw_rms, normalized_filename,
+                        overwrite=bool(existing and overwrite))
+    except Exception:
+        app.logger.exception("save score failed")
+        _discard_normalized(norm_upload, s3_norm_key)
+        return jsonify({'error': '保存に失敗しました'}), 500
 
-    # ---------- 永続化（詳細解析用） & RQ ----------
+    # ---------- 永続化（詳細解析用） & RQ（行を commit してから積む。ワーカーは filename で行を探す） ----------
+    playback_url = None
     try:
         persistent_path = os.path.join(os.path.dirname(__file__), 'uploads', os.path.basename(normalized_path))
         os.makedirs(os.path.dirname(persistent_path), exist_ok=True)
         shutil.copy(normalized_path, persistent_path)
 
-        # 正規化WAVを S3 に保存（★これは残す）
-        s3_norm_key = f"normalized/{os.path.basename(normalized_path)}"
-        upload_to_s3(normalized_path, s3_norm_key, content_type="audio/wav")
+        if norm_upload.result() is None:
+            app.logger.error(f"[upload] normalized upload failed: {s3_norm_key}")
 
         # ★ enqueue は「normalized/… を含むフルキー」を1回だけ渡す
-        job_id = enqueue_detailed_analysis(s3_norm_key, current_user.id)
+        job_id = enqueue_detailed_analysis(s3_norm_key, current_user.id, norm_digest)
         add_action_log(current_user.id, "録音アップロード（light）")
 
     except Exception:
         app.logger.exception("enqueue failed")
         job_id = None
 
-    # ---------- ★MP3 作成 & S3 ----------
-    playback_url = None
-    try:
-        mp3_path = normalized_path.replace("_normalized.wav", ".mp3")
-        # pydub（内部で imageio-ffmpeg が ffmpeg 実行）
-        AudioSegment.from_wav(normalized_path).export(mp3_path, format="mp3", bitrate="192k")
-
-        s3_key = f"diary/{current_user.id}/{os.path.basename(mp3_path)}"
-        upload_to_s3(mp3_path, s3_key, content_type="audio/mpeg", public=False)
-    except Exception:
-        app.logger.exception("make/upload mp3 failed")
-
-    # ---------- DB 保存 ----------
-    log = ScoreLog(
-        user_id=current_user.id,
-        timestamp=now,
-        score=quick_score,
-        is_fallback=True,
-        filename=os.path.basename(normalized_path),
-        volume_std=raw_rms,
-    )
-    db.session.add(log)
-    db.session.commit()
-
     return jsonify({
         'success': True,
         'quick_score': quick_score,
@@ -1480,7 +1372,180 @@ def upload_result(job_id):
 
     # まだ実行中
     return jsonify(status='pending'), 200
-    
+
+@app.route('/api/transcode/<job_id>')
+@login_required
+def transcode_status(job_id):
+    """
+    MP3 変換ジョブの状況。
+    finished のときは S3 に実在するか（exists）と、あれば署名付き URL を返す。
+    """
+    if not job_id or job_id in ('null', 'undefined'):
+        return jsonify(success=False, error='bad_job_id'), 400
+
+    try:
+        job = Job.fetch(job_id, connection=redis_conn)
+    except Exception:
+        return jsonify(success=False, error='not_found'), 404
+
+    # 自分の diary/<user_id>/ 以外のジョブは見せない
+    args = getattr(job, 'args', None) or ()
+    key = args[1] if len(args) > 1 else None
+    if not key or not key.startswith(f"diary/{current_user.id}/"):
+        return jsonify(success=False, error='not_found'), 404
+
+    status = job.get_status()
+    if status == 'finished':
+        result = job.result or {}
+        exists = s3_exists(key)
+        payload = {'status': 'done' if result.get('ok') and exists else 'failed',
+                   'key': key, 'exists': exists}
+        if result.get('error'):
+            payload['error'] = result['error']
+        if exists:
+            row = derived_assets.find(key)
+            payload['playback_url'] = url_cache.signed_url(key, expires=86400,
+                                                           version=row.updated_at if row else None)
+        return jsonify(payload), 200
+
+    if status in ('failed', 'stopped', 'canceled'):
+        return jsonify(status='failed', key=key, exists=s3_exists(key)), 200
+
+    return jsonify(status='pending', key=key), 200
+
+# ===== 署名付き URL で S3 に直接アップロード =====
+# 1) POST /api/upload/presign   → PUT（または POST フォーム）用の URL と upload_token
+# 2) クライアントが S3 に直接アップロード（Web を通らない）
+# 3) POST /api/upload/complete  → 存在確認・上書き確認のうえ処理ジョブを積む
+UPLOAD_MAX_BYTES     = int(os.getenv("UPLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+UPLOAD_PRESIGN_TTL   = int(os.getenv("UPLOAD_PRESIGN_TTL", "900"))
+UPLOAD_MIME = {'m4a': 'audio/mp4', 'webm': 'audio/webm', 'wav': 'audio/wav'}
+
+@app.route('/api/upload/presign', methods=['POST'])
+@login_required
+def upload_presign():
+    data = request.get_json(silent=True) or {}
+    kind = data.get('kind') or 'recording'
+    ext = (data.get('ext') or 'm4a').lower().lstrip('.')
+
+    if kind == 'recording':
+        if ext not in UPLOAD_MIME:
+            return jsonify({'error': '対応していないファイル形式です（m4a/webm/wav）'}), 400
+        now = datetime.now(JST)
+        filename = f"user{current_user.id}_{now.strftime('%Y%m%d_%H%M%S')}.{ext}"
+        key = f"raw/{filename}"
+        claims = {'uid': current_user.id, 'kind': kind, 'key': key, 'ts': now.isoformat()}
+    elif kind == 'diary':
+        if not (is_free_mode() or can_use_premium(current_user)):
+            return jsonify(success=False, error='forbidden'), 403
+        date_str = data.get('date') or datetime.now(JST).strftime('%Y-%m-%d')
+        try:
+            datetime.strptime(date_str, '%Y-%m-%d')
+        except ValueError:
+            return jsonify({'success': False, 'error': 'bad date'}), 400
+        # 日記は確定キーを上書きしうるので、いったん incoming/ に置き complete でコピーする
+        ext = 'm4a'
+        key = f"incoming/diary/{current_user.id}/{secrets.token_hex(8)}.m4a"
+        claims = {'uid': current_user.id, 'kind': kind, 'key': key, 'date': date_str}
+    else:
+        return jsonify({'error': 'bad kind'}), 400
+
+    content_type = UPLOAD_MIME[ext]
+    put_url = presigned_put(key, content_type, expires=UPLOAD_PRESIGN_TTL)
+    post = presigned_post(key, content_type, UPLOAD_MAX_BYTES, expires=UPLOAD_PRESIGN_TTL)
+    if not put_url and not post:
+        return jsonify({'error': 's3_presign_failed'}), 500
+
+    return jsonify({
+        'key': key,
+        'upload_token': serializer.dumps(claims, salt='s3-upload'),
+        'expires_in': UPLOAD_PRESIGN_TTL,
+        'max_bytes': UPLOAD_MAX_BYTES,
+        'put': {'url': put_url, 'headers': {'Content-Type': content_type}},
+        'post': post,
+    }), 200
+
+@app.route('/api/upload/complete', methods=['POST'])
+@login_required
+def upload_complete():
+    data = request.get_json(silent=True) or {}
+    try:
+        claims = serializer.loads(data.get('upload_token') or '', salt='s3-upload',
+                                  max_age=UPLOAD_PRESIGN_TTL + 3600)
+    except (BadSignature, SignatureExpired):
+        return jsonify({'error': 'bad_token'}), 400
+    if claims.get('uid') != current_user.id:
+        return jsonify({'error': 'bad_token'}), 400
+
+    key = claims['key']
+    head = s3_head(key)
+    if head is None:
+        return jsonify({'error': 'not_uploaded'}), 409
+    if head['size'] > UPLOAD_MAX_BYTES:
+        # PUT はサイズを S3 側で制限できないのでここで弾く
+        delete_object(key)
+        return jsonify({'error': 'too_large'}), 413
+    if head['size'] < 5000:
+        app.logger.warning(f"[upload_complete] file too small (<5KB) maybe failed recording: {key}")
+
+    overwrite = bool(data.get('overwrite')) or request.args.get('overwrite') == 'true'
+
+    if claims['kind'] == 'diary':
+        date_str = claims['date']
+        key_m4a = diary_key_m4a(current_user.id, date_str)
+        key_mp3 = diary_key_mp3(current_user.id, date_str)
+        if not overwrite and diary_index.find(current_user.id, date_str):
+            return jsonify({
+                'success': False,
+                'already': True,
+                'message': '本日はすでに日記を保存済みです。上書きする場合は OK を押してください。'
+            }), 200
+        if not copy_object(key, key_m4a, content_type='audio/mp4'):
+            return jsonify({'success': False, 'error': 's3_upload_failed'}), 500
+        # 索引は必須（一覧・既存チェックはこの表だけを見る）。失敗したら incoming/ を残して 500（同じトークンで再送できる）
+        try:
+            entry = diary_index.upsert(current_user.id, date_str, key_m4a, head['size'])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            app.logger.exception('[upload_complete] diary index failed')
+            return jsonify({'success': False, 'error': 'index_failed'}), 500
+        delete_object(key)
+        # mp3 マーカーは任意（無くても diary_get が再生時に作る）
+        try:
+            if overwrite:
+                delete_object(key_mp3)
+            derived_assets.register(current_user.id, key_m4a, key_mp3, bitrate='128k')
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            app.logger.warning(f'[upload_complete] mp3 marker failed: {e}')
+        # 上書きは同じキーなので、索引の updated_at を版にして新しい URL を返す
+        return jsonify({'success': True,
+                        'playback_url': url_cache.signed_url(key_m4a, expires=86400, version=entry.updated_at)}), 200
+
+    # 録音：きょう既存チェック（JST）は upload() と同じ
+    recorded_at = datetime.fromisoformat(claims['ts'])
+    existing = (
+        ScoreLog.query
+        .filter_by(user_id=current_user.id)
+        .filter(ScoreLog.local_date == jst_date(recorded_at))
+        .first()
+    )
+    if existing and not overwrite:
+        return jsonify({
+            'success': False,
+            'already': True,
+            'message': '本日はすでにスコアを記録済みです。再録音して上書きする場合は OK を押してください。'
+        }), 200
+
+    # デコード・軽量スコア・ScoreLog 登録・詳細解析はワーカーで（結果は /api/upload/result/<job_id>）
+    job_id = enqueue_recording_processing(key, current_user.id, recorded_at.isoformat(), overwrite)
+    if not job_id:
+        return jsonify({'success': False, 'error': 'queue_unavailable'}), 503
+    add_action_log(current_user.id, "録音アップロード（direct）")
+    return jsonify({'success': True, 'job_id': job_id}), 202
+
 # ===== Diary Upload API =====
 @app.route('/api/diary/upload', methods=['POST'])
 @login_required
@@ -1505,37 +1570,47 @@ def diary_upload():
         key_m4a = diary_key_m4a(current_user.id, date_str)
         key_mp3 = diary_key_mp3(current_user.id, date_str)
 
-        # 3) 既存チェック（上書き要求が無ければ already）
-        if not overwrite and (s3_exists(key_m4a) or s3_exists(key_mp3)):
+        # 3) 既存チェック（上書き要求が無ければ already）。S3 ではなく索引を見る
+        if not overwrite and diary_index.find(current_user.id, date_str):
             return jsonify({
                 'success': False,
                 'already': True,
                 'message': '本日はすでに日記を保存済みです。上書きする場合は OK を押してください。'
             }), 200
 
-        # 4) 一旦 /tmp に保存
-        tmp_dir = '/tmp/diary'
-        os.makedirs(tmp_dir, exist_ok=True)
+        # 4) 一旦リクエスト用の作業ディレクトリに保存（リクエスト終了時に消える）
         ext = os.path.splitext(f.filename or '')[1].lower() or '.m4a'
-        tmp_in = os.path.join(tmp_dir, f'{current_user.id}-{date_str}{ext}')
+        tmp_in = request_scratch("diary").path(f'{current_user.id}-{date_str}{ext}')
         f.save(tmp_in)
 
         # 5) m4a を S3（ACLなし=public=False）
         ok1 = upload_to_s3(tmp_in, key_m4a, content_type='audio/mp4', public=False)
         if not ok1 and not s3_exists(key_m4a):
             return jsonify({'success': False, 'error': 's3_upload_failed'}), 500
+        size = os.path.getsize(tmp_in)
+
+        # 6) 索引を書く（必須。一覧・既存チェックはこの表だけを見るので、書けなければ失敗として返す）
+        try:
+            entry = diary_index.upsert(current_user.id, date_str, key_m4a, size)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            app.logger.exception('[diary_upload] diary index failed')
+            return jsonify({'success': False, 'error': 'index_failed'}), 500
 
-        # 6) mp3 も作成できればアップロード（失敗しても続行）
+        #    mp3 は再生時に作る（マーカーだけ登録。任意）
+        #    上書き時は古い mp3 を消してマーカーを absent に戻す（前回の音声を返さない）
         try:
-            tmp_mp3 = os.path.join(tmp_dir, f'{current_user.id}-{date_str}.mp3')
-            AudioSegment.from_file(tmp_in).export(tmp_mp3, format='mp3', bitrate='128k')
-            upload_to_s3(tmp_mp3, key_mp3, content_type='audio/mpeg', public=False)
+            if overwrite:
+                delete_object(key_mp3)
+            derived_assets.register(current_user.id, key_m4a, key_mp3, bitrate='128k')
+            db.session.commit()
         except Exception as e:
-            app.logger.warning(f'[diary_upload] mp3 conversion failed: {e}')
+            db.session.rollback()
+            app.logger.warning(f'[diary_upload] mp3 marker failed: {e}')
 
-        # 7) 再生URL（どちらか存在する方に対して署名URL）
-        key = key_mp3 if s3_exists(key_mp3) else key_m4a
-        playback_url = signed_url(key, expires=86400)  # 24h
+        # 7) 再生URL（この時点で確実にあるのは m4a）
+        playback_url = url_cache.signed_url(key_m4a, expires=86400, version=entry.updated_at)  # 24h
 
         return jsonify({'success': True, 'playback_url': playback_url}), 200
 
@@ -1543,7 +1618,7 @@ def diary_upload():
         app.logger.exception('diary_upload failed')
         return jsonify({'success': False, 'error': 'server_error', 'detail': str(e)}), 500
 
-# ===== Diary by-date (S3確認) =====
+# ===== Diary by-date（DiaryEntry の索引で確認） =====
 @app.route('/api/diary/by-date')
 @login_required
 @require_premium
@@ -1558,46 +1633,68 @@ def diary_by_date():
 
     key_mp3 = diary_key_mp3(current_user.id, q)
     key_m4a = diary_key_m4a(current_user.id, q)
+    entry = diary_index.find(current_user.id, q)
 
-    # ★ここを m4a 優先に
-    key = key_m4a if s3_exists(key_m4a) \
-        else (key_mp3 if s3_exists(key_mp3) else None)
-
-    url = signed_url(key, expires=86400) if key else None
+    # ?format=mp3 のときだけ MP3 を返す（無ければここで作る。DERIVED_WAIT_SEC 内に間に合わなければ m4a）
+    if entry is not None and request.args.get('format') == 'mp3':
+        row = derived_assets.find(key_mp3)
+        if row is None and entry.ext == 'm4a':
+            row = derived_assets.register(current_user.id, key_m4a, key_mp3, bitrate='128k')
+            db.session.commit()
+        if row is not None:
+            if derived_assets.ensure(row):
+                return jsonify({'item': {'date': q,
+                                         'playback_url': url_cache.signed_url(key_mp3, expires=86400,
+                                                                              version=row.updated_at),
+                                         'ext': 'mp3'}}), 200
+            return jsonify({'item': {'date': q,
+                                     'playback_url': url_cache.signed_url(row.source_key, expires=86400,
+                                                                          version=entry.updated_at),
+                                     'ext': 'm4a', 'mp3_status': row.status,
+                                     'transcode_job_id': row.job_id}}), 200
+
+    # 索引は m4a 優先で 1 日 1 行
+    url = url_cache.signed_url(entry.s3_key, expires=86400, version=entry.updated_at) if entry else None
     return jsonify({'item': {'date': q, 'playback_url': url}}), 200
 
+@app.route('/api/diary/play')
+@login_required
+@require_premium
+def diary_play():
+    """
+    未作成の MP3 の再生 URL（diary_list が返す）。
+    MP3 があれば署名 URL へ、無ければ変換ジョブを積んで少し待ち、間に合わなければ元音声へリダイレクト。
+    """
+    key = request.args.get('key') or ''
+    if not key.startswith(f"diary/{current_user.id}/"):
+        abort(404)
+    row = derived_assets.find(key)
+    if row is None:
+        abort(404)
+    target = key if derived_assets.ensure(row) else row.source_key
+    # 上書きで register() が行を戻すので、行の updated_at を版にする
+    return redirect(url_cache.signed_url(target, expires=86400, version=row.updated_at), code=302)
+
 # app.py
 @app.route('/api/diary/list')
 @login_required
 @require_premium
 def diary_list():
     limit = max(1, min(int(request.args.get('limit', 90)), 500))
-    prefix = f"diary/{current_user.id}/"
-    resp = s3().list_objects_v2(Bucket=S3_BUCKET, Prefix=prefix)
-    contents = resp.get('Contents', []) or []
-
-    # 同一日付に m4a と mp3 がある場合は m4a を優先
-    by_date = {}
-    for obj in contents:
-        key  = obj['Key']
-        base = os.path.basename(key)
-        if not (base.endswith('.m4a') or base.endswith('.mp3')):
-            continue
-        date_str = base[:-4]  # 拡張子を除去
-        rec = by_date.get(date_str, {'date': date_str, 'size': 0, 'last_modified': None, 'playback_url': None, 'ext': None})
-
-        # m4a を優先（既に m4a が入っていれば mp3 は上書きしない）
-        is_m4a = base.endswith('.m4a')
-        if rec['ext'] != 'm4a':
-            rec['playback_url'] = signed_url(key, expires=86400)  # 24時間
-            rec['ext'] = 'm4a' if is_m4a else 'mp3'
-
-        rec['size'] = max(rec['size'], obj.get('Size', 0))
-        if obj.get('LastModified'):
-            rec['last_modified'] = obj['LastModified'].isoformat()
-        by_date[date_str] = rec
-
-    items = sorted(by_date.values(), key=lambda x: x['date'], reverse=True)[:limit]
+    # S3 の LIST ではなく (user_id, date) の索引から新しい順に limit 件
+    entries = diary_index.list_entries(current_user.id, limit)
+    # 署名付き URL は期限の半分（URL_CACHE_MIN_REMAINING）までは同じものを返す
+    urls = url_cache.signed_urls([e.s3_key for e in entries], expires=86400,  # 24時間
+                                 versions={e.s3_key: e.updated_at for e in entries})
+    items = []
+    for e in entries:
+        items.append({
+            'date': e.date.isoformat(),
+            'size': e.size or 0,
+            'last_modified': e.updated_at.isoformat() if e.updated_at else None,
+            'playback_url': urls.get(e.s3_key),
+            'ext': e.ext,
+        })
     return jsonify({'items': items}), 200
 
 @app.route('/api/premium/status')
@@ -1631,7 +1728,7 @@ def result():
 
     # 3) 以降は既存ロジック
     range_type = request.args.get('range', 'all')
-    today = date.today()
+    today = datetime.now(JST).date()
 
     start_date = None
     end_date = None
@@ -1647,10 +1744,11 @@ def result():
         end_date   = first_this                # 今月1日(未満)
 
     q = ScoreLog.query.filter(ScoreLog.user_id == current_user.id)
+    # JST の暦日で比較
     if start_date:
-        q = q.filter(ScoreLog.timestamp >= start_date)
+        q = q.filter(ScoreLog.local_date >= start_date)
     if end_date:
-        q = q.filter(ScoreLog.timestamp < end_date)
+        q = q.filter(ScoreLog.local_date < end_date)
 
     logs = q.order_by(ScoreLog.timestamp).all()
 
@@ -1696,6 +1794,39 @@ def admin_cleanup_soft_delete():
     db.session.commit()
     return jsonify({"soft_deleted": len(targets)})
 
+@app.route('/admin/transcoder/stats')
+@login_required
+def admin_transcoder_stats():
+    admin_required()
+    from utils.transcode_service import get_stats
+    stats = get_stats()
+    return jsonify(stats if stats is not None else {'enabled': False}), 200
+
+@app.route('/admin/feature-cache/stats')
+@login_required
+def admin_feature_cache_stats():
+    admin_required()
+    from utils import feature_cache
+    return jsonify(feature_cache.stats()), 200
+
+@app.route('/admin/url-cache/stats')
+@login_required
+def admin_url_cache_stats():
+    admin_required()
+    return jsonify(url_cache.stats()), 200
+
+@app.route('/admin/blob-store/stats')
+@login_required
+def admin_blob_store_stats():
+    admin_required()
+    return jsonify(blob_store.stats()), 200
+
+@app.route('/admin/scratch/stats')
+@login_required
+def admin_scratch_stats():
+    admin_required()
+    return jsonify(scratch.stats()), 200
+
 @app.route('/terms')
 def terms():
     return render_template('terms.html')
@@ -2098,13 +2229,8 @@ def within_free_trial(user) -> bool:
 
 def compute_score_baseline(user_id: int):
     """全期間の『最初の最大5回』の平均に統一（小数1桁）。"""
-    first5 = (ScoreLog.query
-              .filter_by(user_id=user_id)
-              .order_by(ScoreLog.timestamp.asc())
-              .limit(5).all())
-    if not first5:
-        return None
-    return round(sum(x.score for x in first5) / len(first5), 1)
+    # 要約行（UserScoreSummary）に書き込み時点で計算済み
+    return score_summary.get(user_id).baseline
 
 @app.route('/api/profile')
 @login_required
@@ -2140,51 +2266,18 @@ def api_profile():
 
     can_use, reason = check_can_use_premium(current_user)
 
-    # --- スコア抽出（列名ゆらぎ対応） ---
-    def pick_score(row):
-        if not row:
-            return None
-        for key in ('score', 'total_score', 'stress_score'):
-            if hasattr(row, key):
-                v = getattr(row, key)
-                if v is not None:
-                    try:
-                        return float(v)
-                    except Exception:
-                        return None
-        return None
-
     uid = current_user.id
 
-    # --- 今日(JST)の範囲をUTCへ ---
-    today_jst = datetime.now(JST).date()
-    start_jst = datetime.combine(today_jst, dt_time(0, 0, 0), tzinfo=JST)
-    end_jst   = start_jst + timedelta(days=1)
-    start_utc = start_jst.astimezone(UTC)
-    end_utc   = end_jst.astimezone(UTC)
+    # 要約行（主キー参照 1 回）から、今日(JST)の最新スコア・直近の1件・baseline
+    summary = score_summary.get(uid)
+    today_score_value = score_summary.today_score(summary)
+    today_score_value = float(today_score_value) if today_score_value is not None else None
 
-    # 今日(JST)の最新スコア
-    today_logs = (
-        ScoreLog.query
-        .filter_by(user_id=uid)
-        .filter(ScoreLog.timestamp >= start_utc, ScoreLog.timestamp < end_utc)
-        .order_by(ScoreLog.timestamp.desc())
-        .all()
-    )
-    today_score_value = next((pick_score(x) for x in today_logs if pick_score(x) is not None), None)
+    last_recorded = fmt_jst(summary.latest_at, '%Y-%m-%d %H:%M:%S') if summary.count else None
+    last_score_val = float(summary.latest_score) if summary.latest_score is not None else None
 
-    # 直近の1件（表示用）
-    last_log = (
-        ScoreLog.query
-        .filter_by(user_id=uid)
-        .order_by(ScoreLog.timestamp.desc())
-        .first()
-    )
-    last_recorded = fmt_jst(last_log.timestamp, '%Y-%m-%d %H:%M:%S') if last_log else None
-    last_score_val = pick_score(last_log)
-
-    # --- baseline: 登録から5日間の「最初の最大5回」 ---
-    baseline = compute_score_baseline(uid)
+    # --- baseline: 全期間の「最初の最大5回」 ---
+    baseline = summary.baseline
 
     # 偏差 = （今日 or 直近） - baseline
     base_for_dev = today_score_value if today_score_value is not None else last_score_val
@@ -2231,32 +2324,56 @@ def api_scores():
     # クエリ組み立て
     q = ScoreLog.query.filter(ScoreLog.user_id == current_user.id)
     if start:
-        # JSTで比較（DBはUTC想定）
-        q = q.filter(cast(func.timezone('Asia/Tokyo', ScoreLog.timestamp), Date) >= start)
+        # JST の暦日で比較（local_date は (user_id, local_date) の索引で引ける）
+        q = q.filter(ScoreLog.local_date >= start)
     if rng in ('last_month', '先月'):
-        q = q.filter(cast(func.timezone('Asia/Tokyo', ScoreLog.timestamp), Date) < end)
-    logs = q.order_by(ScoreLog.timestamp).all()
+        q = q.filter(ScoreLog.local_date < end)
+
+    # 全期間は ?limit= / ?cursor= / ?since= でページング・差分取得できる（無ければ従来どおり全件）。
+    # 期間指定は元々件数が限られるので従来どおり全件
+    summary = score_summary.get(current_user.id)
+    cursor, since = request.args.get('cursor'), request.args.get('since')
+    paged = start is None
+    next_cursor = latest_cursor = None
+    reset = False
+    if paged:
+        try:
+            limit = score_pages.parse_limit(request.args.get('limit'), paged=bool(cursor or since))
+            logs, next_cursor, latest_cursor, reset = score_pages.page(
+                q, limit=limit, cursor=cursor, since=since, deletions=summary.deletions)
+        except ValueError as e:
+            return jsonify({'error': 'bad_request', 'message': str(e)}), 400
+    else:
+        logs = q.order_by(ScoreLog.timestamp).all()
 
     # 表示用配列
     scores = [{
+        'id': log.id,
         'date': fmt_jst(log.timestamp, '%Y-%m-%d'),
         'score': log.score,
         'is_fallback': log.is_fallback
     } for log in logs]
 
     # ★ 統一：全期間の『最初の最大5回』平均
-    global_baseline = compute_score_baseline(current_user.id) or 0
+    global_baseline = summary.baseline or 0
 
-    latest_score = scores[-1]['score'] if scores else 0
+    # 全期間ではページが最新を含むとは限らないので要約の最新を使う
+    if paged:
+        latest_score = summary.latest_score or 0
+    else:
+        latest_score = scores[-1]['score'] if scores else 0
     diff_global  = round(latest_score - global_baseline, 1)
 
-    return jsonify({
+    body = {
         'range': rng,
         'scores': scores,
         'global_baseline': global_baseline,
         'latest': latest_score,
         'diff_against_global': diff_global
-    }), 200
+    }
+    if paged:
+        body.update(next_cursor=next_cursor, latest_cursor=latest_cursor, reset=reset)
+    return jsonify(body), 200
 
 @app.cli.command("create-admin")
 @click.option("--email", required=True)
@@ -2276,6 +2393,59 @@ def create_admin(email, password):
     db.session.commit()
     click.echo("admin created")
 
+@app.cli.command("diary-backfill")
+@click.option("--user-id", type=int, default=None, help="このユーザーだけ（省略時は全員）")
+@with_appcontext
+def diary_backfill(user_id):
+    """S3 の diary/<user_id>/ から DiaryEntry（日記の索引）を作る。何度流してもよい"""
+    click.echo(f"📚 diary backfill: prefix=diary/{'' if user_id is None else f'{user_id}/'}")
+    stats = diary_index.backfill(user_id=user_id, log=click.echo)
+    click.echo(f"✅ scanned={stats['scanned']} upserted={stats['upserted']} skipped={stats['skipped']}")
+
+@app.cli.command("backfill-local-date")
+@click.option("--batch", type=int, default=5000, show_default=True)
+@with_appcontext
+def backfill_local_date(batch):
+    """ScoreLog.local_date が NULL の行を batch 件ずつ埋める（1 バッチ 1 コミット。何度流してもよい）"""
+    total = 0
+    while True:
+        if db.engine.dialect.name == 'postgresql':
+            n = db.session.execute(text(
+                "UPDATE score_log SET local_date = (timezone('Asia/Tokyo', timestamp))::date "
+                "WHERE id IN (SELECT id FROM score_log WHERE local_date IS NULL AND timestamp IS NOT NULL "
+                "ORDER BY id LIMIT :n)"), {'n': batch}).rowcount
+        else:
+            rows = (ScoreLog.query
+                    .filter(ScoreLog.local_date.is_(None), ScoreLog.timestamp.isnot(None))
+                    .order_by(ScoreLog.id).limit(batch).all())
+            for r in rows:
+                r.local_date = jst_date(r.timestamp)
+            n = len(rows)
+        db.session.commit()
+        if not n:
+            break
+        total += n
+        click.echo(f"  … {total} 件")
+    click.echo(f"✅ local_date backfill: {total} 件")
+
+@app.cli.command("rebuild-score-summary")
+@click.option("--user-id", type=int, default=None, help="このユーザーだけ（省略時は全員）")
+@with_appcontext
+def rebuild_score_summary(user_id):
+    """UserScoreSummary（スコア要約）を ScoreLog から作り直す。ずれていた行は表示する。何度流してもよい"""
+    stats = score_summary.rebuild(user_id=user_id, log=click.echo)
+    click.echo(f"✅ score summary: users={stats['users']} drifted={stats['drifted']}")
+
+@app.cli.command("explain-hot-queries")
+@click.option("--user-id", type=int, required=True, help="計画を見るユーザー（データの多いユーザー推奨）")
+@click.option("--natural", is_flag=True, help="enable_seqscan を切らずにそのまま計画させる")
+@with_appcontext
+def explain_hot_queries(user_id, natural):
+    """ScoreLog のホットクエリが索引で引けているか EXPLAIN で確認する（Seq Scan があれば終了コード 1）"""
+    from utils import query_plans
+    if query_plans.check(user_id, natural=natural, log=click.echo) is False:
+        raise SystemExit(1)
+
 @app.route('/api/feedback', methods=['POST'])
 @login_required
 def api_feedback():
@@ -2317,13 +2487,6 @@ def enqueue_test():
     job_id = enqueue_detailed_analysis(test_path, user_id)
     return f"ジョブを送信しました: {job_id}"
 
-# ✅ ローカルでも本番でも動くDB初期化
-try:
-    with app.app_context():
-        db.create_all()
-except Exception as e:
-    print("❌ DB作成エラー:", e)
-
 @app.route('/api/job_status/<job_id>')
 @login_required
 def job_status(job_id):
@@ -2404,6 +2567,45 @@ def _client_ip():
     except Exception:
         return None  # INET列に入らない値は NULL にする
 
+# ───── アプリファクトリ ─────
+# ルートは app_instance.app に直接定義しているので、ここでは起動時の一度きりの処理
+# （Blueprint 登録・管理画面・DB 初期化）だけをまとめる。何度呼んでも同じ app を返す。
+# gunicorn は従来どおり app:app でも、app:create_app() でもよい。
+# 重いモジュール（librosa / scipy / boto3 / stripe / google API）は各ルートの中で import する。
+DB_CREATE_ALL = os.getenv("DB_CREATE_ALL", "0" if IS_PRODUCTION else "1").lower() in ("1", "true", "yes")
+_app_ready = False
+
+def create_app():
+    global _app_ready
+    if _app_ready:
+        return app
+
+    from routes.iap import iap_bp
+    app.register_blueprint(iap_bp, url_prefix="/api/iap")
+
+    # パスワードリセット用Blueprint
+    from server.routes.password import bp as password_bp
+    app.register_blueprint(password_bp, url_prefix="/api")
+
+    from admin import init_admin
+    init_admin(app, db)
+
+    # 本番は flask db upgrade（migrations/）でスキーマを作る。ローカルは create_all で自動作成
+    if DB_CREATE_ALL:
+        try:
+            with app.app_context():
+                db.create_all()
+        except Exception as e:
+            print("❌ DB作成エラー:", e)
+
+    # 一時ファイル・uploads/ の掃除（バックグラウンド。ホストで担当を取れた 1 プロセスだけが掃除する）
+    scratch.start_sweeper()
+
+    _app_ready = True
+    return app
+
+create_app()
+
 # ✅ ローカル起動用（Renderでは無視される）
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,266 @@
+# bench/bench_audio.py
+"""
+音声パイプラインのベンチマークスイート。
+
+  python bench/bench_audio.py [--durations 2,10,60,600] [--rates 16000,44100,48000]
+                              [--formats wav,m4a,webm] [--stages light_analyze,compute_rms,...]
+                              [--repeat 3] [--json results.json]
+  python bench/bench_audio.py --compare old.json new.json [--threshold 1.2]
+
+bench/corpus.py の合成コーパスに対して、ステージごと・ファイルごとに子プロセスを起こし
+  - wall time / CPU time（cold 1 回＋warm repeat 回の中央値）
+  - peak RSS（子プロセスの ru_maxrss）と、import 後からの増分、ffmpeg などサブプロセスの peak RSS
+を測って JSON に保存する。ステージごとに別プロセスなので peak RSS が他のステージに混ざらない。
+特徴量キャッシュと常駐トランスコーダは無効にして測る（キャッシュヒットで速く見えないように）。
+
+--compare は 2 つの結果 JSON を突き合わせ、warm wall time が threshold 倍を超えて遅くなった
+ステージがあれば終了コード 1。
+"""
+import os
+import sys
+import json
+import time
+import re
+import argparse
+import platform
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# ステージ名 → 対象フォーマット
+STAGES = {
+    "light_analyze":             ("wav",),
+    "compute_rms":               ("wav",),
+    "normalize_volume":          ("wav",),
+    "extract_advanced_features": ("wav",),
+    "pipeline_decode":           ("wav", "m4a", "webm"),
+    "convert_to_wav":            ("m4a", "webm"),
+    "export_mp3":                ("wav",),
+}
+
+
+# ────────── 子プロセス側 ──────────
+def _maxrss_mb(who=None):
+    import resource
+    r = resource.getrusage(resource.RUSAGE_SELF if who is None else who).ru_maxrss
+    return r / (1024 * 1024) if sys.platform == "darwin" else r / 1024  # macOS は bytes, Linux は KB
+
+
+def _stage_fn(stage, path, workdir):
+    """stage を 1 回実行する関数を返す（import はここで済ませる）"""
+    from utils import audio_utils
+
+    if stage == "light_analyze":
+        return lambda: audio_utils.light_analyze(path)
+    if stage == "compute_rms":
+        return lambda: audio_utils.compute_rms(path)
+    if stage == "normalize_volume":
+        out = os.path.join(workdir, "normalized.wav")
+        return lambda: audio_utils.normalize_volume(path, out)
+    if stage == "extract_advanced_features":
+        import soundfile as sf
+        from utils.feature_engine import extract_advanced_features
+
+        def run():
+            y, sr = sf.read(path, dtype="float32")
+            return extract_advanced_features(y, sr)
+        return run
+    if stage == "pipeline_decode":
+        return lambda: audio_utils.AudioPipeline.decode(path)
+    if stage == "convert_to_wav":
+        out = os.path.join(workdir, "converted.wav")
+
+        def run():
+            if not audio_utils._convert_to_wav(path, out):
+                raise RuntimeError("convert failed")
+        return run
+    if stage == "export_mp3":
+        out = os.path.join(workdir, "out.mp3")
+        return lambda: audio_utils.export_mp3(path, out)
+    raise ValueError(f"unknown stage: {stage}")
+
+
+def child_main(stage, path, repeat):
+    import tempfile
+    import resource
+
+    def cpu():
+        # ffmpeg など子プロセスの CPU 時間も含める
+        total = 0.0
+        for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+            ru = resource.getrusage(who)
+            total += ru.ru_utime + ru.ru_stime
+        return total
+
+    with tempfile.TemporaryDirectory(prefix="koekarte-bench-") as workdir:
+        fn = _stage_fn(stage, path, workdir)
+        rss_base = _maxrss_mb()
+
+        # cold: 初回（librosa の遅延 import・numba の JIT を含む）
+        w0, c0 = time.perf_counter(), cpu()
+        fn()
+        cold_wall, cold_cpu = time.perf_counter() - w0, cpu() - c0
+
+        walls, cpus = [], []
+        for _ in range(repeat):
+            w0, c0 = time.perf_counter(), cpu()
+            fn()
+            walls.append(time.perf_counter() - w0)
+            cpus.append(cpu() - c0)
+        peak = _maxrss_mb()
+        child_peak = _maxrss_mb(resource.RUSAGE_CHILDREN)
+
+    print(json.dumps({
+        "cold_wall_s": round(cold_wall, 4),
+        "cold_cpu_s": round(cold_cpu, 4),
+        "wall_s": round(statistics.median(walls), 4) if walls else None,
+        "cpu_s": round(statistics.median(cpus), 4) if cpus else None,
+        "wall_runs_s": [round(w, 4) for w in walls],
+        "peak_rss_mb": round(peak, 1),
+        "rss_delta_mb": round(peak - rss_base, 1),
+        "child_peak_rss_mb": round(child_peak, 1),  # ffmpeg などサブプロセスの最大
+    }))
+
+
+# ────────── 親プロセス側 ──────────
+def _child_env():
+    env = dict(os.environ)
+    env["FEATURE_CACHE"] = "0"
+    env.pop("TRANSCODER_SOCKET", None)
+    return env
+
+
+def run_stage(stage, path, repeat, timeout):
+    cmd = [sys.executable, os.path.abspath(__file__), "--child", stage, path, "--repeat", str(repeat)]
+    try:
+        proc = subprocess.run(cmd, cwd=ROOT, env=_child_env(), capture_output=True, text=True,
+                              timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return {"error": f"timeout ({timeout}s)"}
+    if proc.returncode != 0:
+        lines = proc.stderr.strip().splitlines()
+        # 例外行（"XxxError: ..."）を優先して 1 行で返す
+        errors = [l for l in lines if re.match(r"^[\w.]+(Error|Exception)\b", l)]
+        return {"error": (errors or lines or [f"exit {proc.returncode}"])[-1].strip()}
+    # ステージ内の print（light_analyze のログなど）を読み飛ばし、最後の JSON 行を使う
+    for line in reversed(proc.stdout.splitlines()):
+        if line.startswith("{"):
+            return json.loads(line)
+    return {"error": "no result"}
+
+
+def _git_rev():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_suite(args):
+    from corpus import build_corpus, _csv
+
+    stages = _csv(args.stages, str)
+    formats = _csv(args.formats, str)
+    entries = build_corpus(args.corpus, _csv(args.durations, float), _csv(args.rates, int),
+                           formats)
+
+    results = []
+    print(f"{'stage':26s} {'file':28s} {'cold s':>8s} {'wall s':>8s} {'cpu s':>8s} {'x RT':>7s} {'peak MB':>8s} {'Δ MB':>7s}")
+    for stage in stages:
+        for e in entries:
+            if e["format"] not in STAGES[stage]:
+                continue
+            r = run_stage(stage, e["path"], args.repeat, args.timeout)
+            row = {"stage": stage, "file": os.path.basename(e["path"]), "format": e["format"],
+                   "duration": e["duration"], "sr": e["sr"], **r}
+            results.append(row)
+            name = row["file"]
+            if "error" in r:
+                print(f"{stage:26s} {name:28s} ❌ {r['error']}")
+                continue
+            wall = r["wall_s"] if r["wall_s"] is not None else r["cold_wall_s"]
+            cpu = r["cpu_s"] if r["cpu_s"] is not None else r["cold_cpu_s"]
+            rt = e["duration"] / wall if wall else float("inf")
+            print(f"{stage:26s} {name:28s} {r['cold_wall_s']:8.3f} {wall:8.3f} {cpu:8.3f} "
+                  f"{rt:7.0f} {r['peak_rss_mb']:8.1f} {r['rss_delta_mb']:7.1f}")
+
+    out = {
+        "commit": _git_rev(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "repeat": args.repeat,
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(out, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 {args.json}")
+    return out
+
+
+def compare(old_path, new_path, threshold):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    def index(doc):
+        return {(r["stage"], r["file"]): r for r in doc["results"] if "error" not in r}
+
+    a, b = index(old), index(new)
+    print(f"{old.get('commit')} → {new.get('commit')}")
+    print(f"{'stage':26s} {'file':28s} {'old s':>8s} {'new s':>8s} {'ratio':>7s} {'old MB':>8s} {'new MB':>8s}")
+    regressions = 0
+    for key in sorted(set(a) & set(b)):
+        ra, rb = a[key], b[key]
+        wa = ra["wall_s"] if ra["wall_s"] is not None else ra["cold_wall_s"]
+        wb = rb["wall_s"] if rb["wall_s"] is not None else rb["cold_wall_s"]
+        ratio = wb / wa if wa else float("inf")
+        flag = ""
+        if ratio > threshold:
+            flag = " ⚠️"
+            regressions += 1
+        print(f"{key[0]:26s} {key[1]:28s} {wa:8.3f} {wb:8.3f} {ratio:7.2f} "
+              f"{ra['peak_rss_mb']:8.1f} {rb['peak_rss_mb']:8.1f}{flag}")
+    for key in sorted(set(a) ^ set(b)):
+        print(f"{key[0]:26s} {key[1]:28s} (片方のみ)")
+    if regressions:
+        print(f"❌ {regressions} 件が {threshold}x を超えて遅くなりました")
+        sys.exit(1)
+    print("✅ 回帰なし")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--child", nargs=2, metavar=("STAGE", "PATH"), help=argparse.SUPPRESS)
+    ap.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    ap.add_argument("--threshold", type=float, default=1.2)
+    ap.add_argument("--corpus", default=os.getenv("BENCH_CORPUS_DIR", "/tmp/koekarte-bench-corpus"))
+    ap.add_argument("--durations", default="2,10,60,600")
+    ap.add_argument("--rates", default="16000,44100,48000")
+    ap.add_argument("--formats", default="wav,m4a,webm")
+    ap.add_argument("--stages", default=",".join(STAGES))
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--timeout", type=float, default=1800)
+    ap.add_argument("--json")
+    args = ap.parse_args()
+
+    if args.child:
+        child_main(args.child[0], args.child[1], args.repeat)
+    elif args.compare:
+        compare(args.compare[0], args.compare[1], args.threshold)
+    else:
+        unknown = [s for s in args.stages.split(",") if s and s not in STAGES]
+        if unknown:
+            ap.error(f"unknown stages: {unknown}")
+        run_suite(args)
+
+
+if __name__ == "__main__":
+    main()
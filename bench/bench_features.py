@@ -0,0 +1,190 @@
+# bench/bench_features.py
+"""
+extract_advanced_features の新旧比較ベンチマーク。
+
+  python bench/bench_features.py [--durations 5,30,120] [--repeat 3] [--json out.json]
+
+旧実装（STFT 3 回＋フレーム化 2 回）を下にそのまま残し、
+utils/feature_engine.py の共有 STFT 版と実行時間・出力値を比べる。
+出力キーが一致し、全値が許容誤差内でなければ終了コード 1。特徴量キャッシュは無効にして測る。
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+os.environ["FEATURE_CACHE"] = "0"  # 2 回目以降がキャッシュヒットになり新実装の時間を測れないので
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.feature_engine import extract_advanced_features
+
+RTOL = 1e-4
+ATOL = 1e-6
+
+
+def synth_voice(duration, sr=16000, seed=0):
+    """簡易の発話風信号（基本周波数ゆらぎ＋倍音＋音節エンベロープ＋ノイズ）"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(duration * sr)) / sr
+    f0 = 140 + 25 * np.sin(2 * np.pi * 0.7 * t) + 5 * rng.standard_normal(t.size).cumsum() / sr
+    phase = 2 * np.pi * np.cumsum(f0) / sr
+    voice = sum(np.sin(k * phase) / k for k in range(1, 8))
+    env = np.clip(np.sin(2 * np.pi * 3.5 * t), 0, None) * (np.sin(2 * np.pi * 0.25 * t) > -0.6)
+    return (0.2 * voice * env + 0.005 * rng.standard_normal(t.size)).astype(np.float32)
+
+
+# ────────── 旧実装（比較用・変更しない） ──────────
+def _reference_bandpass(signal, sr, lowcut=80, highcut=4000, order=5):
+    from scipy.signal import butter, lfilter
+    nyq = 0.5 * sr
+    b, a = butter(order, [lowcut/nyq, highcut/nyq], btype='band')
+    return lfilter(b, a, signal).astype(np.float32)
+
+
+def reference_extract_advanced_features(signal, sr):
+    """
+    低メモリ＆学習なし想定：
+      - 16kHz/mono化、無音トリム
+      - ピッチ: YIN（1D）
+      - 統計量は「平均＋標準偏差」中心（固定次元）
+      - 発話/無音は適応しきい値
+    返り値: dict（固定キー）
+    """
+    import librosa
+    # --- 安全キャスト＆モノラル化 ---
+    y = np.asarray(signal, dtype=np.float32)
+    if y.ndim > 1:
+        y = y.mean(axis=1)
+
+    # --- サンプリング周波数統一 ---
+    if sr != 16000:
+        y = librosa.resample(y, orig_sr=sr, target_sr=16000, res_type='kaiser_fast')
+        sr = 16000
+
+    # --- 無音区間トリム（前後） ---
+    intervals = librosa.effects.split(y, top_db=30, frame_length=1024, hop_length=256)
+    if len(intervals):
+        y = np.concatenate([y[s:e] for s, e in intervals])
+    if y.size < sr // 2:  # 0.5秒未満はダミーで返す
+        return {
+            'pitch_med': 0.0, 'pitch_iqr': 0.0,
+            'rms_mean': 0.0, 'rms_std': 0.0,
+            'zcr_mean': 0.0, 'zcr_std': 0.0,
+            'centroid_mean': 0.0, 'centroid_std': 0.0,
+            'bandwidth_mean': 0.0, 'bandwidth_std': 0.0,
+            **{f'mfcc_{i+1}_mean': 0.0 for i in range(13)},
+            **{f'mfcc_{i+1}_std':  0.0 for i in range(13)},
+            'voiced_ratio': 0.0, 'voiced_rate_fps': 0.0,
+        }
+
+    # --- （必要なら）帯域制限：F0の劣化が嫌なら YIN の前は未フィルタでOK ---
+    y_bp = _reference_bandpass(y, sr, 80, 4000, order=5)
+
+    # 共通パラメータ
+    n_fft = 2048
+    hop   = 256
+    win   = 1024
+
+    # --- 1) ピッチ（軽量＆堅牢） ---
+    #    piptrack -> yin に変更（1Dで低メモリ）
+    f0 = librosa.yin(y, fmin=50, fmax=400, sr=sr, frame_length=n_fft, hop_length=hop)
+    f0 = f0[np.isfinite(f0)]
+    if f0.size == 0:
+        f0 = np.array([0.0], dtype=np.float32)
+    pitch_med = float(np.median(f0))
+    pitch_iqr = float(np.percentile(f0, 75) - np.percentile(f0, 25))
+
+    # --- 2) 強度・発話テンポプロキシ ---
+    rms = librosa.feature.rms(y=y_bp, frame_length=win, hop_length=hop)[0]
+    zcr = librosa.feature.zero_crossing_rate(y_bp, frame_length=win, hop_length=hop)[0]
+
+    # 適応しきい値で有声/無声を分ける（中央値ベース）
+    thr = float(np.median(rms) * 1.1 + 1e-6)
+    voiced = rms > thr
+    total_frames = rms.size
+    voiced_frames = int(voiced.sum())
+    voiced_ratio = float(voiced_frames / max(total_frames, 1))
+    # 近似「発話レート」＝1秒あたりの有声フレーム数
+    fps = sr / hop
+    voiced_rate_fps = float(voiced_frames / (total_frames / fps + 1e-6))
+
+    # --- 3) スペクトル特徴 ---
+    sc  = librosa.feature.spectral_centroid(y=y_bp, sr=sr, n_fft=n_fft, hop_length=hop)[0]
+    sbw = librosa.feature.spectral_bandwidth(y=y_bp, sr=sr, n_fft=n_fft, hop_length=hop)[0]
+
+    # --- 4) MFCC（13次）: 平均＆標準偏差のみ（固定次元） ---
+    mfcc = librosa.feature.mfcc(y=y_bp, sr=sr, n_mfcc=13, n_fft=n_fft, hop_length=hop)
+    mfcc_mean = mfcc.mean(axis=1).astype(np.float32)
+    mfcc_std  = mfcc.std(axis=1).astype(np.float32)
+
+    # --- 5) まとめ ---
+    feats = {
+        'pitch_med': pitch_med,
+        'pitch_iqr': pitch_iqr,
+        'rms_mean':  float(rms.mean()), 'rms_std': float(rms.std()),
+        'zcr_mean':  float(zcr.mean()), 'zcr_std': float(zcr.std()),
+        'centroid_mean': float(sc.mean()),  'centroid_std': float(sc.std()),
+        'bandwidth_mean': float(sbw.mean()), 'bandwidth_std': float(sbw.std()),
+        'voiced_ratio': voiced_ratio,
+        'voiced_rate_fps': voiced_rate_fps,
+    }
+    for i in range(13):
+        feats[f'mfcc_{i+1}_mean'] = float(mfcc_mean[i])
+        feats[f'mfcc_{i+1}_std']  = float(mfcc_std[i])
+
+    return feats
+
+
+def _time(fn, *args, repeat=3):
+    best, out = None, None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn(*args)
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return best, out
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--durations', default='5,30,120')
+    ap.add_argument('--repeat', type=int, default=3)
+    ap.add_argument('--json')
+    args = ap.parse_args()
+
+    ok = True
+    rows = []
+    for dur in [float(d) for d in args.durations.split(',')]:
+        y = synth_voice(dur)
+        t_ref, ref = _time(reference_extract_advanced_features, y, 16000, repeat=args.repeat)
+        t_new, new = _time(extract_advanced_features, y, 16000, repeat=args.repeat)
+
+        same_keys = set(ref) == set(new)
+        worst_key, worst = None, 0.0
+        for k in ref:
+            err = abs(ref[k] - new.get(k, np.nan)) / (ATOL + RTOL * abs(ref[k]))
+            if not np.isfinite(err) or err > worst:
+                worst_key, worst = k, err
+        within = same_keys and worst <= 1.0
+        ok &= within
+
+        rows.append({
+            'duration_s': dur, 'reference_s': round(t_ref, 4), 'engine_s': round(t_new, 4),
+            'speedup': round(t_ref / t_new, 2), 'same_keys': same_keys,
+            'worst_key': worst_key, 'worst_err_ratio': round(float(worst), 4), 'ok': within,
+        })
+        print(f"{dur:7.1f}s  ref={t_ref:.3f}s  engine={t_new:.3f}s  x{t_ref / t_new:.2f}  "
+              f"keys={'ok' if same_keys else 'NG'}  worst={worst_key}:{worst:.3f}  {'OK' if within else 'NG'}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'rtol': RTOL, 'atol': ATOL, 'results': rows}, f, ensure_ascii=False, indent=2)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
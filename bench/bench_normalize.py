@@ -0,0 +1,113 @@
+# bench/bench_normalize.py
+"""
+normalize_volume の新旧比較ベンチマーク。
+
+  python bench/bench_normalize.py [--durations 2,10,60,600] [--rates 16000] [--repeat 3] [--json out.json]
+
+旧実装（pydub で読み込み → apply_gain → ffmpeg 起動で WAV 書き出し）を下にそのまま残し、
+utils/audio_utils.normalize_volume（soundfile＋numpy、ffmpeg を起動しない）と
+wall time / CPU time（ffmpeg 子プロセス込み）/ 出力サンプルを比べる。
+出力サンプルが 1 つでも違えば終了コード 1。
+（16kHz mono 以外の入力は新実装でも pydub 経路なので、速度差が出るのは 16kHz mono の行）
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import statistics
+
+import numpy as np
+import soundfile as sf
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.audio_utils import normalize_volume, _audio_segment
+from corpus import build_corpus, _csv
+
+
+# ────────── 旧実装（比較用・変更しない） ──────────
+def reference_normalize_volume(input_path, output_path, target_dBFS=-3.0):
+    AudioSegment = _audio_segment()
+    audio = AudioSegment.from_file(input_path)
+    diff = target_dBFS - audio.dBFS
+    audio.apply_gain(diff).export(
+        output_path, format="wav",
+        parameters=['-acodec','pcm_s16le','-ar','16000','-ac','1']
+    )
+
+
+def _cpu():
+    total = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        ru = resource.getrusage(who)
+        total += ru.ru_utime + ru.ru_stime
+    return total
+
+
+def _measure(fn, repeat):
+    walls, cpus = [], []
+    for _ in range(repeat):
+        w0, c0 = time.perf_counter(), _cpu()
+        fn()
+        walls.append(time.perf_counter() - w0)
+        cpus.append(_cpu() - c0)
+    return statistics.median(walls), statistics.median(cpus)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--corpus', default=os.getenv("BENCH_CORPUS_DIR", "/tmp/koekarte-bench-corpus"))
+    ap.add_argument('--durations', default='2,10,60,600')
+    ap.add_argument('--rates', default='16000')
+    ap.add_argument('--repeat', type=int, default=3)
+    ap.add_argument('--json')
+    args = ap.parse_args()
+
+    entries = build_corpus(args.corpus, _csv(args.durations, float), _csv(args.rates, int), ['wav'])
+    rows, mismatch = [], 0
+    print(f"{'file':28s} {'pydub s':>9s} {'numpy s':>9s} {'speedup':>8s} {'pydub cpu':>10s} {'numpy cpu':>10s}  output")
+    with tempfile.TemporaryDirectory(prefix="koekarte-bench-") as tmp:
+        ref_out = os.path.join(tmp, "ref.wav")
+        new_out = os.path.join(tmp, "new.wav")
+        for e in entries:
+            path = e['path']
+            ref_wall, ref_cpu = _measure(lambda: reference_normalize_volume(path, ref_out), args.repeat)
+            new_wall, new_cpu = _measure(lambda: normalize_volume(path, new_out), args.repeat)
+
+            a, _ = sf.read(ref_out, dtype='int16')
+            b, _ = sf.read(new_out, dtype='int16')
+            if a.shape == b.shape:
+                max_diff = int(np.max(np.abs(a.astype(np.int32) - b))) if a.size else 0
+            else:
+                max_diff = None
+            same = max_diff == 0
+            if not same:
+                mismatch += 1
+            verdict = "identical" if same else f"max |diff|={max_diff}" if max_diff is not None \
+                else f"shape {a.shape} != {b.shape}"
+
+            name = os.path.basename(path)
+            print(f"{name:28s} {ref_wall:9.4f} {new_wall:9.4f} {ref_wall / new_wall:7.1f}x "
+                  f"{ref_cpu:10.4f} {new_cpu:10.4f}  {verdict}")
+            rows.append({'file': name, 'duration': e['duration'], 'sr': e['sr'],
+                         'pydub_wall_s': round(ref_wall, 4), 'numpy_wall_s': round(new_wall, 4),
+                         'pydub_cpu_s': round(ref_cpu, 4), 'numpy_cpu_s': round(new_cpu, 4),
+                         'max_abs_diff': max_diff})
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'repeat': args.repeat, 'results': rows}, f, ensure_ascii=False, indent=2)
+
+    if mismatch:
+        print(f"❌ 出力が一致しないファイルが {mismatch} 件")
+        sys.exit(1)
+    print("✅ 出力サンプルは旧実装と一致")
+
+
+if __name__ == '__main__':
+    main()
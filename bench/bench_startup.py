@@ -0,0 +1,147 @@
+# bench/bench_startup.py
+"""
+起動時間ベンチマーク（gunicorn の cold start / オートスケール時の import コスト）。
+
+  python bench/bench_startup.py [--target app] [--repeat 3] [--top 25] [--json out.json]
+                                [--budget-ms 3000]
+
+新しいインタプリタで `python -X importtime -c "import <target>"` を実行し、
+  - 全体の wall time（中央値）
+  - トップレベルパッケージごとの import 時間（cumulative, µs → ms）
+  - 重いと分かっているモジュール（librosa / scipy / boto3 / stripe など）が読まれたかどうか
+を出す。--budget-ms を超えたら終了コード 1。
+app.py は MAIL_PORT などが無いと import できないので、未設定の項目にはダミー値を入れて測る。
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 起動時に読まれていないことを期待するモジュール
+HEAVY_MODULES = [
+    'librosa', 'numba', 'scipy.signal', 'python_speech_features', 'pyAudioAnalysis',
+    'googleapiclient', 'google.oauth2', 'stripe', 'joblib', 'boto3', 'pydub', 'imageio_ffmpeg',
+]
+
+DUMMY_ENV = {
+    'MAIL_PORT': '587',
+    'SECRET_KEY': 'bench',
+    'DATABASE_URL': 'sqlite://',
+    'DB_CREATE_ALL': '0',
+}
+
+
+def _env():
+    env = dict(os.environ)
+    for k, v in DUMMY_ENV.items():
+        env.setdefault(k, v)
+    return env
+
+
+def parse_importtime(stderr):
+    """
+    -X importtime の出力をパース。
+    返り値: [(module, self_us, cumulative_us, depth), ...]（出力順）
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        try:
+            _, rest = line.split(':', 1)
+            self_us, cum_us, name = rest.split('|', 2)
+        except ValueError:
+            continue
+        depth = (len(name) - len(name.lstrip(' '))) // 2
+        rows.append((name.strip(), int(self_us), int(cum_us), depth))
+    return rows
+
+
+def run_once(target):
+    cmd = [sys.executable, '-X', 'importtime', '-c', f'import {target}']
+    t0 = time.perf_counter()
+    proc = subprocess.run(cmd, cwd=ROOT, env=_env(), capture_output=True, text=True)
+    wall = time.perf_counter() - t0
+    if proc.returncode != 0:
+        tail = '\n'.join(l for l in proc.stderr.splitlines() if not l.startswith('import time:'))[-2000:]
+        raise RuntimeError(f"import {target} failed:\n{tail}")
+    return wall, parse_importtime(proc.stderr)
+
+
+def summarize(rows):
+    """トップレベルパッケージ単位の cumulative（最上位の import だけ数える）"""
+    per_pkg = defaultdict(int)
+    for name, _, cum, depth in rows:
+        if depth == 0:
+            per_pkg[name.split('.')[0]] += cum
+    loaded = {name for name, *_ in rows}
+    heavy = {}
+    for mod in HEAVY_MODULES:
+        heavy[mod] = max((cum for name, _, cum, _ in rows if name == mod), default=None)
+    return per_pkg, loaded, heavy
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--target', default='app')
+    ap.add_argument('--repeat', type=int, default=3)
+    ap.add_argument('--top', type=int, default=25)
+    ap.add_argument('--json')
+    ap.add_argument('--budget-ms', type=float)
+    args = ap.parse_args()
+
+    walls, runs = [], []
+    for _ in range(args.repeat):
+        wall, rows = run_once(args.target)
+        walls.append(wall)
+        runs.append(rows)
+
+    # パッケージ別は各回の中央値
+    samples = defaultdict(list)
+    for rows in runs:
+        per_pkg, _, _ = summarize(rows)
+        for pkg, us in per_pkg.items():
+            samples[pkg].append(us)
+    per_pkg = {pkg: statistics.median(v) / 1000 for pkg, v in samples.items()}
+    _, loaded, heavy = summarize(runs[-1])
+
+    wall_ms = statistics.median(walls) * 1000
+    print(f"import {args.target}: wall={wall_ms:.0f}ms (median of {args.repeat}), modules={len(loaded)}")
+    print(f"{'package':32s} {'cumulative ms':>14s}")
+    for pkg, ms in sorted(per_pkg.items(), key=lambda kv: -kv[1])[:args.top]:
+        print(f"{pkg:32s} {ms:14.1f}")
+
+    print("\nheavy modules loaded at startup:")
+    heavy_loaded = {m: us / 1000 for m, us in heavy.items() if us is not None}
+    if heavy_loaded:
+        for m, ms in sorted(heavy_loaded.items(), key=lambda kv: -kv[1]):
+            print(f"  ⚠️ {m:28s} {ms:8.1f}ms")
+    else:
+        print("  ✅ none")
+
+    result = {
+        'target': args.target,
+        'python': sys.version.split()[0],
+        'wall_ms': round(wall_ms, 1),
+        'wall_ms_runs': [round(w * 1000, 1) for w in walls],
+        'modules_loaded': len(loaded),
+        'packages_ms': {k: round(v, 1) for k, v in sorted(per_pkg.items(), key=lambda kv: -kv[1])},
+        'heavy_loaded_ms': {k: round(v, 1) for k, v in heavy_loaded.items()},
+    }
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    if args.budget_ms is not None and wall_ms > args.budget_ms:
+        print(f"❌ budget 超過: {wall_ms:.0f}ms > {args.budget_ms:.0f}ms")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+# bench/corpus.py
+"""
+ベンチマーク用の合成音声コーパス生成。
+
+  python bench/corpus.py [--out /tmp/koekarte-bench-corpus] [--durations 2,10,60,600]
+                         [--rates 16000,44100,48000] [--formats wav,m4a,webm]
+
+発話風の信号（基本周波数のゆらぎ＋倍音＋フォルマント風の帯域強調＋音節エンベロープ＋息継ぎの無音
+＋背景ノイズ）を seed 固定で作り、WAV（PCM16 mono）と、ffmpeg で M4A（AAC）/ WebM（Opus）を書く。
+同じ引数なら毎回同じ内容になり、既にあるファイルは作り直さない。
+"""
+import os
+import sys
+import argparse
+import subprocess
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DEFAULT_OUT       = os.getenv("BENCH_CORPUS_DIR", "/tmp/koekarte-bench-corpus")
+DEFAULT_DURATIONS = [2, 10, 60, 600]
+DEFAULT_RATES     = [16000, 44100, 48000]
+DEFAULT_FORMATS   = ["wav", "m4a", "webm"]
+
+_ENCODE_ARGS = {
+    "m4a":  ["-c:a", "aac", "-b:a", "96k", "-f", "mp4"],
+    "webm": ["-c:a", "libopus", "-b:a", "48k", "-f", "webm"],
+}
+
+
+def synth_speech(duration, sr, seed=0, block_sec=10):
+    """
+    発話風の信号（float32, -1..1）。
+    10 分・48kHz でもメモリを食わないよう block_sec ごとに作り、位相とピッチのゆらぎは引き継ぐ。
+    """
+    n = int(round(duration * sr))
+    rng = np.random.default_rng(seed)
+    # 基本周波数のランダムウォーク（1 秒ごとの増分）は先に全部引く
+    steps = rng.standard_normal(int(np.ceil(duration)) + 1)
+    csum = np.cumsum(steps)
+
+    out = np.empty(n, dtype=np.float32)
+    phase0 = 0.0
+    block = int(block_sec * sr)
+    for start in range(0, n, block):
+        m = min(block, n - start)
+        idx = np.arange(start, start + m)
+        t = idx / sr
+
+        # 基本周波数：ゆっくりしたイントネーション＋ランダムウォーク
+        sec = idx // sr
+        walk = (csum[sec] - steps[sec] * (1 - (idx % sr) / sr)) / 8   # 秒ごとの増分を線形補間
+        f0 = np.clip(130 + 30 * np.sin(2 * np.pi * 0.3 * t) + 8 * walk, 70, 300)
+        phase = phase0 + 2 * np.pi * np.cumsum(f0) / sr
+        phase0 = float(phase[-1])
+
+        # 倍音（フォルマント付近 500Hz / 1500Hz を強める）
+        voice = np.zeros(m)
+        for k in range(1, 16):
+            fk = k * 130
+            gain = (1.0 / k) * (1 + 1.5 * np.exp(-((fk - 500) / 250) ** 2) + np.exp(-((fk - 1500) / 400) ** 2))
+            voice += gain * np.sin(k * phase)
+
+        # 音節（約 4Hz）と息継ぎ（6 秒ごとに 0.6 秒の無音）
+        syll = np.clip(np.sin(2 * np.pi * 4.2 * t + 0.5 * np.sin(2 * np.pi * 0.9 * t)), 0, None) ** 0.7
+        breath = (t % 6.0) > 0.6
+
+        # 子音っぽい短いノイズバースト＋背景ノイズ
+        noise = rng.standard_normal(m)
+        burst = (np.sin(2 * np.pi * 4.2 * t - 1.2) > 0.95) * breath
+        y = 0.12 * voice * syll * breath + 0.03 * noise * burst + 0.004 * noise
+        out[start:start + m] = np.clip(y, -1.0, 1.0)
+    return out
+
+
+def corpus_name(duration, sr, fmt):
+    return f"speech_{duration:g}s_{sr}.{fmt}"
+
+
+def _ffmpeg():
+    from utils.audio_utils import _ffmpeg_exe
+    return _ffmpeg_exe()
+
+
+def write_file(path, duration, sr, fmt, seed=0):
+    import soundfile as sf
+    if fmt == "wav":
+        sf.write(path, synth_speech(duration, sr, seed), sr, subtype="PCM_16", format="WAV")
+        return path
+
+    # 圧縮形式は同じ WAV を ffmpeg でエンコード（bitexact でメタデータ差を出さない）
+    src = path + ".src.wav"
+    sf.write(src, synth_speech(duration, sr, seed), sr, subtype="PCM_16", format="WAV")
+    try:
+        cmd = [_ffmpeg(), "-y", "-loglevel", "error", "-i", src, "-ac", "1",
+               "-map_metadata", "-1", "-fflags", "+bitexact", "-flags:a", "+bitexact",
+               *_ENCODE_ARGS[fmt], path]
+        res = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if res.returncode != 0:
+            raise RuntimeError(f"encode {fmt} failed: {res.stderr[-300:]!r}")
+    finally:
+        os.remove(src)
+    return path
+
+
+def build_corpus(out=DEFAULT_OUT, durations=DEFAULT_DURATIONS, rates=DEFAULT_RATES,
+                 formats=DEFAULT_FORMATS, seed=0):
+    """コーパスを作って [{'path', 'duration', 'sr', 'format'}, ...] を返す（既存ファイルは再利用）"""
+    os.makedirs(out, exist_ok=True)
+    entries = []
+    for fmt in formats:
+        for sr in rates:
+            for d in durations:
+                path = os.path.join(out, corpus_name(d, sr, fmt))
+                if not os.path.exists(path):
+                    tmp = path + ".tmp." + fmt
+                    write_file(tmp, d, sr, fmt, seed)
+                    os.replace(tmp, path)
+                entries.append({"path": path, "duration": d, "sr": sr, "format": fmt})
+    return entries
+
+
+def _csv(s, cast):
+    return [cast(x) for x in s.split(",") if x.strip()]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--out", default=DEFAULT_OUT)
+    ap.add_argument("--durations", default=",".join(str(d) for d in DEFAULT_DURATIONS))
+    ap.add_argument("--rates", default=",".join(str(r) for r in DEFAULT_RATES))
+    ap.add_argument("--formats", default=",".join(DEFAULT_FORMATS))
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    entries = build_corpus(args.out, _csv(args.durations, float), _csv(args.rates, int),
+                           _csv(args.formats, str), args.seed)
+    for e in entries:
+        print(f"{e['path']}  ({os.path.getsize(e['path']) / 1e6:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+# bench/parity_light_analyze.py
+"""
+light_analyze / compute_rms の新旧一致チェック。
+
+  python bench/parity_light_analyze.py [--durations 0.4,1,2.5,10,61,125] [--rates 16000,22050,44100,48000]
+                                       [--seeds 0,1] [--out /tmp/koekarte-parity]
+
+旧実装（1 秒ブロックごとに np.interp で再サンプル＋gc.collect）を下にそのまま残し、
+utils/audio_utils（60 秒ストライプの一括計算）と
+  - light_analyze のスコア（raw_rms / rms_baseline の組み合わせごと）
+  - pitch / tempo の合計とブロック数（ビット単位）
+  - compute_rms（user-004 で float64 の Welford 集計にしたので 9 桁目程度の差は許す: RMS_RTOL）
+を比べる。合成音声（bench/corpus.py）に加えて無音・端数長・極小ファイルも流す。
+例外になる入力は、新旧が同じ種類の例外になれば一致とみなす。
+1 つでも違えば終了コード 1。特徴量キャッシュは無効にして比べる。
+"""
+import os
+import sys
+import gc
+import argparse
+import tempfile
+import warnings
+
+os.environ["FEATURE_CACHE"] = "0"  # キャッシュヒットで新実装を通らずに一致しないように
+
+import numpy as np
+import soundfile as sf
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils import audio_utils
+from corpus import synth_speech, _csv
+
+# (raw_rms, rms_baseline) の組み合わせ。None は「渡さない」
+VOLUME_CASES = [(None, None), (0.05, None), (0.05, 0.08), (0.2, 0.1)]
+RMS_RTOL = 1e-6
+
+
+# ────────── 旧実装（比較用・変更しない） ──────────
+def reference_compute_rms(path):
+    data, _ = sf.read(path, dtype='float32')
+    return float(np.std(data))
+
+
+def reference_light_totals(wav_path, target_sr=16000, chunk_sec=1.0):
+    """旧 light_analyze の 2) pitch/tempo 部分（合計値とブロック数を返す）"""
+    total_pitch, total_tempo, chunks = 0.0, 0.0, 0
+    with sf.SoundFile(wav_path) as f:
+        orig_sr = f.samplerate
+        blocksize = int(orig_sr * chunk_sec)
+        for block in f.blocks(blocksize=blocksize, dtype='float32'):
+            if orig_sr != target_sr:
+                x_old = np.linspace(0,1,len(block))
+                x_new = np.linspace(0,1,int(len(block)*target_sr/orig_sr))
+                block = np.interp(x_new, x_old, block)
+            zc = np.mean(np.abs(np.diff(np.sign(block))))
+            total_pitch += zc * 150                 # ← 強めに
+            threshold = np.max(np.abs(block)) * 0.02
+            voiced = np.mean(np.abs(block) > threshold)
+            total_tempo += voiced * 200             # ← 強めに
+            chunks += 1
+            del block; gc.collect()
+    return total_pitch, total_tempo, chunks
+
+
+def reference_light_analyze(wav_path, raw_rms=None, rms_baseline=None,
+                            target_sr=16000, chunk_sec=1.0):
+    # 1) 音量スコア
+    abs_score = np.clip(raw_rms * 300, 0, 100) if raw_rms else 50
+    if raw_rms and rms_baseline:
+        rel = (raw_rms - rms_baseline) / rms_baseline
+        rel_score = np.clip(1+rel, 0.5, 1.5) * 50
+    else:
+        rel_score = 50
+    vol_score = 0.5 * abs_score + 0.5 * rel_score
+
+    # 2) pitch/tempo
+    total_pitch, total_tempo, chunks = reference_light_totals(wav_path, target_sr, chunk_sec)
+    pitch_score = total_pitch/chunks if chunks else 50
+    tempo_score = total_tempo/chunks if chunks else 50
+
+    # 3) 合成＆クランプ
+    raw_score = 0.3*vol_score + 0.4*pitch_score + 0.3*tempo_score
+    return int(np.clip(raw_score, 20, 95)), False
+
+
+# ────────── 入力 ──────────
+def build_inputs(out, durations, rates, seeds):
+    """(名前, パス) の一覧。合成音声＋端のケース"""
+    os.makedirs(out, exist_ok=True)
+    items = []
+    for sr in rates:
+        for d in durations:
+            for seed in seeds:
+                path = os.path.join(out, f"speech_{d:g}s_{sr}_seed{seed}.wav")
+                if not os.path.exists(path):
+                    sf.write(path, synth_speech(d, sr, seed), sr, subtype="PCM_16", format="WAV")
+                items.append((os.path.basename(path), path))
+        # 無音（しきい値 0 / 符号 0 の分岐）と、1 ブロックに満たない長さ・ストライプ境界の前後
+        for name, data in (("silence_3s", np.zeros(sr * 3, np.float32)),
+                           ("tiny_7", np.linspace(-0.1, 0.1, 7).astype(np.float32)),
+                           ("stripe_edge_m1", synth_speech(60, sr, 9)[:-1]),
+                           ("stripe_edge_p1", np.concatenate([synth_speech(60, sr, 9), [0.25]]).astype(np.float32))):
+            path = os.path.join(out, f"{name}_{sr}.wav")
+            if not os.path.exists(path):
+                sf.write(path, data, sr, subtype="PCM_16", format="WAV")
+            items.append((os.path.basename(path), path))
+    return items
+
+
+# ────────── 比較 ──────────
+def _same(a, b):
+    return type(a) is type(b) and (a == b or (a != a and b != b))  # NaN 同士も一致扱い
+
+
+def _outcome(fn, *args, **kwargs):
+    """戻り値か、例外なら ('raises', 例外クラス名)"""
+    try:
+        return fn(*args, **kwargs)
+    except Exception as e:
+        return ("raises", type(e).__name__)
+
+
+def check(path):
+    """違いのリスト（空なら一致）"""
+    diffs = []
+    rms_old = reference_compute_rms(path)
+    rms_new = audio_utils.compute_rms(path)
+    if not np.isclose(rms_old, rms_new, rtol=RMS_RTOL, atol=0):
+        diffs.append(f"compute_rms {rms_old!r} != {rms_new!r}")
+
+    def _new_totals():
+        st = audio_utils.analyze_stats(path)
+        return st.total_pitch, st.total_tempo, st.chunks
+    old = _outcome(reference_light_totals, path)
+    new = _outcome(_new_totals)
+    if old[0] == "raises" or new[0] == "raises":
+        if old != new:
+            diffs.append(f"totals {old!r} != {new!r}")
+    elif old[2] != new[2] or not _same(old[0], new[0]) or not _same(old[1], new[1]):
+        diffs.append(f"totals {old!r} != {new!r}")
+
+    for raw_rms, baseline in VOLUME_CASES:
+        old = _outcome(reference_light_analyze, path, raw_rms=raw_rms, rms_baseline=baseline)
+        new = _outcome(audio_utils.light_analyze, path, raw_rms=raw_rms, rms_baseline=baseline)
+        if old != new:
+            diffs.append(f"score(raw_rms={raw_rms}, baseline={baseline}) {old} != {new}")
+    return diffs
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--durations", default="0.4,1,2.5,10,61,125")
+    ap.add_argument("--rates", default="16000,22050,44100,48000")
+    ap.add_argument("--seeds", default="0,1")
+    ap.add_argument("--out", default=os.path.join(tempfile.gettempdir(), "koekarte-parity"))
+    args = ap.parse_args()
+    warnings.simplefilter("ignore", RuntimeWarning)  # 無音・極小入力の mean of empty slice など（新旧とも同じ）
+
+    items = build_inputs(args.out, _csv(args.durations, float), _csv(args.rates, int), _csv(args.seeds, int))
+    failed = 0
+    for name, path in items:
+        diffs = check(path)
+        if diffs:
+            failed += 1
+            print(f"❌ {name}")
+            for d in diffs:
+                print(f"     {d}")
+        else:
+            print(f"✅ {name}")
+    print(f"\n{len(items) - failed}/{len(items)} 一致")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""add derived_asset (on-demand MP3 markers)
+
+Revision ID: 3b1f0c9a7d21
+Revises: 72c0f13321d0
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b1f0c9a7d21'
+down_revision = '72c0f13321d0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'derived_asset',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(length=16), nullable=False),
+        sa.Column('source_key', sa.String(length=512), nullable=False),
+        sa.Column('asset_key', sa.String(length=512), nullable=False),
+        sa.Column('bitrate', sa.String(length=8), nullable=True),
+        sa.Column('status', sa.String(length=16), nullable=False),
+        sa.Column('job_id', sa.String(length=64), nullable=True),
+        sa.Column('error', sa.String(length=255), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('asset_key')
+    )
+    with op.batch_alter_table('derived_asset', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_derived_asset_user_id'), ['user_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('derived_asset', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_derived_asset_user_id'))
+
+    op.drop_table('derived_asset')
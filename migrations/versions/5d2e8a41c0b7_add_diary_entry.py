@@ -0,0 +1,40 @@
+"""add diary_entry (index of diary/<user_id>/<date> objects)
+
+Revision ID: 5d2e8a41c0b7
+Revises: 3b1f0c9a7d21
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d2e8a41c0b7'
+down_revision = '3b1f0c9a7d21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'diary_entry',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('date', sa.Date(), nullable=False),
+        sa.Column('ext', sa.String(length=8), nullable=False),
+        sa.Column('size', sa.Integer(), nullable=True),
+        sa.Column('s3_key', sa.String(length=512), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('diary_entry', schema=None) as batch_op:
+        batch_op.create_index('ix_diary_entry_user_date', ['user_id', 'date'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('diary_entry', schema=None) as batch_op:
+        batch_op.drop_index('ix_diary_entry_user_date')
+
+    op.drop_table('diary_entry')
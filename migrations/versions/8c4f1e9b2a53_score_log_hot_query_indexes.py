@@ -0,0 +1,60 @@
+"""score_log: (user_id, timestamp) / (user_id, filename) indexes, built concurrently
+
+Revision ID: 8c4f1e9b2a53
+Revises: 5d2e8a41c0b7
+Create Date: 2026-10-18 14:00:00.000000
+
+PostgreSQL では CREATE INDEX CONCURRENTLY で作る（score_log への書き込みを止めない）。
+CONCURRENTLY はトランザクション内で実行できないので autocommit_block の中で流す。
+途中で失敗すると INVALID な索引が残るので、その場合は作り直す。
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c4f1e9b2a53'
+down_revision = '5d2e8a41c0b7'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_score_log_user_id_timestamp', ['user_id', 'timestamp']),
+    ('ix_score_log_user_id_filename', ['user_id', 'filename']),
+]
+
+
+def _is_postgres():
+    return op.get_bind().dialect.name == 'postgresql'
+
+
+def _invalid(name):
+    row = op.get_bind().execute(sa.text(
+        "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE c.relname = :name"), {'name': name}).first()
+    return row is not None and not row[0]
+
+
+def upgrade():
+    if not _is_postgres():
+        for name, cols in INDEXES:
+            op.create_index(name, 'score_log', cols, unique=False)
+        return
+
+    with op.get_context().autocommit_block():
+        for name, cols in INDEXES:
+            if _invalid(name):
+                op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+            col_sql = ', '.join(f'"{c}"' for c in cols)
+            op.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON score_log ({col_sql})')
+
+
+def downgrade():
+    if not _is_postgres():
+        for name, _ in INDEXES:
+            op.drop_index(name, table_name='score_log')
+        return
+
+    with op.get_context().autocommit_block():
+        for name, _ in INDEXES:
+            op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
@@ -0,0 +1,87 @@
+"""score_log.local_date (JST calendar day) + (user_id, local_date) index
+
+Revision ID: a1e7c3d90f64
+Revises: 8c4f1e9b2a53
+Create Date: 2026-10-18 15:00:00.000000
+
+1) 列を追加（NULL 可・default 無しなので PostgreSQL ではテーブルを書き換えない）
+2) 既存行を BATCH 件ずつ埋める（1 バッチ 1 コミット。長いトランザクション／ロックを作らない）
+3) (user_id, local_date) の索引を CREATE INDEX CONCURRENTLY で作る
+デプロイ中に旧コードが書いた行（local_date が NULL）は `flask backfill-local-date` で埋め直す。
+"""
+from datetime import datetime, timedelta, timezone
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a1e7c3d90f64'
+down_revision = '8c4f1e9b2a53'
+branch_labels = None
+depends_on = None
+
+INDEX = 'ix_score_log_user_id_local_date'
+BATCH = 5000
+JST = timezone(timedelta(hours=9))
+
+PG_BACKFILL = sa.text(
+    "UPDATE score_log SET local_date = (timezone('Asia/Tokyo', timestamp))::date "
+    "WHERE id IN (SELECT id FROM score_log WHERE local_date IS NULL AND timestamp IS NOT NULL "
+    "ORDER BY id LIMIT :n)")
+
+
+def _backfill_pg(bind):
+    while True:
+        if bind.execute(PG_BACKFILL, {'n': BATCH}).rowcount == 0:
+            break
+
+
+def _backfill_generic(bind):
+    # SQLite など（timezone() が無い）: Python で JST に直して書く
+    last_id = 0
+    while True:
+        rows = bind.execute(sa.text(
+            "SELECT id, timestamp FROM score_log WHERE id > :last AND local_date IS NULL "
+            "AND timestamp IS NOT NULL ORDER BY id LIMIT :n"), {'last': last_id, 'n': BATCH}).all()
+        if not rows:
+            break
+        for row_id, ts in rows:
+            if isinstance(ts, str):
+                ts = datetime.fromisoformat(ts)
+            if ts.tzinfo is None:
+                ts = ts.replace(tzinfo=timezone.utc)
+            bind.execute(sa.text("UPDATE score_log SET local_date = :d WHERE id = :id"),
+                         {'d': ts.astimezone(JST).date(), 'id': row_id})
+        last_id = rows[-1][0]
+
+
+def upgrade():
+    with op.batch_alter_table('score_log', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('local_date', sa.Date(), nullable=True))
+
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        _backfill_generic(bind)
+        op.create_index(INDEX, 'score_log', ['user_id', 'local_date'], unique=False)
+        return
+
+    with op.get_context().autocommit_block():
+        _backfill_pg(bind)
+        row = bind.execute(sa.text(
+            "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE c.relname = :name"), {'name': INDEX}).first()
+        if row is not None and not row[0]:
+            op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {INDEX}')
+        op.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {INDEX} ON score_log (user_id, local_date)')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {INDEX}')
+    else:
+        op.drop_index(INDEX, table_name='score_log')
+
+    with op.batch_alter_table('score_log', schema=None) as batch_op:
+        batch_op.drop_column('local_date')
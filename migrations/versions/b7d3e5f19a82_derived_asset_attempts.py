@@ -0,0 +1,26 @@
+"""derived_asset: attempts (retry limit / backoff for failed transcodes)
+
+Revision ID: b7d3e5f19a82
+Revises: f2c8a6b04d19
+Create Date: 2026-10-18 21:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d3e5f19a82'
+down_revision = 'f2c8a6b04d19'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('derived_asset', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    with op.batch_alter_table('derived_asset', schema=None) as batch_op:
+        batch_op.drop_column('attempts')
@@ -0,0 +1,60 @@
+"""score_log.updated_at + user_score_summary.deletions (score history delta sync)
+
+Revision ID: c3a9f7e2d5b6
+Revises: b7d3e5f19a82
+Create Date: 2026-10-18 22:00:00.000000
+
+スコア履歴 API の ?since= を録音時刻（timestamp）ではなく書き込み時刻（updated_at）で辿るための列と索引。
+既存行の updated_at は NULL のまま（差分には出ない。移行後に全件取り直したクライアントは既に持っている）。
+索引は PostgreSQL では CONCURRENTLY で作る（書き込みを止めない）。
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3a9f7e2d5b6'
+down_revision = 'b7d3e5f19a82'
+branch_labels = None
+depends_on = None
+
+INDEX = 'ix_score_log_user_id_updated_at_id'
+
+
+def _is_postgres():
+    return op.get_bind().dialect.name == 'postgresql'
+
+
+def _invalid(name):
+    row = op.get_bind().execute(sa.text(
+        "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE c.relname = :name"), {'name': name}).first()
+    return row is not None and not row[0]
+
+
+def upgrade():
+    with op.batch_alter_table('score_log', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True))
+    with op.batch_alter_table('user_score_summary', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('deletions', sa.Integer(), nullable=False, server_default='0'))
+
+    if not _is_postgres():
+        op.create_index(INDEX, 'score_log', ['user_id', 'updated_at', 'id'], unique=False)
+        return
+    with op.get_context().autocommit_block():
+        if _invalid(INDEX):
+            op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {INDEX}')
+        op.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {INDEX} ON score_log (user_id, updated_at, id)')
+
+
+def downgrade():
+    if not _is_postgres():
+        op.drop_index(INDEX, table_name='score_log')
+    else:
+        with op.get_context().autocommit_block():
+            op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {INDEX}')
+
+    with op.batch_alter_table('user_score_summary', schema=None) as batch_op:
+        batch_op.drop_column('deletions')
+    with op.batch_alter_table('score_log', schema=None) as batch_op:
+        batch_op.drop_column('updated_at')
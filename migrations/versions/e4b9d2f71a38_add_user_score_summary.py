@@ -0,0 +1,40 @@
+"""add user_score_summary (per-user ScoreLog summary)
+
+Revision ID: e4b9d2f71a38
+Revises: a1e7c3d90f64
+Create Date: 2026-10-18 18:00:00.000000
+
+行は読み出し時に無ければ作られるが、まとめて作るならデプロイ後に `flask rebuild-score-summary`。
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4b9d2f71a38'
+down_revision = 'a1e7c3d90f64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'user_score_summary',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.Column('first_score', sa.Integer(), nullable=True),
+        sa.Column('first_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('latest_score', sa.Integer(), nullable=True),
+        sa.Column('latest_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('latest_is_fallback', sa.Boolean(), nullable=True),
+        sa.Column('baseline', sa.Float(), nullable=True),
+        sa.Column('today_date', sa.Date(), nullable=True),
+        sa.Column('today_score', sa.Integer(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('user_id')
+    )
+
+
+def downgrade():
+    op.drop_table('user_score_summary')
@@ -0,0 +1,59 @@
+"""score_log: (user_id, timestamp, id) index for keyset pagination
+
+Revision ID: f2c8a6b04d19
+Revises: e4b9d2f71a38
+Create Date: 2026-10-18 20:00:00.000000
+
+スコア履歴 API のカーソル（(timestamp, id) の組）を索引だけで辿れるように、
+(user_id, timestamp) を (user_id, timestamp, id) に置き換える（先頭 2 列が同じなので既存のクエリもこれで引ける）。
+PostgreSQL では新しい索引を CONCURRENTLY で作ってから古い方を落とす（書き込みを止めない）。
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2c8a6b04d19'
+down_revision = 'e4b9d2f71a38'
+branch_labels = None
+depends_on = None
+
+NEW = 'ix_score_log_user_id_timestamp_id'
+OLD = 'ix_score_log_user_id_timestamp'
+
+
+def _is_postgres():
+    return op.get_bind().dialect.name == 'postgresql'
+
+
+def _invalid(name):
+    row = op.get_bind().execute(sa.text(
+        "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE c.relname = :name"), {'name': name}).first()
+    return row is not None and not row[0]
+
+
+def upgrade():
+    if not _is_postgres():
+        op.create_index(NEW, 'score_log', ['user_id', 'timestamp', 'id'], unique=False)
+        op.drop_index(OLD, table_name='score_log')
+        return
+
+    with op.get_context().autocommit_block():
+        if _invalid(NEW):
+            op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {NEW}')
+        op.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {NEW} ON score_log (user_id, "timestamp", id)')
+        op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {OLD}')
+
+
+def downgrade():
+    if not _is_postgres():
+        op.create_index(OLD, 'score_log', ['user_id', 'timestamp'], unique=False)
+        op.drop_index(NEW, table_name='score_log')
+        return
+
+    with op.get_context().autocommit_block():
+        if _invalid(OLD):
+            op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {OLD}')
+        op.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {OLD} ON score_log (user_id, "timestamp")')
+        op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {NEW}')
@@ -64,7 +64,17 @@ JST = timezone(timedelta(hours=9))
 
 class ScoreLog(db.Model):
     __tablename__ = 'score_log'
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (
+        # ほぼ全画面が「user_id で絞って timestamp 順」、詳細解析は (user_id, filename) で引く。
+        # id まで含めるのはスコア履歴 API のカーソル（(timestamp, id) の組）を索引だけで辿るため
+        db.Index('ix_score_log_user_id_timestamp_id', 'user_id', 'timestamp', 'id'),
+        # スコア履歴 API の差分取得（?since=）は「書き込まれた順」の (updated_at, id) で辿る
+        db.Index('ix_score_log_user_id_updated_at_id', 'user_id', 'updated_at', 'id'),
+        db.Index('ix_score_log_user_id_filename', 'user_id', 'filename'),
+        # 「JST のきょう」「期間指定」は local_date で引く（timestamp を関数で包むと索引が効かない）
+        db.Index('ix_score_log_user_id_local_date', 'user_id', 'local_date'),
+        {'extend_existing': True},
+    )
 
     id         = db.Column(db.Integer, primary_key=True)
     user_id    = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -74,6 +84,8 @@ class ScoreLog(db.Model):
         db.DateTime(timezone=True),
         default=lambda: datetime.now(JST)
     )
+    # timestamp の JST の暦日（insert / update 時に自動で入る。既存行は flask backfill-local-date）
+    local_date = db.Column(db.Date)
     is_fallback = db.Column(db.Boolean, default=False)
     filename   = db.Column(db.String(255), nullable=True)
     volume_std    = db.Column(db.Float)
@@ -81,6 +93,24 @@ class ScoreLog(db.Model):
     zcr           = db.Column(db.Float)
     pitch_std     = db.Column(db.Float)
     tempo_val     = db.Column(db.Float)
+    # 最後に insert / update した時刻（自動で入る。録音時刻の timestamp とは別。移行前の行は NULL）
+    updated_at    = db.Column(db.DateTime(timezone=True))
+
+def jst_date(ts):
+    """datetime の JST の暦日（naive は UTC とみなす。DB の timestamptz と同じ扱い）"""
+    if ts is None:
+        return None
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.astimezone(JST).date()
+
+@db.event.listens_for(ScoreLog, 'before_insert')
+@db.event.listens_for(ScoreLog, 'before_update')
+def _fill_local_date(mapper, connection, target):
+    if target.timestamp is None:
+        target.timestamp = datetime.now(JST)  # 列の default より先に決めて local_date と揃える
+    target.local_date = jst_date(target.timestamp)
+    target.updated_at = datetime.now(timezone.utc)
 
 class ActionLog(db.Model):
     __tablename__ = 'action_log'
@@ -104,3 +134,87 @@ class ScoreFeedback(db.Model):
         db.DateTime(timezone=True),
         default=lambda: datetime.now(timezone.utc)
     )
+
+class DerivedAsset(db.Model):
+    """
+    元音声（S3）から作る派生ファイル（MP3 など）のマーカー。
+    アップロード時は status='absent' で登録だけして、再生が要求されたときに初めて変換する。
+      absent  : 未作成
+      pending : 変換ジョブ実行中（job_id）
+      ready   : asset_key が S3 にある
+      failed  : 変換失敗（error）。attempts に応じて間隔を空けて再投入し、上限を超えたら諦める
+    job_id は今有効な変換ジョブ。結果はこれと同じジョブからしか書き込まない（上書き前の古いジョブを無視する）。
+    """
+    __tablename__ = 'derived_asset'
+
+    id         = db.Column(db.Integer, primary_key=True)
+    user_id    = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    kind       = db.Column(db.String(16), nullable=False, default='mp3')
+    source_key = db.Column(db.String(512), nullable=False)
+    asset_key  = db.Column(db.String(512), nullable=False, unique=True)
+    bitrate    = db.Column(db.String(8))
+    status     = db.Column(db.String(16), nullable=False, default='absent')
+    job_id     = db.Column(db.String(64))
+    error      = db.Column(db.String(255))
+    attempts   = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # 変換ジョブを積んだ回数
+    created_at = db.Column(
+        db.DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc)
+    )
+    updated_at = db.Column(
+        db.DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc)
+    )
+
+class DiaryEntry(db.Model):
+    """
+    日記音声（S3 の diary/<user_id>/<YYYY-MM-DD>.<ext>）の索引。1 ユーザー 1 日 1 行。
+    アップロード時に書き、既存チェック・日付指定・一覧はこの表だけで答える（S3 の HEAD / LIST を打たない）。
+    既存の S3 オブジェクトからは `flask diary-backfill` で作る。
+    """
+    __tablename__ = 'diary_entry'
+    __table_args__ = (
+        db.Index('ix_diary_entry_user_date', 'user_id', 'date', unique=True),
+    )
+
+    id         = db.Column(db.Integer, primary_key=True)
+    user_id    = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    date       = db.Column(db.Date, nullable=False)          # 日記の日付（JST の暦日）
+    ext        = db.Column(db.String(8), nullable=False)     # 'm4a'（旧データは 'mp3' のみのことがある）
+    size       = db.Column(db.Integer)
+    s3_key     = db.Column(db.String(512), nullable=False)
+    updated_at = db.Column(
+        db.DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc)
+    )
+
+class UserScoreSummary(db.Model):
+    """
+    ユーザーごとの ScoreLog の要約（1 ユーザー 1 行）。dashboard / api_dashboard / api_profile は
+    毎回 ScoreLog を引かず、この行の主キー参照だけで答える。
+    ScoreLog を書く処理（upload / process_uploaded_recording / 詳細解析）が同じトランザクションで
+    utils.score_summary.sync() を呼んで更新する。ずれたら `flask rebuild-score-summary`。
+    """
+    __tablename__ = 'user_score_summary'
+
+    user_id      = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    count        = db.Column(db.Integer, nullable=False, default=0)
+    first_score  = db.Column(db.Integer)
+    first_at     = db.Column(db.DateTime(timezone=True))
+    latest_score = db.Column(db.Integer)
+    latest_at    = db.Column(db.DateTime(timezone=True))
+    latest_is_fallback = db.Column(db.Boolean)
+    baseline     = db.Column(db.Float)                   # 全期間の『最初の最大5回』の平均（小数1桁）
+    # 最新の記録日（JST）とその日の最新スコア。today_date が JST のきょうなら「きょうのスコア」
+    today_date   = db.Column(db.Date)
+    today_score  = db.Column(db.Integer)
+    # これまでに消した ScoreLog の行数（上書き録音など）。スコア履歴 API の差分カーソルに入れ、
+    # 変わっていたらクライアントに取り直し（reset）を返す
+    deletions    = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    updated_at   = db.Column(
+        db.DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc)
+    )
@@ -1,26 +1,140 @@
 # s3_utils.py
 import os
+import time
+import threading
 import mimetypes
-import boto3
+import contextvars
+from collections import Counter
 from urllib.parse import quote_plus
-from botocore.exceptions import NoCredentialsError, ClientError
 
 AWS_ACCESS_KEY = os.getenv('AWS_ACCESS_KEY_ID')
 AWS_SECRET_KEY = os.getenv('AWS_SECRET_ACCESS_KEY')
 S3_BUCKET     = os.getenv('S3_BUCKET', 'koekarte-up')
-S3_REGION     = os.getenv('AWS_REGION', 'ap-northeast-1')  # 東京
+S3_REGION     = os.getenv('AWS_REGION') or os.getenv('S3_REGION') or os.getenv('AWS_S3_REGION', 'ap-northeast-1')  # 東京
+# ローカルの S3 互換サーバ（MinIO / moto_server など）を使うとき: S3_ENDPOINT_URL=http://localhost:9000
+S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL') or None
 
-def _client():
-    return boto3.client(
-        's3',
+# 接続プール／転送設定
+S3_MAX_POOL            = int(os.getenv('S3_MAX_POOL', '32'))           # keep-alive で使い回す接続数
+S3_CONNECT_TIMEOUT     = float(os.getenv('S3_CONNECT_TIMEOUT', '5'))
+S3_READ_TIMEOUT        = float(os.getenv('S3_READ_TIMEOUT', '60'))
+S3_MAX_ATTEMPTS        = int(os.getenv('S3_MAX_ATTEMPTS', '3'))
+S3_MULTIPART_THRESHOLD = int(os.getenv('S3_MULTIPART_THRESHOLD', str(8 * 1024 * 1024)))
+S3_MULTIPART_CHUNKSIZE = int(os.getenv('S3_MULTIPART_CHUNKSIZE', str(8 * 1024 * 1024)))
+S3_MAX_CONCURRENCY     = int(os.getenv('S3_MAX_CONCURRENCY', '8'))     # 1 ファイルあたりの並列パート数
+S3_UPLOAD_WORKERS      = int(os.getenv('S3_UPLOAD_WORKERS', '4'))      # upload_batch の同時アップロード数
+S3_UPLOAD_RETRIES      = int(os.getenv('S3_UPLOAD_RETRIES', '2'))      # 失敗時の再試行回数（botocore のリトライとは別）
+
+# クライアントはプロセスに 1 つ（boto3 のクライアントはスレッドセーフ）。
+# RQ の work-horse や supervisor の子は fork で生まれるので、pid が変わったら作り直す
+# （親の接続プールのソケットを子で使い回さない）。
+_client_lock = threading.Lock()
+_client_obj = None
+_client_pid = None
+_transfer_cfg = None
+_upload_pool = None
+_upload_pool_pid = None
+
+# API 呼び出し回数（プロセス累計と、begin_request_stats() 以降のリクエスト単位）
+_totals = Counter()
+_totals_lock = threading.Lock()
+_request_calls = contextvars.ContextVar('s3_request_calls', default=None)
+
+
+def _count(op):
+    with _totals_lock:
+        _totals[op] += 1
+    calls = _request_calls.get()
+    if calls is not None:
+        calls[op] += 1
+
+
+def _on_before_call(model=None, **kwargs):
+    # botocore の before-call イベント（リトライを除く API 呼び出し 1 回ごと）
+    _count(model.name if model is not None else 'unknown')
+
+
+def _build_client():
+    import boto3  # 起動時に読まない（初回の S3 アクセスで import）
+    from botocore.config import Config
+    config = Config(
+        region_name=S3_REGION,
+        max_pool_connections=S3_MAX_POOL,
+        tcp_keepalive=True,
+        connect_timeout=S3_CONNECT_TIMEOUT,
+        read_timeout=S3_READ_TIMEOUT,
+        retries={'max_attempts': S3_MAX_ATTEMPTS, 'mode': 'standard'},
+        # ローカルの S3 互換サーバはバケットをパスで指定する
+        s3={'addressing_style': 'path'} if S3_ENDPOINT_URL else None,
+    )
+    # デフォルトセッションはスレッドセーフでないので専用のセッションから作る
+    session = boto3.session.Session(
         aws_access_key_id=AWS_ACCESS_KEY,
         aws_secret_access_key=AWS_SECRET_KEY,
-        region_name=S3_REGION
+        region_name=S3_REGION,
     )
+    client = session.client('s3', endpoint_url=S3_ENDPOINT_URL, config=config)
+    client.meta.events.register('before-call.s3', _on_before_call)
+    return client
+
+
+def _count_transfer(op):
+    """
+    upload_file / download_file の PutObject・UploadPart などは s3transfer のスレッドで走るので
+    リクエスト単位のカウンタには届かない（プロセス累計には入る）。転送 1 回として呼び出し側で数える。
+    """
+    calls = _request_calls.get()
+    if calls is not None:
+        calls[op] += 1
+
+
+def _client():
+    global _client_obj, _client_pid
+    pid = os.getpid()
+    if _client_obj is not None and _client_pid == pid:
+        return _client_obj
+    with _client_lock:
+        if _client_obj is None or _client_pid != pid:
+            _client_obj = _build_client()
+            _client_pid = pid
+    return _client_obj
+
+
+def transfer_config():
+    """upload_file / download_file 用（マルチパートの閾値・チャンク・並列数）"""
+    global _transfer_cfg
+    if _transfer_cfg is None:
+        from boto3.s3.transfer import TransferConfig
+        _transfer_cfg = TransferConfig(
+            multipart_threshold=S3_MULTIPART_THRESHOLD,
+            multipart_chunksize=S3_MULTIPART_CHUNKSIZE,
+            max_concurrency=S3_MAX_CONCURRENCY,
+            use_threads=True,
+        )
+    return _transfer_cfg
+
 
 def s3():
     return _client()
 
+
+def begin_request_stats():
+    """このリクエスト（コンテキスト）での API 呼び出し回数を数え始める"""
+    calls = Counter()
+    _request_calls.set(calls)
+    return calls
+
+
+def request_stats():
+    """begin_request_stats() 以降の {操作名: 回数}。数えていなければ空"""
+    return dict(_request_calls.get() or {})
+
+
+def api_call_totals():
+    """プロセス起動からの {操作名: 回数}"""
+    with _totals_lock:
+        return dict(_totals)
+
 def s3_exists(key: str) -> bool:
     try:
         _client().head_object(Bucket=S3_BUCKET, Key=key)
@@ -28,8 +142,18 @@ def s3_exists(key: str) -> bool:
     except Exception:
         return False
 
+def s3_head(key: str):
+    """オブジェクトのメタ情報（size / content_type）。無ければ None"""
+    try:
+        r = _client().head_object(Bucket=S3_BUCKET, Key=key)
+        return {'size': r.get('ContentLength', 0), 'content_type': r.get('ContentType')}
+    except Exception:
+        return None
+
 def s3_object_url(key: str) -> str:
     # バケットが公開設定なら直接アクセス可。非公開なら使えない（参考用）。
+    if S3_ENDPOINT_URL:
+        return f"{S3_ENDPOINT_URL.rstrip('/')}/{S3_BUCKET}/{quote_plus(key)}"
     return f"https://{S3_BUCKET}.s3.{S3_REGION}.amazonaws.com/{quote_plus(key)}"
 
 def upload_to_s3(file_path, s3_key, content_type=None, public=True):
@@ -38,11 +162,13 @@ def upload_to_s3(file_path, s3_key, content_type=None, public=True):
     成功時は、public=True なら公開URL文字列（※非公開だと実アクセス不可）を、
     public=False なら s3_key を返す。失敗時は None。
     """
+    from botocore.exceptions import NoCredentialsError, ClientError
     try:
         if not content_type:
             content_type = mimetypes.guess_type(s3_key)[0] or 'application/octet-stream'
         extra = {'ContentType': content_type}  # ← ACL を渡さない！
-        _client().upload_file(file_path, S3_BUCKET, s3_key, ExtraArgs=extra)
+        _count_transfer('UploadFile')
+        _client().upload_file(file_path, S3_BUCKET, s3_key, ExtraArgs=extra, Config=transfer_config())
         return s3_object_url(s3_key) if public else s3_key
     except (NoCredentialsError, ClientError) as e:
         print("❌ S3アップロード失敗:", repr(e))
@@ -50,7 +176,8 @@ def upload_to_s3(file_path, s3_key, content_type=None, public=True):
 
 def download_from_s3(s3_key: str, local_path: str):
     try:
-        _client().download_file(S3_BUCKET, s3_key, local_path)
+        _count_transfer('DownloadFile')
+        _client().download_file(S3_BUCKET, s3_key, local_path, Config=transfer_config())
         print("✅ S3ダウンロード成功:", s3_key)
         return True
     except Exception as e:
@@ -68,3 +195,92 @@ def signed_url(s3_key: str, expires: int = 3600):
     except Exception as e:
         print("❌ 署名付きURL生成失敗:", e)
         return None
+
+def presigned_put(s3_key: str, content_type: str, expires: int = 900):
+    """クライアントが S3 に直接 PUT するための署名付き URL（Content-Type も署名に含める）"""
+    try:
+        return _client().generate_presigned_url(
+            ClientMethod='put_object',
+            Params={'Bucket': S3_BUCKET, 'Key': s3_key, 'ContentType': content_type},
+            ExpiresIn=expires
+        )
+    except Exception as e:
+        print("❌ 署名付きPUT URL生成失敗:", e)
+        return None
+
+def presigned_post(s3_key: str, content_type: str, max_bytes: int, expires: int = 900):
+    """
+    ブラウザのフォーム POST 用（サイズ上限を S3 側で強制できる）。
+    返り値: {'url': ..., 'fields': {...}}。失敗時は None。
+    """
+    try:
+        return _client().generate_presigned_post(
+            Bucket=S3_BUCKET,
+            Key=s3_key,
+            Fields={'Content-Type': content_type},
+            Conditions=[{'Content-Type': content_type}, ['content-length-range', 1, max_bytes]],
+            ExpiresIn=expires
+        )
+    except Exception as e:
+        print("❌ 署名付きPOST生成失敗:", e)
+        return None
+
+def copy_object(src_key: str, dst_key: str, content_type=None):
+    """S3 内コピー（データは Web を通らない）。成功で True"""
+    try:
+        extra = {'ContentType': content_type, 'MetadataDirective': 'REPLACE'} if content_type else {}
+        _client().copy_object(Bucket=S3_BUCKET, Key=dst_key,
+                              CopySource={'Bucket': S3_BUCKET, 'Key': src_key}, **extra)
+        return True
+    except Exception as e:
+        print("❌ S3コピー失敗:", e)
+        return False
+
+def delete_object(s3_key: str):
+    try:
+        _client().delete_object(Bucket=S3_BUCKET, Key=s3_key)
+        return True
+    except Exception as e:
+        print("❌ S3削除失敗:", e)
+        return False
+
+def _pool():
+    global _upload_pool, _upload_pool_pid
+    pid = os.getpid()
+    if _upload_pool is None or _upload_pool_pid != pid:
+        with _client_lock:
+            if _upload_pool is None or _upload_pool_pid != pid:
+                from concurrent.futures import ThreadPoolExecutor
+                _upload_pool = ThreadPoolExecutor(max_workers=S3_UPLOAD_WORKERS,
+                                                  thread_name_prefix='s3-upload')
+                _upload_pool_pid = pid
+    return _upload_pool
+
+def _upload_with_retry(file_path, s3_key, content_type, retries):
+    for attempt in range(retries + 1):
+        try:
+            if upload_to_s3(file_path, s3_key, content_type=content_type, public=False):
+                return s3_key
+        except Exception as e:
+            print(f"❌ S3アップロード例外 ({s3_key}):", repr(e))
+        if attempt < retries:
+            time.sleep(0.5 * (2 ** attempt))
+            print(f"🔁 S3アップロード再試行 {attempt + 1}/{retries}: {s3_key}")
+    print(f"❌ S3アップロード断念: {s3_key}")
+    return None
+
+def upload_batch(items, retries=S3_UPLOAD_RETRIES):
+    """
+    複数ファイルを上限付きスレッドプールで並列に S3 へアップロードする。
+    items: [(file_path, s3_key, content_type), ...]
+    返り値: {s3_key: Future}。Future.result() は成功で s3_key、再試行しても失敗なら None（例外は投げない）。
+    失敗は（待たなかった Future でも）ワーカースレッド側でログに出す。ファイルはアップロードが終わるまで消さないこと。
+    """
+    pool = _pool()
+    futures = {}
+    for file_path, s3_key, content_type in items:
+        # リクエスト単位の API カウンタに数えられるよう、呼び出し元のコンテキストで実行する
+        ctx = contextvars.copy_context()
+        fut = pool.submit(ctx.run, _upload_with_retry, file_path, s3_key, content_type, retries)
+        futures[s3_key] = fut
+    return futures
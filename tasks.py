@@ -1,47 +1,136 @@
 import os
+import json
+import hashlib
+import time
 import redis as real_redis
-from rq import Queue
+from rq import Queue, Retry
 from app_instance import app, db
 from datetime import datetime, timedelta, timezone
-from s3_utils import download_from_s3
-from utils.log_utils import add_action_log
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from s3_utils import download_from_s3, upload_to_s3
 
 # Redis 接続
 redis_url = os.getenv('REDIS_URL')
 if redis_url:
     redis_conn = real_redis.from_url(redis_url)
     q = Queue('default', connection=redis_conn)
+    # MP3 変換は解析と別キュー（リクエスト処理ではエンコードしない）
+    transcode_q = Queue('transcode', connection=redis_conn)
 else:
     redis_conn = None
     q = None
+    transcode_q = None
 
-def enqueue_detailed_analysis(s3_filename, user_id):
+# バッチ解析（ANALYSIS_BATCH_SIZE > 1 で有効）
+ANALYSIS_BATCH_SIZE = int(os.getenv('ANALYSIS_BATCH_SIZE', '1'))
+ANALYSIS_PROCS      = int(os.getenv('ANALYSIS_PROCS', str(os.cpu_count() or 1)))
+ANALYSIS_DOWNLOADS  = int(os.getenv('ANALYSIS_DOWNLOADS', '8'))
+PENDING_KEY = 'analysis:pending'
+RESULT_KEY  = 'analysis:result:{}'
+CLAIM_KEY   = 'analysis:claim:{}'
+# 結果はキューの滞留より長く残す（後から動いたジョブが先行バッチの結果を拾えるように）
+RESULT_TTL  = int(os.getenv('ANALYSIS_RESULT_TTL', str(24 * 3600)))
+# 処理権はバッチ 1 回ぶん。持ち主のワーカーが落ちてもこの秒数で他が引き取れる
+CLAIM_TTL   = int(os.getenv('ANALYSIS_CLAIM_TTL', '900'))
+# 他のバッチが処理中の録音は、待たずにこの間隔でジョブを入れ直す（CLAIM_TTL ぶんは待てる回数）
+RETRY_INTERVAL = int(os.getenv('ANALYSIS_RETRY_INTERVAL', '5'))
+RETRY_MAX      = CLAIM_TTL // max(1, RETRY_INTERVAL) + 1
+
+def enqueue_detailed_analysis(s3_filename, user_id, digest=None):
+    """
+    digest: 正規化WAVの PCM ハッシュ（utils.blob_store の ID）。
+    同じホストのワーカーなら S3 から取り直さずにそれを使い、特徴量キャッシュも読む前に引ける。
+    """
     if not q:
         print("⚠️ Redis 未設定のため詳細解析ジョブをスキップ")
         return None
     print(f"📤 Redis にジョブ登録中: user_id={user_id}, filename={s3_filename}")
-    job = q.enqueue(detailed_worker, s3_filename, user_id, result_ttl=600)
+    if ANALYSIS_BATCH_SIZE > 1:
+        # 保留リストに積み、最初に動いたバッチジョブがまとめて処理する
+        redis_conn.rpush(PENDING_KEY, json.dumps({'s3_key': s3_filename, 'user_id': user_id,
+                                                  'digest': digest}))
+        job = q.enqueue(detailed_batch_worker, s3_filename, user_id, digest, result_ttl=RESULT_TTL,
+                        retry=Retry(max=RETRY_MAX, interval=RETRY_INTERVAL))
+    else:
+        job = q.enqueue(detailed_worker, s3_filename, user_id, digest, result_ttl=RESULT_TTL)
     print(f"✅ Redis 登録完了: job.id={job.id}")
     return job.get_id()
 
 from os.path import basename
 
-def detailed_worker(s3_key, user_id):
+def _action_log(user_id, action):
+    """add_action_log と同じ行を作る（commit はしない）"""
+    from models import ActionLog
+    db.session.add(ActionLog(admin_email=user_id, user_email=user_id, action=action))
+
+def _apply_score(user_id, base, score, fresh_rms):
+    """
+    解析結果を ScoreLog / User に反映する（commit は呼び出し側）。
+    ScoreLog が見つかり上書きしたら True。
+    """
     from models import ScoreLog, User
-    from utils.audio_utils import light_analyze, compute_rms
+    from utils import score_summary
+
+    # ★ ファイル名で特定（時刻差問題を回避）
+    log = (ScoreLog.query
+           .filter(ScoreLog.user_id == user_id,
+                   ScoreLog.filename == base)
+           .order_by(ScoreLog.timestamp.desc())
+           .first())
+
+    user = User.query.get(user_id)
+
+    # raw_rms（集計済み）でベースライン更新
+    user.volume_baseline = 0.8 * (user.volume_baseline or fresh_rms) + 0.2 * fresh_rms
+    user.last_score      = score
+    user.last_recorded   = datetime.now(timezone.utc)
+
+    if not log:
+        _action_log(user_id, f"詳細スコア解析完了（ScoreLog見つからず, score={score}, fn={base}）")
+        print(f"⚠️ ScoreLog not found for user {user_id}, filename {base}")
+        return False
+
+    # スコア更新
+    log.score       = score
+    log.is_fallback = False
+    score_summary.sync(user_id)  # 最新・baseline・きょうのスコアが変わりうる
 
+    _action_log(user_id, f"詳細スコア解析完了（score={score}）")
+    return True
+
+def _score_file(local_path, digest=None):
+    """1 ファイルの解析（ProcessPoolExecutor から呼ぶのでトップレベル関数）"""
+    from utils.audio_utils import analyze_stats, light_analyze
+
+    # RMS と pitch/tempo を 1 パスで集計（ファイルは 1 回だけ読む）
+    stats = analyze_stats(local_path, digest=digest)
+    score, is_fallback = light_analyze(local_path, stats=stats)
+    return score, is_fallback, stats.rms
+
+def _fetch_input(s3_key, local_path, digest=None):
+    """ローカルの blob ストアにあればそれを、無ければ S3 から取る"""
+    from utils import blob_store
+    if blob_store.fetch(digest, local_path):
+        return True
+    return download_from_s3(s3_key, local_path)
+
+def detailed_worker(s3_key, user_id, digest=None):
+    from utils import scratch
     print(f"🚀 detailed_worker START: user_id={user_id}, s3_key={s3_key}")
-    local_path = f"/tmp/{os.path.basename(s3_key)}"
 
-    if not download_from_s3(s3_key, local_path):
-        print(f"❌ S3からのダウンロード失敗: {s3_key}")
-        return {"ok": False, "error": "download_failed", "filename": basename(s3_key)}
+    # 入力はジョブ用の作業ディレクトリへ（解析が終わったら消す）
+    with scratch.workspace("analysis") as ws:
+        local_path = ws.path(s3_key)
+        if not _fetch_input(s3_key, local_path, digest):
+            print(f"❌ S3からのダウンロード失敗: {s3_key}")
+            return {"ok": False, "error": "download_failed", "filename": basename(s3_key)}
 
-    try:
-        score, is_fallback = light_analyze(local_path)
-    except Exception as e:
-        print(f"❌ analyze error: {e}")
-        return {"ok": False, "error": "analyze_failed", "filename": basename(s3_key)}
+        try:
+            score, is_fallback, fresh_rms = _score_file(local_path, digest)
+        except Exception as e:
+            print(f"❌ analyze error: {e}")
+            return {"ok": False, "error": "analyze_failed", "filename": basename(s3_key)}
     print(f"🎯 analyze result = score={score}, is_fallback={is_fallback}")
 
     if is_fallback:
@@ -50,32 +139,295 @@ def detailed_worker(s3_key, user_id):
 
     with app.app_context():
         base = basename(s3_key)  # ← ScoreLog.filename は basename で保存している
-        # ★ ファイル名で特定（時刻差問題を回避）
-        log = (ScoreLog.query
-               .filter(ScoreLog.user_id == user_id,
-                       ScoreLog.filename == base)
-               .order_by(ScoreLog.timestamp.desc())
-               .first())
-
-        user = User.query.get(user_id)
-
-        # raw_rms 再計算＆ベースライン更新
-        fresh_rms = compute_rms(local_path)
-        user.volume_baseline = 0.8 * (user.volume_baseline or fresh_rms) + 0.2 * fresh_rms
-        user.last_score      = score
-        user.last_recorded   = datetime.now(timezone.utc)
-
-        if not log:
-            add_action_log(user_id, f"詳細スコア解析完了（ScoreLog見つからず, score={score}, fn={base}）")
+        updated = _apply_score(user_id, base, score, fresh_rms)
+        db.session.commit()
+        if updated:
+            print(f"✅ 詳細解析＆上書き完了 for user {user_id}, score={score}, fn={base}")
+        return {"ok": True, "score": score, "filename": base, "updated": updated}
+
+# ────────── バッチ解析 ──────────
+class AnalysisPending(Exception):
+    """他のバッチが処理中。RQ の Retry でジョブごと入れ直す（ワーカーを待たせない）"""
+
+_pool = None
+_pool_pid = None
+
+def _analysis_pool():
+    """
+    解析用のプロセスプール（ワーカープロセスごとに 1 つを使い回す）。
+    バッチのたびに作ると、毎回 ANALYSIS_PROCS 個の fork と後片付けが走る。
+    fork 後の子や、子が落ちて壊れたプールは作り直す。
+    """
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid() or getattr(_pool, '_broken', False):
+        _pool = ProcessPoolExecutor(max_workers=max(1, ANALYSIS_PROCS))
+        _pool_pid = os.getpid()
+    return _pool
+
+def _drain_pending(limit):
+    """保留リストから最大 limit 件を原子的に取り出す"""
+    pipe = redis_conn.pipeline(transaction=True)
+    pipe.lrange(PENDING_KEY, 0, limit - 1)
+    pipe.ltrim(PENDING_KEY, limit, -1)
+    raw, _ = pipe.execute()
+    items = []
+    for r in raw:
+        try:
+            items.append(json.loads(r))
+        except ValueError:
+            pass
+    return items
+
+def run_analysis_batch(items):
+    """
+    items: [{'s3_key': ..., 'user_id': ...}, ...]
+    並列ダウンロード → プロセスプールで解析 → ScoreLog 更新を 1 トランザクションで commit。
+    返り値: {s3_key: 結果 dict}
+    """
+    from utils import scratch
+    with scratch.workspace("batch") as ws:
+        return _run_analysis_batch(items, ws)
+
+def _run_analysis_batch(items, ws):
+    started = time.monotonic()
+    results = {}
+
+    # 1) ダウンロード（I/O 待ちなのでスレッド）。入力はバッチ用の作業ディレクトリへ
+    def _download(item):
+        local_path = ws.path(item['s3_key'])
+        return item, local_path, _fetch_input(item['s3_key'], local_path, item.get('digest'))
+
+    ready = []
+    with ThreadPoolExecutor(max_workers=max(1, min(ANALYSIS_DOWNLOADS, len(items)))) as pool:
+        for item, local_path, ok in pool.map(_download, items):
+            if ok:
+                ready.append((item, local_path))
+            else:
+                print(f"❌ S3からのダウンロード失敗: {item['s3_key']}")
+                results[item['s3_key']] = {"ok": False, "error": "download_failed",
+                                           "filename": basename(item['s3_key'])}
+    t_download = time.monotonic() - started
+
+    # 2) 解析（CPU バウンドなのでプロセス）
+    scored = []
+    if ready:
+        pool = _analysis_pool()
+        futures = [(item, pool.submit(_score_file, path, item.get('digest'))) for item, path in ready]
+        for item, fut in futures:
+            try:
+                scored.append((item, fut.result()))
+            except Exception as e:
+                if isinstance(e, BrokenProcessPool):
+                    print("⚠️ analysis pool が壊れました（次のバッチで作り直します）")
+                print(f"❌ analyze error: {item['s3_key']}: {e}")
+                results[item['s3_key']] = {"ok": False, "error": "analyze_failed",
+                                           "filename": basename(item['s3_key'])}
+    t_analyze = time.monotonic() - started - t_download
+
+    # 3) DB 反映（1 トランザクション）
+    with app.app_context():
+        try:
+            for item, (score, is_fallback, fresh_rms) in scored:
+                base = basename(item['s3_key'])
+                if is_fallback:
+                    results[item['s3_key']] = {"ok": True, "score": score, "filename": base, "updated": False}
+                    continue
+                updated = _apply_score(item['user_id'], base, score, fresh_rms)
+                results[item['s3_key']] = {"ok": True, "score": score, "filename": base, "updated": updated}
             db.session.commit()
-            print(f"⚠️ ScoreLog not found for user {user_id}, filename {base}")
-            return {"ok": True, "score": score, "filename": base, "updated": False}
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ batch commit failed: {e}")
+            for item, _ in scored:
+                results[item['s3_key']] = {"ok": False, "error": "commit_failed",
+                                           "filename": basename(item['s3_key'])}
 
-        # スコア更新
-        log.score       = score
-        log.is_fallback = False
+    elapsed = time.monotonic() - started
+    batch = {
+        "size": len(items),
+        "ok": sum(1 for r in results.values() if r.get("ok")),
+        "seconds": round(elapsed, 3),
+        "download_s": round(t_download, 3),
+        "analyze_s": round(t_analyze, 3),
+        "files_per_sec": round(len(items) / elapsed, 2) if elapsed > 0 else None,
+    }
+    print(f"📦 batch 完了: size={batch['size']} ok={batch['ok']} {batch['seconds']}s "
+          f"(download={batch['download_s']}s analyze={batch['analyze_s']}s) "
+          f"{batch['files_per_sec']} files/s")
+    for r in results.values():
+        r["batch"] = batch
+    return results
 
-        add_action_log(user_id, f"詳細スコア解析完了（score={score}）")
-        db.session.commit()
-        print(f"✅ 詳細解析＆上書き完了 for user {user_id}, score={score}, fn={base}")
-        return {"ok": True, "score": score, "filename": base, "updated": True}
+def _claim(s3_key):
+    """同じ録音を 2 つのバッチが処理しないよう、処理権を取る"""
+    return bool(redis_conn.set(CLAIM_KEY.format(s3_key), os.getpid(), nx=True, ex=CLAIM_TTL))
+
+def detailed_batch_worker(s3_key, user_id, digest=None):
+    """
+    enqueue_detailed_analysis が 1 録音ごとに積むジョブ。
+    保留中の解析を最大 ANALYSIS_BATCH_SIZE 件まとめて処理し、自分の録音の結果を返す
+    （job_status / upload_result は従来と同じ形の dict を受け取る）。
+    自分の録音を他のバッチが処理中なら AnalysisPending を投げ、RQ の Retry で
+    RETRY_INTERVAL 秒後に同じジョブ ID のまま入れ直される（その間クライアントには pending に見える）。
+    """
+    done = redis_conn.get(RESULT_KEY.format(s3_key))
+    if done:
+        return json.loads(done)  # 先行バッチで処理済み
+
+    own = _claim(s3_key)
+    batch = [{'s3_key': s3_key, 'user_id': user_id, 'digest': digest}] if own else []
+    for it in _drain_pending(ANALYSIS_BATCH_SIZE):
+        if it['s3_key'] != s3_key and _claim(it['s3_key']):
+            batch.append(it)
+
+    if batch:
+        results = run_analysis_batch(batch)
+        pipe = redis_conn.pipeline()
+        for key, res in results.items():
+            pipe.set(RESULT_KEY.format(key), json.dumps(res), ex=RESULT_TTL)
+        pipe.execute()
+        if own:
+            return results[s3_key]
+
+    done = redis_conn.get(RESULT_KEY.format(s3_key))
+    if done:
+        return json.loads(done)
+    raise AnalysisPending(f"{s3_key} は他のバッチが処理中")
+
+# ────────── MP3 変換ジョブ ──────────
+
+def enqueue_transcode(src_key, dst_key, bitrate='128k', job_id=None):
+    """
+    S3 の src_key を MP3 にして dst_key へ置くジョブを transcode キューに積む。job_id を返す。
+    job_id: DerivedAsset に先に書いておいた ID（utils.derived_assets.request_build）
+    """
+    if not transcode_q:
+        print(f"⚠️ Redis 未設定のため MP3 変換をスキップ: {src_key}")
+        return None
+    job = transcode_q.enqueue(transcode_worker, src_key, dst_key, bitrate,
+                              job_id=job_id, result_ttl=86400, failure_ttl=86400)
+    print(f"📤 MP3 変換ジョブ登録: {src_key} → {dst_key} job.id={job.id}")
+    return job.get_id()
+
+def _mark_asset(dst_key, status, error=None, job_id=None):
+    """DerivedAsset マーカーがこのジョブのものなら結果を反映（再生時の on-demand 変換用）"""
+    from utils import derived_assets
+    try:
+        with app.app_context():
+            if not derived_assets.mark(dst_key, status, error, job_id=job_id):
+                print(f"⚠️ derived asset は別のジョブに置き換え済み: {dst_key} job={job_id}")
+    except Exception as e:
+        print(f"⚠️ derived asset mark failed: {dst_key}: {e}")
+
+def _asset_current(dst_key, job_id):
+    """アップロード直前の確認。上書きで古くなったジョブなら False（確認できなければ True）"""
+    from utils import derived_assets
+    try:
+        with app.app_context():
+            return derived_assets.current(dst_key, job_id)
+    except Exception as e:
+        print(f"⚠️ derived asset check failed: {dst_key}: {e}")
+        return True
+
+def transcode_worker(src_key, dst_key, bitrate='128k'):
+    from rq import get_current_job
+    from utils import scratch
+    from utils.audio_utils import export_mp3
+
+    job = get_current_job()
+    job_id = job.id if job else None
+    started = time.monotonic()
+    # 入力・MP3 はジョブ用の作業ディレクトリへ（終わったら消える）
+    with scratch.workspace("transcode") as ws:
+        stem = basename(dst_key).rsplit('.', 1)[0]
+        local_in = ws.path(stem + os.path.splitext(src_key)[1])
+        local_mp3 = ws.path(stem + '.mp3')
+        if not download_from_s3(src_key, local_in):
+            _mark_asset(dst_key, 'failed', 'download_failed', job_id)
+            return {"ok": False, "error": "download_failed", "key": dst_key}
+        try:
+            export_mp3(local_in, local_mp3, bitrate=bitrate)
+        except Exception as e:
+            print(f"❌ MP3 変換失敗: {src_key}: {e}")
+            _mark_asset(dst_key, 'failed', f'encode_failed: {e}', job_id)
+            return {"ok": False, "error": "encode_failed", "key": dst_key}
+        if not _asset_current(dst_key, job_id):
+            # 変換中に元音声が上書きされた。古い MP3 で新しいジョブの結果を潰さない
+            print(f"⏭️ MP3 変換を破棄（元音声が更新済み）: {dst_key}")
+            return {"ok": False, "error": "superseded", "key": dst_key}
+        if not upload_to_s3(local_mp3, dst_key, content_type='audio/mpeg', public=False):
+            _mark_asset(dst_key, 'failed', 'upload_failed', job_id)
+            return {"ok": False, "error": "upload_failed", "key": dst_key}
+    _mark_asset(dst_key, 'ready', job_id=job_id)
+    elapsed = round(time.monotonic() - started, 3)
+    print(f"✅ MP3 変換完了: {dst_key} ({elapsed}s)")
+    return {"ok": True, "key": dst_key, "seconds": elapsed}
+
+# ────────── 直接アップロード（/api/upload/complete）後の処理 ──────────
+RECORDING_JOB_KEY = 'upload:recording:{}'
+
+def recording_job_id(raw_key):
+    """raw_key ごとに決まるジョブ ID（同じアップロードの complete を何度送っても 1 ジョブ）"""
+    return 'rec-' + hashlib.sha1(raw_key.encode()).hexdigest()
+
+def enqueue_recording_processing(raw_key, user_id, recorded_at, overwrite=False):
+    """
+    録音処理ジョブを積んで job_id を返す。同じ raw_key で既に積んでいれば積まずにその job_id を返す
+    （アップロードトークンの再送で二重にスコアを登録しない）。
+    """
+    if not q:
+        print("⚠️ Redis 未設定のため録音処理ジョブをスキップ")
+        return None
+    job_id = recording_job_id(raw_key)
+    # トークンの有効期限（UPLOAD_PRESIGN_TTL + 1h）より長く覚えておく
+    if not redis_conn.set(RECORDING_JOB_KEY.format(raw_key), job_id, nx=True, ex=RESULT_TTL):
+        print(f"⏭️ 録音処理ジョブは登録済み: {raw_key} job.id={job_id}")
+        return job_id
+    try:
+        job = q.enqueue(process_uploaded_recording, raw_key, user_id, recorded_at, overwrite,
+                        job_id=job_id, result_ttl=RESULT_TTL)
+    except Exception:
+        redis_conn.delete(RECORDING_JOB_KEY.format(raw_key))  # 積めなかったら再送でやり直せるように
+        raise
+    print(f"📤 録音処理ジョブ登録: {raw_key} job.id={job.id}")
+    return job.get_id()
+
+def process_uploaded_recording(raw_key, user_id, recorded_at, overwrite=False):
+    """
+    S3 に直接アップロードされた録音（raw/…）を、/api/upload と同じ手順で処理する：
+    デコード → 正規化WAV（S3 normalized/…）→ 軽量スコアで ScoreLog 登録 → 詳細解析ジョブ。
+    返り値は upload_result で読む（score は軽量スコア、job_id は詳細解析ジョブ）。
+    """
+    from utils.audio_utils import AudioPipeline
+    from utils import blob_store, recordings, scratch
+
+    print(f"🚀 process_uploaded_recording START: user_id={user_id}, key={raw_key}")
+    filename = basename(raw_key)
+    # 入力・正規化WAVはジョブ用の作業ディレクトリへ（終わったら消える）
+    with scratch.workspace("recording") as ws:
+        local_raw = ws.path(filename)
+        if not download_from_s3(raw_key, local_raw):
+            return {"ok": False, "error": "download_failed", "filename": filename}
+
+        pipeline = AudioPipeline.decode(local_raw)
+        if pipeline is None or pipeline.duration < 1.5:
+            return {"ok": False, "error": "too_short", "filename": filename}
+
+        normalized_filename = filename.rsplit('.', 1)[0] + "_normalized.wav"
+        normalized_path = ws.path(normalized_filename)
+        pipeline.write_wav(normalized_path, normalized=True)
+        s3_norm_key = f"normalized/{normalized_filename}"
+        if not upload_to_s3(normalized_path, s3_norm_key, content_type="audio/wav"):
+            return {"ok": False, "error": "upload_failed", "filename": filename}
+        # 詳細解析はこのホストなら S3 を読まない
+        digest = blob_store.put(normalized_path, pipeline.wav_digest(normalized=True))
+
+        with app.app_context():
+            quick_score, _ = recordings.quick_score(pipeline, user_id)
+            recordings.save(user_id, datetime.fromisoformat(recorded_at), quick_score, pipeline.raw_rms,
+                            normalized_filename, overwrite=overwrite)
+
+    detail_job_id = enqueue_detailed_analysis(s3_norm_key, user_id, digest)
+    print(f"✅ process_uploaded_recording 完了: user_id={user_id}, quick_score={quick_score}")
+    return {"ok": True, "score": quick_score, "quick_score": quick_score,
+            "filename": normalized_filename, "job_id": detail_job_id, "updated": False}
@@ -0,0 +1,13 @@
+# transcoder.py
+# ホスト内共有のトランスコードサービスを起動する（gunicorn / RQ ワーカーと同じホストで 1 プロセス）
+#   python transcoder.py
+# Web / ワーカー側は TRANSCODER_SOCKET に同じソケットパスを設定すると自動で利用する。
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.transcode_service import TranscodeServer
+
+if __name__ == '__main__':
+    TranscodeServer().serve_forever()
@@ -1,48 +1,173 @@
 # utils/audio_utils.py
 
+import os
 import soundfile as sf
 import numpy as np
-import gc
+from utils import transcode_service, feature_cache
 
-def compute_rms(path):
-    """
-    生データの RMS を返す（正規化前の特徴量）。
-    """
-    data, _ = sf.read(path, dtype='float32')
-    return float(np.std(data))
+# 解析ロジックを変えたら上げる（特徴量キャッシュのキーに含まれる）
+STATS_VERSION = 1
 
-
-def light_analyze(wav_path, raw_rms=None, rms_baseline=None,
-                  target_sr=16000, chunk_sec=1.0):
-    # 1) 音量スコア
+def _volume_score(raw_rms=None, rms_baseline=None):
     abs_score = np.clip(raw_rms * 300, 0, 100) if raw_rms else 50
     if raw_rms and rms_baseline:
         rel = (raw_rms - rms_baseline) / rms_baseline
         rel_score = np.clip(1+rel, 0.5, 1.5) * 50
     else:
         rel_score = 50
-    vol_score = 0.5 * abs_score + 0.5 * rel_score
+    return 0.5 * abs_score + 0.5 * rel_score
 
-    # 2) pitch/tempo
-    total_pitch, total_tempo, chunks = 0.0, 0.0, 0
-    with sf.SoundFile(wav_path) as f:
-        orig_sr = f.samplerate
-        blocksize = int(orig_sr * chunk_sec)
-        for block in f.blocks(blocksize=blocksize, dtype='float32'):
+
+# 1ストライプ = 60 ブロック（1ブロック 1 秒なら 60 秒ぶん）をまとめて処理
+LIGHT_STRIPE_BLOCKS = 60
+
+
+def _interp_rows(frames, n_new):
+    """
+    各行に np.interp(linspace(0,1,n_new), linspace(0,1,n_old), row) を一括適用。
+    np.interp と同じ式・同じ分岐で計算するので結果はビット単位で一致する。
+    """
+    n_old = frames.shape[1]
+    xp = np.linspace(0, 1, n_old)
+    x = np.linspace(0, 1, n_new)
+    fp = frames.astype(np.float64)
+    if n_old < 2:
+        return np.repeat(fp[:, :1], n_new, axis=1)
+
+    j = np.clip(np.searchsorted(xp, x, side='right') - 1, 0, n_old - 2)
+    y0 = fp[:, j]
+    slope = (fp[:, j + 1] - y0) / (xp[j + 1] - xp[j])
+    out = slope * (x - xp[j]) + y0
+    exact = x == xp[j]
+    out[:, exact] = y0[:, exact]
+    out[:, x >= xp[-1]] = fp[:, -1:]
+    return out
+
+
+def _light_rows(frames, orig_sr, target_sr):
+    """(ブロック数, ブロック長) の行列から、ブロックごとの zc / voiced を一括計算"""
+    if orig_sr != target_sr:
+        frames = _interp_rows(frames, int(frames.shape[1]*target_sr/orig_sr))
+    zcs = np.mean(np.abs(np.diff(np.sign(frames), axis=1)), axis=1)
+    absf = np.abs(frames)
+    # しきい値はブロック単位のスカラー演算と同じ型規則で作る（比較結果を一致させるため）
+    thr = np.array([m * 0.02 for m in np.max(absf, axis=1)]).astype(absf.dtype)
+    voiced = np.mean(absf > thr[:, None], axis=1)
+    return zcs, voiced
+
+
+def _light_stripe_stats(stripe, blocksize, orig_sr, target_sr):
+    """
+    stripe を blocksize ごとの行に並べ替えて（コピーなしの reshape）一括処理。
+    端数は最後のストライプにしか出ないので、従来の f.blocks() と同じブロック境界になる。
+    """
+    if stripe.ndim > 1:
+        # 多チャンネルは従来どおりブロック単位（np.diff は最終軸＝チャンネル方向）
+        for i in range(0, len(stripe), blocksize):
+            block = stripe[i:i + blocksize]
             if orig_sr != target_sr:
                 x_old = np.linspace(0,1,len(block))
                 x_new = np.linspace(0,1,int(len(block)*target_sr/orig_sr))
                 block = np.interp(x_new, x_old, block)
-            zc = np.mean(np.abs(np.diff(np.sign(block))))
-            total_pitch += zc * 150                 # ← 強めに
-            threshold = np.max(np.abs(block)) * 0.02
-            voiced = np.mean(np.abs(block) > threshold)
-            total_tempo += voiced * 200             # ← 強めに
-            chunks += 1
-            del block; gc.collect()
+            yield (np.mean(np.abs(np.diff(np.sign(block)))),
+                   np.mean(np.abs(block) > np.max(np.abs(block)) * 0.02))
+        return
+
+    n_full = len(stripe) // blocksize
+    parts = []
+    if n_full:
+        parts.append(stripe[:n_full * blocksize].reshape(n_full, blocksize))
+    if len(stripe) > n_full * blocksize:
+        parts.append(stripe[n_full * blocksize:][None, :])
+    for frames in parts:
+        zcs, voiced = _light_rows(frames, orig_sr, target_sr)
+        yield from zip(zcs, voiced)
+
+
+class StreamingStats:
+    """
+    1 パス・固定メモリ（ストライプ 1 本分）で集計する音声統計。
+      - RMS: Welford / Chan の分散合成（np.std と同じ母標準偏差）
+      - pitch / tempo 代理値: ブロックごとの ZCR と有声率（light_analyze と同じ定義）
+    compute_rms と light_analyze が同じファイルを 2 回読まないよう、両方をここで出す。
+    """
+
+    def __init__(self, samplerate, blocksize, target_sr=16000, with_light=True):
+        self.samplerate = samplerate
+        self.blocksize = blocksize
+        self.target_sr = target_sr
+        self.with_light = with_light
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.total_pitch = 0.0
+        self.total_tempo = 0.0
+        self.chunks = 0
+
+    def update(self, stripe):
+        x = np.asarray(stripe).reshape(-1).astype(np.float64)
+        if x.size:
+            n_b = x.size
+            mean_b = float(x.mean())
+            m2_b = float(np.square(x - mean_b).sum())
+            n = self.n + n_b
+            delta = mean_b - self.mean
+            self.mean += delta * n_b / n
+            self.m2 += m2_b + delta * delta * self.n * n_b / n
+            self.n = n
+
+        if self.with_light:
+            # 加算順は従来のブロック逐次と同じ
+            for zc, voiced in _light_stripe_stats(stripe, self.blocksize,
+                                                  self.samplerate, self.target_sr):
+                self.total_pitch += zc * 150                 # ← 強めに
+                self.total_tempo += voiced * 200             # ← 強めに
+                self.chunks += 1
+        return self
+
+    @property
+    def rms(self):
+        return float(np.sqrt(self.m2 / self.n)) if self.n else 0.0
+
+    # ---------- 特徴量キャッシュ用 ----------
+    def to_dict(self):
+        # 合計値は型ごと保存（float32 のまま復元しないとスコア計算の丸めが変わる）
+        return {
+            "samplerate": self.samplerate, "blocksize": self.blocksize,
+            "target_sr": self.target_sr, "with_light": self.with_light,
+            "n": self.n, "mean": self.mean, "m2": self.m2, "chunks": self.chunks,
+            "total_pitch": [float(self.total_pitch), np.asarray(self.total_pitch).dtype.str],
+            "total_tempo": [float(self.total_tempo), np.asarray(self.total_tempo).dtype.str],
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        st = cls(d["samplerate"], d["blocksize"], d["target_sr"], with_light=d["with_light"])
+        st.n, st.mean, st.m2, st.chunks = d["n"], d["mean"], d["m2"], d["chunks"]
+        st.total_pitch = np.dtype(d["total_pitch"][1]).type(d["total_pitch"][0])
+        st.total_tempo = np.dtype(d["total_tempo"][1]).type(d["total_tempo"][0])
+        return st
+
+    @property
+    def pitch_score(self):
+        return self.total_pitch/self.chunks if self.chunks else 50
 
-    pitch_score = total_pitch/chunks if chunks else 50
-    tempo_score = total_tempo/chunks if chunks else 50
+    @property
+    def tempo_score(self):
+        return self.total_tempo/self.chunks if self.chunks else 50
+
+
+def _light_score(stats, raw_rms=None, rms_baseline=None):
+    """
+    集計済みの StreamingStats から軽量スコアを計算する共通部。
+    ファイル版（light_analyze）とバッファ版（AudioPipeline）で共有。
+    """
+    # 1) 音量スコア
+    vol_score = _volume_score(raw_rms, rms_baseline)
+
+    # 2) pitch/tempo
+    pitch_score = stats.pitch_score
+    tempo_score = stats.tempo_score
 
     # 3) 合成＆クランプ
     raw_score = 0.3*vol_score + 0.4*pitch_score + 0.3*tempo_score
@@ -51,11 +176,310 @@ def light_analyze(wav_path, raw_rms=None, rms_baseline=None,
     print(f"⚙️ light_analyze: vol={vol_score:.1f}, pitch={pitch_score:.1f}, "
           f"tempo={tempo_score:.1f} → raw={raw_score:.1f} → score={score}")
     return score, False
+
+
+def _file_stripes(f, blocksize, hasher=None):
+    """
+    ストライプ（float32）を順に返す。hasher があれば読んだ PCM をそのまま流し込む
+    （PCM16 は int16 で読んでハッシュし、float32 には /32768 で直す＝sf の float32 読みと同じ値）。
+    """
+    dtype = feature_cache.file_pcm_dtype(f) if hasher is not None else 'float32'
+    while True:
+        stripe = f.read(frames=blocksize * LIGHT_STRIPE_BLOCKS, dtype=dtype)
+        if not len(stripe):
+            break
+        if hasher is not None:
+            hasher.update(np.ascontiguousarray(stripe).tobytes())
+        if stripe.dtype != np.float32:
+            stripe = stripe.astype(np.float32) / np.float32(32768.0)
+        yield stripe
+
+
+def analyze_stats(path, target_sr=16000, chunk_sec=1.0, with_light=True, digest=None):
+    """
+    ファイルを 1 回だけストリーミングで読み、RMS と pitch/tempo 代理値をまとめて返す。
+    upload / detailed_worker はこれを 1 回呼んで compute_rms・light_analyze の両方に使う。
+    digest: ファイルの PCM ハッシュ（blob ストアの ID = AudioPipeline.wav_digest）が分かっていれば渡す。読む前にキャッシュを引ける。
+    """
+    params = dict(target_sr=target_sr, chunk_sec=chunk_sec, with_light=with_light)
+    hasher = None
+    if feature_cache.ENABLED:
+        # 読む前に分かるキー（渡された PCM ハッシュ／以前読んだ同じファイルの PCM ハッシュ）だけ引く
+        for known in (digest, feature_cache.file_alias(path)):
+            if known:
+                hit = feature_cache.get(feature_cache.make_key("stats", STATS_VERSION, known, **params))
+                if hit is not None:
+                    return StreamingStats.from_dict(hit)
+
+    with sf.SoundFile(path) as f:
+        blocksize = int(f.samplerate * chunk_sec)
+        stats = StreamingStats(f.samplerate, blocksize, target_sr, with_light=with_light)
+        if feature_cache.ENABLED:
+            hasher = feature_cache.pcm_hasher(f.samplerate, f.channels, feature_cache.file_pcm_dtype(f))
+        for stripe in _file_stripes(f, blocksize, hasher):
+            stats.update(stripe)
+
+    if hasher is not None:
+        # 解析と同じパスで取った PCM ハッシュで保存（AudioPipeline.stats と同じキー）
+        pcm = hasher.hexdigest()
+        value = stats.to_dict()
+        feature_cache.put(feature_cache.make_key("stats", STATS_VERSION, pcm, **params), value)
+        feature_cache.remember_alias(path, pcm)
+    return stats
+
+
+def compute_rms(path):
+    """
+    生データの RMS を返す（正規化前の特徴量）。
+    """
+    return analyze_stats(path, with_light=False).rms
+
+
+def light_analyze(wav_path, raw_rms=None, rms_baseline=None,
+                  target_sr=16000, chunk_sec=1.0, stats=None):
+    # 集計済みの stats があればファイルを読み直さない
+    if stats is None:
+        stats = analyze_stats(wav_path, target_sr=target_sr, chunk_sec=chunk_sec)
+    return _light_score(stats, raw_rms=raw_rms, rms_baseline=rms_baseline)
+
+
+# ────────── 1回デコードのパイプライン ──────────
+PIPELINE_SR = 16000
+
+
+def _ffmpeg_exe():
+    # pydub と同じ imageio-ffmpeg 同梱バイナリを優先（無ければ PATH 上の ffmpeg）
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return 'ffmpeg'
+
+
+def _audio_segment():
+    """pydub は初回利用時に import し、app.py でしていた converter 設定もここで行う"""
+    from pydub import AudioSegment
+    AudioSegment.converter = _ffmpeg_exe()
+    return AudioSegment
+
+
+def pcm_dbfs(samples):
+    """
+    pydub の AudioSegment.dBFS と同じ定義（int16 の整数 RMS / 32768）。
+    無音なら -inf。
+    """
+    if samples.size == 0:
+        return float('-inf')
+    rms = int(np.sqrt(np.mean(np.square(samples, dtype=np.float64))))
+    if rms == 0:
+        return float('-inf')
+    return 20 * np.log10(rms / 32768.0)
+
+
+def peak_dbfs(samples):
+    """pydub の AudioSegment.max_dBFS と同じ（int16 の最大振幅 / 32768）。無音なら -inf。"""
+    if samples.size == 0:
+        return float('-inf')
+    peak = int(np.max(np.abs(samples.astype(np.int32))))
+    if peak == 0:
+        return float('-inf')
+    return 20 * np.log10(peak / 32768.0)
+
+
+def apply_gain_pcm(samples, gain_db):
+    """
+    pydub の apply_gain（audioop.mul）と同じく、倍率を掛けて int16 範囲に飽和＋切り捨て。
+    """
+    factor = 10 ** (gain_db / 20.0)
+    out = np.floor(np.clip(samples.astype(np.float64) * factor, -32768, 32767))
+    return out.astype(np.int16)
+
+
+def normalize_pcm(samples, target_dBFS=-3.0, mode="rms", max_peak_dBFS=None):
+    """
+    int16 PCM をメモリ上で音量正規化する。返り値: (正規化後の int16, 掛けたゲイン dB)
+      mode="rms"  : 平均音量（pydub の dBFS）を target_dBFS に合わせる（従来の normalize_volume と同じ）
+      mode="peak" : 最大振幅を target_dBFS に合わせる
+    max_peak_dBFS を指定すると、ピークがそれを超えないようゲインを抑える（クリップ防止）。
+    指定しなければ従来どおり int16 範囲で飽和させる。無音はゲイン 0。
+    """
+    samples = np.asarray(samples, dtype=np.int16)
+    level = pcm_dbfs(samples) if mode == "rms" else peak_dbfs(samples)
+    if not np.isfinite(level):
+        return samples.copy(), 0.0
+    gain = target_dBFS - level
+    if max_peak_dBFS is not None:
+        gain = min(gain, max_peak_dBFS - peak_dbfs(samples))
+    return apply_gain_pcm(samples, gain), gain
+
+
+class AudioPipeline:
+    """
+    アップロード音声を 1 回だけデコードし（16kHz / mono / int16）、
+    同じバッファから RMS・正規化ゲイン・軽量スコア・WAV/MP3 出力をまとめて作る。
+
+    以前は ffmpeg 変換 → コピー → pydub 正規化 → sf.read(RMS) → sf.read(light_analyze)
+    → pydub MP3 と、同じ録音を何度も読み直していた。
+    """
+
+    def __init__(self, samples, sr=PIPELINE_SR, target_dBFS=-3.0, source_path=None):
+        self.samples = np.asarray(samples, dtype=np.int16)
+        self.sr = sr
+        self.target_dBFS = target_dBFS
+        # 16kHz mono 以外の WAV のときの元ファイル。RMS・軽量スコア・正規化は従来どおり元ファイルから出す
+        # （元のレートで RMS を取り、元のレートでゲイン → 16kHz mono の順。変えると既存の baseline とずれる）
+        self.source_path = source_path
+        self._float = None
+        self._normalized = None
+        self._stats = None
+        self._wav_digest = {}
+
+    # ---------- デコード ----------
+    @classmethod
+    def decode(cls, input_path, sr=PIPELINE_SR, **kwargs):
+        """
+        入力（m4a/webm/wav）を 16kHz mono int16 にデコード。失敗時は None。
+        すでに 16kHz mono PCM16 の WAV なら ffmpeg を起動せず soundfile で読む。
+        """
+        try:
+            info = sf.info(input_path)
+            if (info.format == 'WAV' and info.subtype == 'PCM_16'
+                    and info.samplerate == sr and info.channels == 1):
+                data, _ = sf.read(input_path, dtype='int16')
+                return cls(data, sr, **kwargs)
+            if info.format == 'WAV':
+                kwargs.setdefault('source_path', input_path)
+        except Exception:
+            pass  # WAV 以外（m4a/webm）は ffmpeg へ
+
+        # 常駐トランスコーダがあればそちらでデコード（プロセス起動なし）
+        pcm = transcode_service.decode_pcm(input_path, sr)
+        if pcm is not None:
+            return cls(pcm, sr, **kwargs)
+
+        import subprocess
+        cmd = [
+            _ffmpeg_exe(), '-nostdin', '-y', '-i', input_path,
+            '-acodec', 'pcm_s16le', '-ac', '1', '-ar', str(sr),
+            '-f', 's16le', 'pipe:1'
+        ]
+        res = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if res.returncode != 0:
+            print(f"❌ decode failed: {res.stderr[-300:]!r}")
+            return None
+        return cls(np.frombuffer(res.stdout, dtype='<i2'), sr, **kwargs)
+
+    # ---------- 派生値（遅延計算＆キャッシュ） ----------
+    @property
+    def duration(self):
+        return self.samples.size / float(self.sr)
+
+    @property
+    def pcm_float(self):
+        """sf.read(dtype='float32') と同じスケール（int16 / 32768）"""
+        if self._float is None:
+            self._float = self.samples.astype(np.float32) / np.float32(32768.0)
+        return self._float
+
+    def stats(self, target_sr=16000, chunk_sec=1.0):
+        """analyze_stats と同じ集計をバッファに対して 1 回だけ行う"""
+        key = (target_sr, chunk_sec)
+        if self.source_path and (self._stats is None or self._stats[0] != key):
+            # 元の WAV（元のレート・チャンネル）で集計する＝従来の compute_rms / light_analyze と同じ
+            self._stats = (key, analyze_stats(self.source_path, target_sr=target_sr, chunk_sec=chunk_sec))
+        if self._stats is None or self._stats[0] != key:
+            cache_key = None
+            st = None
+            if feature_cache.ENABLED:
+                # analyze_stats(ファイル) と同じキー（同じ PCM なら同じハッシュ）
+                cache_key = feature_cache.make_key(
+                    "stats", STATS_VERSION, feature_cache.pcm_digest(self.samples, self.sr),
+                    target_sr=target_sr, chunk_sec=chunk_sec, with_light=True)
+                hit = feature_cache.get(cache_key)
+                if hit is not None:
+                    st = StreamingStats.from_dict(hit)
+            if st is None:
+                blocksize = int(self.sr * chunk_sec)
+                st = StreamingStats(self.sr, blocksize, target_sr)
+                for stripe in self.iter_stripes(blocksize):
+                    st.update(stripe)
+                if cache_key is not None:
+                    feature_cache.put(cache_key, st.to_dict())
+            self._stats = (key, st)
+        return self._stats[1]
+
+    @property
+    def raw_rms(self):
+        """compute_rms と同じ（正規化前の std）"""
+        return self.stats().rms
+
+    @property
+    def gain_db(self):
+        dbfs = pcm_dbfs(self.samples)
+        return 0.0 if not np.isfinite(dbfs) else self.target_dBFS - dbfs
+
+    @property
+    def normalized(self):
+        """normalize_volume と同じ出力サンプル（int16）"""
+        if self._normalized is None:
+            if self.source_path:
+                # 元のレートでゲイン → 飽和 → 16kHz mono（従来の normalize_volume と同じ順序）
+                self._normalized = normalize_volume(self.source_path, target_dBFS=self.target_dBFS)
+            else:
+                self._normalized, _ = normalize_pcm(self.samples, self.target_dBFS)
+        return self._normalized
+
+    # ---------- 解析 ----------
+    def iter_stripes(self, blocksize):
+        x = self.pcm_float
+        step = blocksize * LIGHT_STRIPE_BLOCKS
+        for i in range(0, x.size, step):
+            yield x[i:i + step]
+
+    def light_analyze(self, raw_rms=None, rms_baseline=None, target_sr=16000, chunk_sec=1.0):
+        return _light_score(self.stats(target_sr, chunk_sec),
+                            raw_rms=raw_rms, rms_baseline=rms_baseline)
+
+    # ---------- 出力 ----------
+    def write_wav(self, path, normalized=False):
+        data = self.normalized if normalized else self.samples
+        sf.write(path, data, self.sr, subtype='PCM_16', format='WAV')
+        # 書いた PCM のハッシュ（= feature_cache.file_digest(path)。ファイルは読み直さない）
+        self._wav_digest[normalized] = feature_cache.pcm_digest(data, self.sr)
+        return path
+
+    def wav_digest(self, normalized=False):
+        """write_wav で書いた WAV の中身のハッシュ（blob ストアの ID / 特徴量キャッシュのキー）。未書き込みなら None"""
+        return self._wav_digest.get(normalized)
+
+    def export_mp3(self, path, bitrate="192k", normalized=True):
+        import subprocess
+        data = self.normalized if normalized else self.samples
+        if transcode_service.encode_mp3(data, self.sr, path, bitrate):
+            return path
+        cmd = [
+            _ffmpeg_exe(), '-nostdin', '-y',
+            '-f', 's16le', '-ar', str(self.sr), '-ac', '1', '-i', 'pipe:0',
+            '-b:a', bitrate, '-f', 'mp3', path
+        ]
+        res = subprocess.run(cmd, input=data.astype('<i2').tobytes(),
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if res.returncode != 0:
+            raise RuntimeError(f"mp3 encode failed: {res.stderr[-300:]!r}")
+        return path
+
+
 # ────────── WAV 変換系 ──────────
-def convert_webm_to_wav(input_path, output_path):
+def _convert_to_wav(input_path, output_path):
+    # 常駐トランスコーダがあれば PCM を受け取って soundfile で書く
+    pcm = transcode_service.decode_pcm(input_path, 16000)
+    if pcm is not None:
+        sf.write(output_path, pcm, 16000, subtype='PCM_16', format='WAV')
+        return True
+
     import subprocess
     cmd = [
-        'ffmpeg', '-y', '-i', input_path,
+        _ffmpeg_exe(), '-y', '-i', input_path,
         '-acodec', 'pcm_s16le', '-ac', '1', '-ar', '16000',
         '-f', 'wav', output_path
     ]
@@ -63,25 +487,64 @@ def convert_webm_to_wav(input_path, output_path):
     return res.returncode == 0
 
 
+def convert_webm_to_wav(input_path, output_path):
+    return _convert_to_wav(input_path, output_path)
+
+
 def convert_m4a_to_wav(input_path, output_path):
-    import subprocess
-    cmd = [
-        'ffmpeg', '-y', '-i', input_path,
-        '-acodec', 'pcm_s16le', '-ac', '1', '-ar', '16000',
-        '-f', 'wav', output_path
-    ]
-    res = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    return res.returncode == 0
+    return _convert_to_wav(input_path, output_path)
 
 
-def normalize_volume(input_path, output_path, target_dBFS=-3.0):
-    from pydub import AudioSegment
+def export_mp3(input_path, output_path, bitrate="128k"):
+    """
+    任意の音声ファイル → MP3。常駐トランスコーダ優先、無ければ pydub（ffmpeg 起動）。
+    """
+    if transcode_service.transcode_file(input_path, output_path, bitrate):
+        return output_path
+    AudioSegment = _audio_segment()
+    AudioSegment.from_file(input_path).export(output_path, format="mp3", bitrate=bitrate)
+    return output_path
+
+
+def normalize_volume(input_path, output_path=None, target_dBFS=-3.0, mode="rms", max_peak_dBFS=None):
+    """
+    入力を 16kHz / mono / PCM16 にして音量正規化し、output_path があれば WAV で書く。
+    正規化後の int16 配列を返すので、次の処理にそのまま渡してもよい。
+
+    16kHz mono PCM16 の WAV（アップロード処理で作る変換済み WAV）は soundfile で読んで
+    normalize_pcm で処理し、pydub も ffmpeg も使わない。出力サンプルは従来の _normalized.wav と同一。
+    それ以外の入力は従来どおり pydub（元のレートでゲイン → ffmpeg で 16kHz mono）で処理する。
+    ゲイン後に飽和してから再サンプルする順序まで同じにしないと結果が一致しないため。
+    """
+    try:
+        info = sf.info(input_path)
+        native = (info.format == 'WAV' and info.subtype == 'PCM_16'
+                  and info.samplerate == PIPELINE_SR and info.channels == 1)
+    except Exception:
+        native = False
+
+    if native:
+        samples, _ = sf.read(input_path, dtype='int16')
+        out, _ = normalize_pcm(samples, target_dBFS, mode=mode, max_peak_dBFS=max_peak_dBFS)
+        if output_path:
+            sf.write(output_path, out, PIPELINE_SR, subtype='PCM_16', format='WAV')
+        return out
+
+    AudioSegment = _audio_segment()
     audio = AudioSegment.from_file(input_path)
-    diff = target_dBFS - audio.dBFS
+    level = audio.dBFS if mode == "rms" else audio.max_dBFS
+    diff = target_dBFS - level
+    if max_peak_dBFS is not None:
+        diff = min(diff, max_peak_dBFS - audio.max_dBFS)
+    dest = output_path or input_path + ".normalized.wav"
     audio.apply_gain(diff).export(
-        output_path, format="wav",
+        dest, format="wav",
         parameters=['-acodec','pcm_s16le','-ar','16000','-ac','1']
     )
+    out, _ = sf.read(dest, dtype='int16')
+    if not output_path:
+        os.remove(dest)
+    return out
 
 
 def is_valid_wav(wav_path, min_duration_sec=1.5):
@@ -0,0 +1,233 @@
+# utils/blob_store.py
+"""
+Web → ワーカーの受け渡し用ローカル blob ストア。
+
+upload() が作った正規化WAVは S3（normalized/…）に置いたあと、ワーカーがすぐ同じものをダウンロードする。
+Web とワーカーが同じホスト／共有ボリュームにいるならその往復は無駄なので、
+アップロード側は put() でここにも置いて digest をジョブに渡し、ワーカーは fetch() で先にここを見る。
+無ければ（別ホスト・追い出し済み）従来どおり S3 から取る。
+
+コンテンツアドレス型：digest は中身の PCM ハッシュ（AudioPipeline.write_wav がメモリ上の PCM から取る
+＝feature_cache.file_digest と同じ値）。同じ中身のアップロードは 1 つにまとまり、特徴量キャッシュのキーにもなる。
+BLOB_STORE_DIR を設定したときだけ有効（既定では何もしない。BLOB_STORE=0/1 で明示もできる）。
+リクエストの中ではファイルを読み直さずコピーもしない：put() は作業ディレクトリのファイルをハードリンクするだけなので、
+BLOB_STORE_DIR は SCRATCH_DIR と同じファイルシステムに置く（違えば put() は何もせず、ワーカーは S3 から取る）。
+
+  BLOB_STORE_DIR/<digest 先頭2桁>/<digest>   … 中身（put 後に中身は書き換えない）
+  mtime を最終アクセス時刻として、合計が BLOB_STORE_MAX_BYTES を超えたら古い順に追い出す（LRU）。
+  追い出しの走査は put() のたびではなく BLOB_STORE_EVICT_INTERVAL 秒に 1 回
+
+ヒット／ミス数はプロセス内と Redis（blobstore:stats）の両方に数える
+（RQ のジョブは fork した子で動くので、ワーカー側の数は Redis で見る）。
+"""
+import os
+import time
+import errno
+import shutil
+import threading
+
+STORE_DIR = os.getenv("BLOB_STORE_DIR", "")
+MAX_BYTES = int(os.getenv("BLOB_STORE_MAX_BYTES", str(1024 * 1024 * 1024)))  # 1GB
+ENABLED   = os.getenv("BLOB_STORE", "1" if STORE_DIR else "0").lower() in ("1", "true", "yes") and bool(STORE_DIR)
+EVICT_INTERVAL = float(os.getenv("BLOB_STORE_EVICT_INTERVAL", "60"))
+
+REDIS_STATS = "blobstore:stats"
+
+_lock = threading.Lock()
+_counters = {"hits": 0, "misses": 0, "puts": 0, "dedup": 0, "evicted": 0, "bytes_served": 0}
+_redis = None
+_redis_failed = False
+_last_evict = 0.0
+_cross_device = False
+
+
+# ────────── カウンタ ──────────
+def _count(field, n=1):
+    with _lock:
+        _counters[field] += n
+    r = _get_redis()
+    if r is not None:
+        try:
+            r.hincrby(REDIS_STATS, field, n)
+        except Exception:
+            pass
+
+
+def _hit_rate(c):
+    lookups = c.get("hits", 0) + c.get("misses", 0)
+    return round(c.get("hits", 0) / lookups, 4) if lookups else None
+
+
+def _usage():
+    total = files = 0
+    for e in _entries():
+        try:
+            total += e.stat().st_size
+            files += 1
+        except OSError:
+            pass
+    return total, files
+
+
+def stats():
+    with _lock:
+        local = dict(_counters)
+    local["hit_rate"] = _hit_rate(local)
+
+    shared = None
+    r = _get_redis()
+    if r is not None:
+        try:
+            shared = {k.decode(): int(v) for k, v in r.hgetall(REDIS_STATS).items()}
+            shared["hit_rate"] = _hit_rate(shared)
+        except Exception:
+            shared = None
+    used, files = _usage()
+    return {"process": local, "shared": shared, "bytes": used, "files": files,
+            "max_bytes": MAX_BYTES, "dir": STORE_DIR, "enabled": ENABLED}
+
+
+# ────────── Redis ──────────
+def _get_redis():
+    global _redis, _redis_failed
+    if _redis is not None or _redis_failed:
+        return _redis
+    url = os.getenv("REDIS_URL")
+    if not url:
+        _redis_failed = True
+        return None
+    try:
+        import redis
+        _redis = redis.from_url(url, socket_timeout=1.0, socket_connect_timeout=1.0)
+    except Exception as e:
+        print(f"⚠️ blob store: redis 無効 ({e})")
+        _redis_failed = True
+    return _redis
+
+
+# ────────── ストア本体 ──────────
+def _path(digest):
+    return os.path.join(STORE_DIR, digest[:2], digest)
+
+
+def _entries():
+    try:
+        shards = [e for e in os.scandir(STORE_DIR) if e.is_dir()]
+    except OSError:
+        return []
+    out = []
+    for shard in shards:
+        try:
+            out.extend(e for e in os.scandir(shard.path) if e.is_file() and not e.name.endswith(".tmp"))
+        except OSError:
+            pass
+    return out
+
+
+def _link_or_copy(src, dst):
+    # 取り出しは同じファイルシステムならハードリンク（コピー無し。dest は書き換えない前提）
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def _evict():
+    entries = []
+    total = 0
+    for e in _entries():
+        try:
+            st = e.stat()
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, e.path))
+        total += st.st_size
+    if total <= MAX_BYTES:
+        return
+    # 最終アクセスが古いものから上限の 9 割まで削る（毎回の走査を避ける）
+    entries.sort()
+    target = MAX_BYTES * 0.9
+    evicted = 0
+    for _, size, path in entries:
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+            total -= size
+            evicted += 1
+        except OSError:
+            pass
+    if evicted:
+        _count("evicted", evicted)
+
+
+def _maybe_evict():
+    """追い出しの走査は EVICT_INTERVAL 秒に 1 回（プロセスごと）"""
+    global _last_evict
+    now = time.monotonic()
+    with _lock:
+        if now - _last_evict < EVICT_INTERVAL:
+            return
+        _last_evict = now
+    _evict()
+
+
+def _touch(dst):
+    """同じ digest がもうあれば最終アクセス時刻を更新して True"""
+    try:
+        os.utime(dst)
+    except OSError:
+        return False
+    _count("dedup")
+    return True
+
+
+def put(path, digest):
+    """
+    path（中身のハッシュが digest）をストアにハードリンクして digest を返す（無効・失敗時は None）。
+    同じ digest がもうあれば何もしない。path はこの後書き換えないこと（消すのは構わない。ストア側のリンクは残る）。
+    """
+    global _cross_device
+    if not ENABLED or _cross_device or not digest:
+        return None
+    dst = _path(digest)
+    if _touch(dst):
+        return digest
+    try:
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        os.link(path, dst)
+    except OSError as e:
+        if e.errno == errno.EEXIST and _touch(dst):
+            return digest  # 同じ中身を別のリクエストが先に置いた
+        if e.errno == errno.EXDEV:
+            # 別のファイルシステム：リクエストの中でコピーはしない（以後このプロセスでは put しない）
+            _cross_device = True
+            print(f"⚠️ blob store: {STORE_DIR} は作業ディレクトリと別のファイルシステムです（無効化）")
+        else:
+            print(f"⚠️ blob store put failed: {e}")
+        return None
+    _count("puts")
+    _maybe_evict()
+    return digest
+
+
+def fetch(digest, dest):
+    """
+    digest の中身を dest に置く（ハードリンク／コピー）。ヒットで True、無ければ False（呼び出し側は S3 へ）。
+    """
+    if not ENABLED or not digest:
+        return False
+    src = _path(digest)
+    try:
+        os.utime(src)  # LRU: 最終アクセス時刻を更新（無ければここで FileNotFoundError）
+        if os.path.exists(dest):
+            os.remove(dest)
+        _link_or_copy(src, dest)
+        size = os.path.getsize(dest)
+    except OSError:
+        _count("misses")
+        return False
+    _count("hits")
+    _count("bytes_served", size)
+    print(f"✅ blob store hit: {digest[:12]} → {dest}")
+    return True
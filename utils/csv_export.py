@@ -0,0 +1,79 @@
+# utils/csv_export.py
+"""
+ScoreLog の CSV エクスポート（ストリーミング）。
+
+全件を .all() で読んで StringIO に溜めるのではなく、
+  - 必要な列だけの SELECT を yield_per（PostgreSQL ではサーバサイドカーソル）で EXPORT_YIELD_PER 行ずつ読み
+  - EXPORT_CHUNK_BYTES ぶん溜まるごとに yield する（gzip=True なら zlib で逐次圧縮）
+ので、履歴が何行あってもメモリは一定。Flask では stream_with_context で包んで Response に渡す
+（レスポンスを送り終えるまでセッション＝カーソルを開いたままにするため）。
+"""
+import os
+import csv
+import zlib
+from io import StringIO
+
+from app_instance import db
+
+YIELD_PER   = int(os.getenv("EXPORT_YIELD_PER", "1000"))
+CHUNK_BYTES = int(os.getenv("EXPORT_CHUNK_BYTES", str(64 * 1024)))
+
+
+def score_rows(user_id=None, start=None, end=None):
+    """
+    (user_id, timestamp, score) を timestamp 順に返す（yield_per で少しずつ）。
+      user_id=None … 全ユーザー（user_id, timestamp 順）
+      start / end  … JST の暦日（local_date, 両端含む）
+    """
+    from models import ScoreLog
+    stmt = db.select(ScoreLog.user_id, ScoreLog.timestamp, ScoreLog.score)
+    if user_id is not None:
+        stmt = stmt.where(ScoreLog.user_id == user_id)
+    if start:
+        stmt = stmt.where(ScoreLog.local_date >= start)
+    if end:
+        stmt = stmt.where(ScoreLog.local_date <= end)
+    stmt = stmt.order_by(ScoreLog.user_id, ScoreLog.timestamp)
+    return db.session.execute(stmt.execution_options(yield_per=YIELD_PER))
+
+
+def stream_csv(header, rows, gzip=False):
+    """header と rows（イテラブル）を CSV にして bytes のチャンクで yield する"""
+    buf = StringIO()
+    writer = csv.writer(buf)
+    # wbits=31 で gzip 形式（.csv.gz としてそのまま開ける）
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+
+    def _drain():
+        data = buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate(0)
+        return gz.compress(data) if gz else data
+
+    writer.writerow(header)
+    for row in rows:
+        writer.writerow(row)
+        if buf.tell() >= CHUNK_BYTES:
+            chunk = _drain()
+            if chunk:
+                yield chunk
+    chunk = _drain()
+    if gz:
+        chunk += gz.flush()
+    if chunk:
+        yield chunk
+
+
+def score_csv(user_id=None, start=None, end=None, gzip=False):
+    """ScoreLog の CSV（1 ユーザーなら 日付,スコア／全ユーザーなら user_id,日付,スコア）"""
+    result = score_rows(user_id=user_id, start=start, end=end)
+    try:
+        if user_id is not None:
+            header = ['日付', 'スコア']
+            rows = ((ts.strftime('%Y-%m-%d %H:%M:%S') if ts else '', score) for _, ts, score in result)
+        else:
+            header = ['user_id', '日付', 'スコア']
+            rows = ((uid, ts.strftime('%Y-%m-%d %H:%M:%S') if ts else '', score) for uid, ts, score in result)
+        yield from stream_csv(header, rows, gzip=gzip)
+    finally:
+        result.close()  # 途中で切断されてもカーソルを閉じる
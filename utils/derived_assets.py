@@ -0,0 +1,154 @@
+# utils/derived_assets.py
+"""
+派生ファイル（MP3）を再生時にだけ作るためのヘルパー。
+
+アップロード時は DerivedAsset に status='absent' のマーカーを登録するだけで、変換も S3 PUT もしない。
+再生が要求されたら ensure() が transcode キューにジョブを積み、最大 DERIVED_WAIT_SEC 秒だけ
+完了を待つ。間に合わなければ呼び出し側は元ファイル（m4a / 正規化WAV）で再生し、次回からは MP3 を返す。
+ready のマーカーがあれば S3 の HEAD も打たない。
+
+変換ジョブの ID はジョブを積む前に決めて行に書いておき、結果（mark）はその ID のジョブからだけ受け付ける。
+上書きアップロードで register() が行を absent に戻した後に古いジョブが終わっても、古い MP3 を ready にしない。
+失敗した行は DERIVED_RETRY_BASE_SEC × 2^(attempts-1) 秒空けてから積み直し、DERIVED_MAX_ATTEMPTS 回で諦める
+（再生のたびに失敗し続けるジョブを積まない）。
+"""
+import os
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+
+from app_instance import db
+
+DERIVED_WAIT_SEC  = float(os.getenv("DERIVED_WAIT_SEC", "3"))
+PENDING_STALE_SEC = int(os.getenv("DERIVED_PENDING_STALE_SEC", "600"))  # pending のまま放置されたら再投入
+MAX_ATTEMPTS      = int(os.getenv("DERIVED_MAX_ATTEMPTS", "5"))
+RETRY_BASE_SEC    = int(os.getenv("DERIVED_RETRY_BASE_SEC", "60"))
+RETRY_MAX_SEC     = int(os.getenv("DERIVED_RETRY_MAX_SEC", str(6 * 3600)))
+
+
+def find(asset_key):
+    from models import DerivedAsset
+    return DerivedAsset.query.filter_by(asset_key=asset_key).first()
+
+
+def register(user_id, source_key, asset_key, bitrate='128k', kind='mp3'):
+    """
+    マーカーを登録（既にあれば absent に戻す＝上書きアップロード時の無効化）。
+    commit は呼び出し側。
+    """
+    from models import DerivedAsset
+    row = find(asset_key)
+    if row is None:
+        row = DerivedAsset(user_id=user_id, asset_key=asset_key, kind=kind)
+        db.session.add(row)
+    row.source_key = source_key
+    row.bitrate = bitrate
+    row.status = 'absent'
+    row.job_id = None
+    row.error = None
+    row.attempts = 0
+    return row
+
+
+def _age(row):
+    ts = row.updated_at
+    if ts is None:
+        return None
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return datetime.now(timezone.utc) - ts
+
+
+def _stale(row):
+    age = _age(row)
+    return age is None or age > timedelta(seconds=PENDING_STALE_SEC)
+
+
+def _retry_due(row):
+    """failed の行を積み直してよいか（回数の上限と、回数に応じた待ち時間）"""
+    attempts = row.attempts or 0
+    if attempts >= MAX_ATTEMPTS:
+        return False
+    age = _age(row)
+    wait = min(RETRY_BASE_SEC * 2 ** max(0, attempts - 1), RETRY_MAX_SEC)
+    return age is None or age >= timedelta(seconds=wait)
+
+
+def request_build(row):
+    """
+    未作成なら変換ジョブを積んで job_id を返す（実行中ならその job_id、ready なら None）。
+    failed で再投入の時期でない（または上限に達した）ときも None。
+    """
+    if row.status == 'ready':
+        return None
+    if row.status == 'pending' and row.job_id and not _stale(row):
+        return row.job_id
+    if row.status == 'failed' and not _retry_due(row):
+        return None
+
+    # 先に ID を行へ書いてから積む（すぐ終わったジョブの mark が、まだ古い job_id の行に弾かれないように）
+    prev = (row.status, row.job_id, row.error, row.attempts)
+    job_id = uuid.uuid4().hex
+    row.status = 'pending'
+    row.job_id = job_id
+    row.error = None
+    row.attempts = (row.attempts or 0) + 1
+    db.session.commit()
+
+    from tasks import enqueue_transcode
+    if enqueue_transcode(row.source_key, row.asset_key, row.bitrate or '128k', job_id=job_id):
+        return job_id
+    row.status, row.job_id, row.error, row.attempts = prev
+    db.session.commit()
+    return None
+
+
+def ensure(row, wait=DERIVED_WAIT_SEC):
+    """
+    再生時に呼ぶ。ready なら True。無ければジョブを積み、最大 wait 秒だけ完了を待つ。
+    """
+    if row.status == 'ready':
+        return True
+    job_id = request_build(row)
+    if not job_id or wait <= 0:
+        return False
+
+    from rq.job import Job
+    from tasks import redis_conn
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        try:
+            status = Job.fetch(job_id, connection=redis_conn).get_status()
+        except Exception:
+            return False
+        if status in ('finished', 'failed', 'stopped', 'canceled'):
+            break
+        time.sleep(0.2)
+
+    # ワーカーがマーカーを更新しているので読み直す
+    db.session.refresh(row)
+    return row.status == 'ready'
+
+
+def current(asset_key, job_id):
+    """job_id がこのマーカーの今有効なジョブか（マーカーが無ければ True）"""
+    row = find(asset_key)
+    return row is None or row.job_id == job_id
+
+
+def mark(asset_key, status, error=None, job_id=None):
+    """
+    変換ジョブ（tasks.transcode_worker）から結果を書き込む。
+    マーカーが無い、または行の job_id と違う（上書き・再投入で古くなった）ジョブなら何もしない。
+    書き込んだら True。
+    """
+    from models import DerivedAsset
+    row = (DerivedAsset.query.filter_by(asset_key=asset_key)
+           .with_for_update().first())
+    if row is None or row.job_id != job_id:
+        db.session.rollback()
+        return False
+    row.status = status
+    row.error = (error or None) and str(error)[:255]
+    db.session.commit()
+    return True
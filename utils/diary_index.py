@@ -0,0 +1,107 @@
+# utils/diary_index.py
+"""
+日記音声の索引（DiaryEntry）の読み書き。
+
+S3 の diary/<user_id>/<YYYY-MM-DD>.m4a（旧データは .mp3）を 1 ユーザー 1 日 1 行で持つ。
+同じ日に m4a と mp3 があれば m4a を採る（diary_list の従来の優先順）。
+diary/<user_id>/ 以下でも日付名でないキー（録音の MP3 など）は日記ではないので載せない。
+"""
+import os
+import re
+from datetime import date as _date, datetime, timezone
+
+from app_instance import db
+
+_DIARY_KEY = re.compile(r'^diary/(\d+)/(\d{4}-\d{2}-\d{2})\.(m4a|mp3)$')
+
+
+def parse_key(key):
+    """'diary/<uid>/<YYYY-MM-DD>.<ext>' → (user_id, date, ext)。日記のキーでなければ None"""
+    m = _DIARY_KEY.match(key or '')
+    if not m:
+        return None
+    try:
+        d = datetime.strptime(m.group(2), '%Y-%m-%d').date()
+    except ValueError:
+        return None
+    return int(m.group(1)), d, m.group(3)
+
+
+def _as_date(d):
+    return d if isinstance(d, _date) else datetime.strptime(d, '%Y-%m-%d').date()
+
+
+def find(user_id, d):
+    from models import DiaryEntry
+    return DiaryEntry.query.filter_by(user_id=user_id, date=_as_date(d)).first()
+
+
+def upsert(user_id, d, s3_key, size=None):
+    """
+    その日の行を作る／差し替える（上書きアップロード）。commit は呼び出し側。
+    """
+    from models import DiaryEntry
+    d = _as_date(d)
+    row = find(user_id, d)
+    if row is None:
+        row = DiaryEntry(user_id=user_id, date=d)
+        db.session.add(row)
+    row.s3_key = s3_key
+    row.ext = os.path.splitext(s3_key)[1].lstrip('.') or 'm4a'
+    row.size = size
+    # 同じキー・同じサイズの上書きでも進める（再生 URL のキャッシュの版に使う: url_cache）
+    row.updated_at = datetime.now(timezone.utc)
+    return row
+
+
+def list_entries(user_id, limit=90):
+    """新しい日付から limit 件（(user_id, date) の索引だけで引ける）"""
+    from models import DiaryEntry
+    return (DiaryEntry.query
+            .filter(DiaryEntry.user_id == user_id)
+            .order_by(DiaryEntry.date.desc())
+            .limit(limit)
+            .all())
+
+
+def backfill(user_id=None, commit_every=500, log=print):
+    """
+    S3 の diary/ 以下（user_id 指定ならそのユーザーだけ）を LIST して DiaryEntry を作る。
+    何度流しても同じ結果になる。返り値: {'scanned', 'upserted', 'skipped'}
+    """
+    from s3_utils import s3, S3_BUCKET
+    prefix = f"diary/{user_id}/" if user_id is not None else "diary/"
+
+    # 同じ日に m4a と mp3 があれば m4a
+    found = {}
+    scanned = skipped = 0
+    paginator = s3().get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=prefix):
+        for obj in page.get('Contents', []) or []:
+            scanned += 1
+            parsed = parse_key(obj['Key'])
+            if parsed is None:
+                skipped += 1
+                continue
+            uid, d, ext = parsed
+            prev = found.get((uid, d))
+            if prev is None or (ext == 'm4a' and prev[1] != 'm4a'):
+                found[(uid, d)] = (obj['Key'], ext, obj.get('Size'))
+
+    # 既に消えたユーザーのプレフィックスは外部キーで弾かれるので飛ばす
+    from models import User
+    uids = {uid for uid, _ in found}
+    known = {u.id for u in User.query.with_entities(User.id).filter(User.id.in_(uids))} if uids else set()
+
+    upserted = 0
+    for (uid, d), (key, _ext, size) in sorted(found.items()):
+        if uid not in known:
+            skipped += 1
+            continue
+        upsert(uid, d, key, size)
+        upserted += 1
+        if upserted % commit_every == 0:
+            db.session.commit()
+            log(f"  … {upserted} 件")
+    db.session.commit()
+    return {'scanned': scanned, 'upserted': upserted, 'skipped': skipped}
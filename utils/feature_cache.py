@@ -0,0 +1,302 @@
+# utils/feature_cache.py
+"""
+解析結果のコンテンツアドレス型キャッシュ。
+
+キー = 名前空間 + 解析器バージョン + パラメータ + PCM の SHA-256。
+同じ音声（上書き再録音で同一内容・detailed_worker の再実行など）なら再計算しない。
+
+  1) ローカルディスク（FEATURE_CACHE_DIR, mtime による LRU, 上限 FEATURE_CACHE_DISK_MAX 件）
+  2) Redis（REDIS_URL, ZSET で最終アクセス時刻を持つ LRU, 上限 FEATURE_CACHE_REDIS_MAX 件）
+
+の順に引き、Redis ヒット時はディスクにも書き戻す。
+ファイルの解析（audio_utils.analyze_stats）は、ハッシュのためだけにファイルを読み直さない：
+読みながらハッシュして結果を保存し、同じファイルは (パス, サイズ, mtime) の覚え書きから、
+blob ストア経由の入力は呼び出し側が渡す digest（書き出し時に取った PCM ハッシュ＝blob ストアの ID）で、読む前に引く。
+ヒット／ミス数はプロセス内と Redis（featcache:stats）の両方に数える。
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+CACHE_DIR   = os.getenv("FEATURE_CACHE_DIR", "/tmp/koekarte-feature-cache")
+DISK_MAX    = int(os.getenv("FEATURE_CACHE_DISK_MAX", "5000"))
+REDIS_MAX   = int(os.getenv("FEATURE_CACHE_REDIS_MAX", "50000"))
+REDIS_TTL   = int(os.getenv("FEATURE_CACHE_TTL", str(30 * 86400)))
+ENABLED     = os.getenv("FEATURE_CACHE", "1").lower() in ("1", "true", "yes")
+ALIAS_MAX   = int(os.getenv("FEATURE_CACHE_ALIAS_MAX", "4096"))
+EVICT_RESYNC = int(os.getenv("FEATURE_CACHE_EVICT_RESYNC", "200"))
+
+REDIS_PREFIX = "featcache:"
+REDIS_LRU    = "featcache:lru"
+REDIS_STATS  = "featcache:stats"
+
+_lock = threading.Lock()
+_counters = {"hits_disk": 0, "hits_redis": 0, "misses": 0, "puts": 0}
+_redis = None
+_redis_failed = False
+_aliases = OrderedDict()  # (実パス, サイズ, mtime, inode) -> PCM ハッシュ
+_disk_entries = None      # ディスク上の件数（プロセス内の見積もり。None なら未走査）
+_puts_since_scan = 0
+
+
+# ────────── コンテンツハッシュ ──────────
+def pcm_hasher(sr, channels, dtype):
+    """PCM のハッシュ（sha256）。読みながら update() していけば file_digest と同じ値になる"""
+    return hashlib.sha256(f"{sr}:{channels}:{np.dtype(dtype).str}:".encode())
+
+
+def file_pcm_dtype(f):
+    """file_digest が読む型（PCM16 の WAV は int16 のまま、それ以外は float32）"""
+    return 'int16' if f.subtype == 'PCM_16' else 'float32'
+
+
+def pcm_digest(samples, sr):
+    """デコード済み PCM（ndarray）のハッシュ。file_digest と同じ規則。"""
+    samples = np.ascontiguousarray(samples)
+    channels = 1 if samples.ndim == 1 else samples.shape[1]
+    h = pcm_hasher(sr, channels, samples.dtype)
+    h.update(samples.tobytes())
+    return h.hexdigest()
+
+
+def file_digest(path):
+    """
+    音声ファイルの PCM 部分のハッシュ（ヘッダ差は無視）。
+    解析と別にファイルを読むので、解析するなら audio_utils.analyze_stats のように読みながら pcm_hasher に流す。
+    """
+    import soundfile as sf
+    with sf.SoundFile(path) as f:
+        dtype = file_pcm_dtype(f)
+        h = pcm_hasher(f.samplerate, f.channels, dtype)
+        for block in f.blocks(blocksize=1 << 16, dtype=dtype):
+            h.update(np.ascontiguousarray(block).tobytes())
+    return h.hexdigest()
+
+
+# ────────── ファイル → ハッシュの覚え書き ──────────
+# 一度読んだファイル（実パス・サイズ・mtime・inode が同じ）は、読まずにハッシュが分かる
+
+def _file_id(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (os.path.realpath(path), st.st_size, st.st_mtime_ns, st.st_ino)
+
+
+def file_alias(path):
+    """以前 remember_alias したファイルがそのままならそのハッシュ、無ければ None"""
+    fid = _file_id(path)
+    with _lock:
+        digest = _aliases.get(fid) if fid else None
+        if digest is not None:
+            _aliases.move_to_end(fid)
+    return digest
+
+
+def remember_alias(path, digest):
+    fid = _file_id(path)
+    if fid is None:
+        return
+    with _lock:
+        _aliases[fid] = digest
+        _aliases.move_to_end(fid)
+        while len(_aliases) > ALIAS_MAX:
+            _aliases.popitem(last=False)
+
+
+def make_key(namespace, version, digest, **params):
+    p = ",".join(f"{k}={params[k]}" for k in sorted(params))
+    return f"{namespace}-v{version}-{hashlib.sha1(p.encode()).hexdigest()[:10]}-{digest}"
+
+
+# ────────── カウンタ ──────────
+def _count(field):
+    with _lock:
+        _counters[field] += 1
+    r = _get_redis()
+    if r is not None:
+        try:
+            r.hincrby(REDIS_STATS, field, 1)
+        except Exception:
+            pass
+
+
+def stats():
+    with _lock:
+        local = dict(_counters)
+    lookups = local["hits_disk"] + local["hits_redis"] + local["misses"]
+    local["hit_rate"] = round((local["hits_disk"] + local["hits_redis"]) / lookups, 4) if lookups else None
+
+    shared = None
+    r = _get_redis()
+    if r is not None:
+        try:
+            shared = {k.decode(): int(v) for k, v in r.hgetall(REDIS_STATS).items()}
+            shared["redis_entries"] = int(r.zcard(REDIS_LRU))
+        except Exception:
+            shared = None
+    try:
+        disk_entries = len(os.listdir(CACHE_DIR))
+    except OSError:
+        disk_entries = 0
+    return {"process": local, "shared": shared, "disk_entries": disk_entries,
+            "disk_max": DISK_MAX, "redis_max": REDIS_MAX}
+
+
+# ────────── Redis ──────────
+def _get_redis():
+    global _redis, _redis_failed
+    if _redis is not None or _redis_failed:
+        return _redis
+    url = os.getenv("REDIS_URL")
+    if not url:
+        _redis_failed = True
+        return None
+    try:
+        import redis
+        _redis = redis.from_url(url, socket_timeout=1.0, socket_connect_timeout=1.0)
+    except Exception as e:
+        print(f"⚠️ feature cache: redis 無効 ({e})")
+        _redis_failed = True
+    return _redis
+
+
+def _redis_get(key):
+    r = _get_redis()
+    if r is None:
+        return None
+    try:
+        raw = r.get(REDIS_PREFIX + key)
+        if raw is None:
+            return None
+        r.zadd(REDIS_LRU, {key: time.time()})
+        return json.loads(raw)
+    except Exception as e:
+        print(f"⚠️ feature cache redis get failed: {e}")
+        return None
+
+
+def _redis_put(key, value):
+    r = _get_redis()
+    if r is None:
+        return
+    try:
+        pipe = r.pipeline()
+        pipe.set(REDIS_PREFIX + key, json.dumps(value), ex=REDIS_TTL)
+        pipe.zadd(REDIS_LRU, {key: time.time()})
+        pipe.zcard(REDIS_LRU)
+        size = pipe.execute()[-1]
+        if size > REDIS_MAX:
+            # 最終アクセスが古いものから追い出す
+            old = r.zpopmin(REDIS_LRU, size - REDIS_MAX)
+            if old:
+                r.delete(*[REDIS_PREFIX + k.decode() for k, _ in old])
+    except Exception as e:
+        print(f"⚠️ feature cache redis put failed: {e}")
+
+
+# ────────── ローカルディスク ──────────
+def _disk_path(key):
+    return os.path.join(CACHE_DIR, key + ".json")
+
+
+def _disk_get(key):
+    path = _disk_path(key)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            value = json.load(f)
+        os.utime(path)  # LRU: 最終アクセス時刻を更新
+        return value
+    except (OSError, ValueError):
+        return None
+
+
+def _disk_put(key, value):
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp = _disk_path(key) + f".{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(value, f)
+        existed = os.path.exists(_disk_path(key))
+        os.replace(tmp, _disk_path(key))
+        _maybe_evict(0 if existed else 1)
+    except OSError as e:
+        print(f"⚠️ feature cache disk put failed: {e}")
+
+
+def _maybe_evict(added):
+    """
+    件数はプロセス内で数えておき、上限の 1 割を超えたときだけディレクトリを走査して追い出す
+    （put のたびに全件 scandir しない）。他のプロセスの書き込みぶんは EVICT_RESYNC 回に 1 回数え直して拾う。
+    """
+    global _disk_entries, _puts_since_scan
+    with _lock:
+        _puts_since_scan += 1
+        resync = _disk_entries is None or _puts_since_scan >= EVICT_RESYNC
+        if not resync:
+            _disk_entries += added
+            if _disk_entries <= DISK_MAX * 1.1:
+                return
+        _puts_since_scan = 0
+    n = _disk_evict()
+    with _lock:
+        _disk_entries = n
+
+
+def _disk_evict():
+    """上限の 1 割を超えていれば古い順に DISK_MAX 件まで削除。残った件数を返す"""
+    try:
+        entries = [e for e in os.scandir(CACHE_DIR) if e.name.endswith(".json")]
+    except OSError:
+        return 0
+    if len(entries) <= DISK_MAX * 1.1:
+        return len(entries)
+    entries.sort(key=lambda e: e.stat().st_mtime)
+    removed = 0
+    for e in entries[:len(entries) - DISK_MAX]:
+        try:
+            os.remove(e.path)
+            removed += 1
+        except OSError:
+            pass
+    return len(entries) - removed
+
+
+# ────────── 公開 API ──────────
+def get(key):
+    if not ENABLED:
+        return None
+    value = _disk_get(key)
+    if value is not None:
+        _count("hits_disk")
+        return value
+    value = _redis_get(key)
+    if value is not None:
+        _count("hits_redis")
+        _disk_put(key, value)
+        return value
+    _count("misses")
+    return None
+
+
+def put(key, value):
+    if not ENABLED:
+        return
+    _disk_put(key, value)
+    _redis_put(key, value)
+    _count("puts")
+
+
+def cached(key, compute):
+    """key にヒットすればその値、無ければ compute() を実行して保存"""
+    value = get(key)
+    if value is None:
+        value = compute()
+        put(key, value)
+    return value
@@ -0,0 +1,198 @@
+# utils/feature_engine.py
+"""
+extract_advanced_features 用の特徴量エンジン。
+
+以前は spectral_centroid / spectral_bandwidth / mfcc がそれぞれ STFT を計算し、
+rms / zero_crossing_rate もそれぞれ信号をフレーム化していた。
+ここでは振幅スペクトログラム（STFT 1 回）とフレーム行列（1 回）を作り、
+全統計量をそこから導出する。librosa の各関数に S= を渡す形なので値は同一。
+"""
+import numpy as np
+
+from utils import feature_cache
+
+# 特徴量の定義を変えたら上げる（特徴量キャッシュのキーに含まれる）
+ADVANCED_FEATURES_VERSION = 1
+
+
+class FeatureEngine:
+    def __init__(self, y, sr, n_fft=2048, hop=256, win=1024):
+        self.y = np.asarray(y, dtype=np.float32)
+        self.sr = sr
+        self.n_fft = n_fft
+        self.hop = hop
+        self.win = win
+        self._mag = None
+        self._frames = None
+
+    # ---------- 共有の中間表現 ----------
+    @property
+    def mag(self):
+        """振幅スペクトログラム |STFT|（center=True, hann）"""
+        if self._mag is None:
+            import librosa
+            self._mag = np.abs(librosa.stft(self.y, n_fft=self.n_fft, hop_length=self.hop))
+        return self._mag
+
+    @property
+    def frames(self):
+        """win 長・hop 間隔のフレーム行列（librosa.feature.rms と同じ 0 埋め center）"""
+        if self._frames is None:
+            import librosa
+            pad = self.win // 2
+            y = np.pad(self.y, (pad, pad), mode='constant')
+            self._frames = librosa.util.frame(y, frame_length=self.win, hop_length=self.hop)
+        return self._frames
+
+    # ---------- 時間領域 ----------
+    def rms(self):
+        return np.sqrt(np.mean(np.square(self.frames), axis=0))
+
+    def zcr(self):
+        """
+        librosa.feature.zero_crossing_rate と同じ値（端は edge 埋め、|y|<=1e-10 は 0 扱い）。
+        サンプル間の符号反転を 1 回だけ求め、累積和でフレームごとに数える。
+        """
+        pad = self.win // 2
+        y = np.pad(self.y, (pad, pad), mode='edge')
+        y = np.where(np.abs(y) <= 1e-10, 0, y)
+        flips = np.concatenate([[0], np.signbit(y[1:]) != np.signbit(y[:-1])]).astype(np.int64)
+        csum = np.concatenate([[0], np.cumsum(flips)])
+        n_frames = 1 + (len(y) - self.win) // self.hop
+        starts = np.arange(n_frames) * self.hop
+        # フレーム先頭サンプルの反転は数えない（pad=False）
+        counts = csum[starts + self.win] - csum[starts + 1]
+        return counts / self.win
+
+    # ---------- スペクトル ----------
+    def centroid(self):
+        import librosa
+        return librosa.feature.spectral_centroid(S=self.mag, sr=self.sr, n_fft=self.n_fft,
+                                                 hop_length=self.hop)[0]
+
+    def bandwidth(self):
+        import librosa
+        return librosa.feature.spectral_bandwidth(S=self.mag, sr=self.sr, n_fft=self.n_fft,
+                                                  hop_length=self.hop)[0]
+
+    def mfcc(self, n_mfcc=13):
+        import librosa
+        mel = librosa.feature.melspectrogram(S=self.mag ** 2, sr=self.sr, n_fft=self.n_fft,
+                                             hop_length=self.hop)
+        return librosa.feature.mfcc(S=librosa.power_to_db(mel), sr=self.sr, n_mfcc=n_mfcc)
+
+
+# ────────── 特徴量抽出（旧 app.py） ──────────
+def bandpass_filter(signal, sr, lowcut=80, highcut=4000, order=5):
+    from scipy.signal import butter, lfilter
+    nyq = 0.5 * sr
+    b, a = butter(order, [lowcut/nyq, highcut/nyq], btype='band')
+    return lfilter(b, a, signal).astype(np.float32)
+
+
+def extract_advanced_features(signal, sr):
+    """
+    低メモリ＆学習なし想定：
+      - 16kHz/mono化、無音トリム
+      - ピッチ: YIN（1D）
+      - 統計量は「平均＋標準偏差」中心（固定次元）
+      - 発話/無音は適応しきい値
+    返り値: dict（固定キー）
+    """
+    # 同じ PCM なら前回の結果を返す
+    if feature_cache.ENABLED:
+        y = np.asarray(signal, dtype=np.float32)
+        key = feature_cache.make_key("adv", ADVANCED_FEATURES_VERSION,
+                                     feature_cache.pcm_digest(y, sr))
+        return feature_cache.cached(key, lambda: _extract_advanced_features(y, sr))
+    return _extract_advanced_features(signal, sr)
+
+
+def _extract_advanced_features(signal, sr):
+    import librosa
+
+    # --- 安全キャスト＆モノラル化 ---
+    y = np.asarray(signal, dtype=np.float32)
+    if y.ndim > 1:
+        y = y.mean(axis=1)
+
+    # --- サンプリング周波数統一 ---
+    if sr != 16000:
+        y = librosa.resample(y, orig_sr=sr, target_sr=16000, res_type='kaiser_fast')
+        sr = 16000
+
+    # --- 無音区間トリム（前後） ---
+    intervals = librosa.effects.split(y, top_db=30, frame_length=1024, hop_length=256)
+    if len(intervals):
+        y = np.concatenate([y[s:e] for s, e in intervals])
+    if y.size < sr // 2:  # 0.5秒未満はダミーで返す
+        return {
+            'pitch_med': 0.0, 'pitch_iqr': 0.0,
+            'rms_mean': 0.0, 'rms_std': 0.0,
+            'zcr_mean': 0.0, 'zcr_std': 0.0,
+            'centroid_mean': 0.0, 'centroid_std': 0.0,
+            'bandwidth_mean': 0.0, 'bandwidth_std': 0.0,
+            **{f'mfcc_{i+1}_mean': 0.0 for i in range(13)},
+            **{f'mfcc_{i+1}_std':  0.0 for i in range(13)},
+            'voiced_ratio': 0.0, 'voiced_rate_fps': 0.0,
+        }
+
+    # --- （必要なら）帯域制限：F0の劣化が嫌なら YIN の前は未フィルタでOK ---
+    y_bp = bandpass_filter(y, sr, 80, 4000, order=5)
+
+    # 共通パラメータ
+    n_fft = 2048
+    hop   = 256
+    win   = 1024
+
+    # --- 1) ピッチ（軽量＆堅牢） ---
+    #    piptrack -> yin に変更（1Dで低メモリ）
+    f0 = librosa.yin(y, fmin=50, fmax=400, sr=sr, frame_length=n_fft, hop_length=hop)
+    f0 = f0[np.isfinite(f0)]
+    if f0.size == 0:
+        f0 = np.array([0.0], dtype=np.float32)
+    pitch_med = float(np.median(f0))
+    pitch_iqr = float(np.percentile(f0, 75) - np.percentile(f0, 25))
+
+    # STFT（振幅スペクトログラム）とフレーム行列は 1 回だけ作り、以降の特徴量で共有
+    engine = FeatureEngine(y_bp, sr, n_fft=n_fft, hop=hop, win=win)
+
+    # --- 2) 強度・発話テンポプロキシ ---
+    rms = engine.rms()
+    zcr = engine.zcr()
+
+    # 適応しきい値で有声/無声を分ける（中央値ベース）
+    thr = float(np.median(rms) * 1.1 + 1e-6)
+    voiced = rms > thr
+    total_frames = rms.size
+    voiced_frames = int(voiced.sum())
+    voiced_ratio = float(voiced_frames / max(total_frames, 1))
+    # 近似「発話レート」＝1秒あたりの有声フレーム数
+    fps = sr / hop
+    voiced_rate_fps = float(voiced_frames / (total_frames / fps + 1e-6))
+
+    # --- 3) スペクトル特徴 ---
+    sc  = engine.centroid()
+    sbw = engine.bandwidth()
+
+    # --- 4) MFCC（13次）: 平均＆標準偏差のみ（固定次元） ---
+    mfcc = engine.mfcc(n_mfcc=13)
+    mfcc_mean = mfcc.mean(axis=1).astype(np.float32)
+    mfcc_std  = mfcc.std(axis=1).astype(np.float32)
+
+    # --- 5) まとめ ---
+    feats = {
+        'pitch_med': pitch_med,
+        'pitch_iqr': pitch_iqr,
+        'rms_mean':  float(rms.mean()), 'rms_std': float(rms.std()),
+        'zcr_mean':  float(zcr.mean()), 'zcr_std': float(zcr.std()),
+        'centroid_mean': float(sc.mean()),  'centroid_std': float(sc.std()),
+        'bandwidth_mean': float(sbw.mean()), 'bandwidth_std': float(sbw.std()),
+        'voiced_ratio': voiced_ratio,
+        'voiced_rate_fps': voiced_rate_fps,
+    }
+    for i in range(13):
+        feats[f'mfcc_{i+1}_mean'] = float(mfcc_mean[i])
+        feats[f'mfcc_{i+1}_std']  = float(mfcc_std[i])
+
+    return feats
@@ -0,0 +1,92 @@
+# utils/query_plans.py
+"""
+ScoreLog のホットなクエリの実行計画チェック（PostgreSQL の EXPLAIN）。
+
+  flask explain-hot-queries --user-id 1 [--natural]
+
+各エンドポイントと同じ形のクエリを EXPLAIN (FORMAT JSON) し、score_log を Seq Scan しているものがあれば失敗にする。
+既定では SET LOCAL enable_seqscan = off で流す（行数の少ない開発 DB でもプランナが索引を選べるかを見る）。
+--natural はその設定をせず、本番と同じ統計でそのまま計画させる。
+"""
+from datetime import datetime, timezone
+
+from sqlalchemy import text, tuple_
+
+from app_instance import db
+
+
+def hot_queries(user_id):
+    """(名前, 使っているエンドポイント, Query) の一覧"""
+    from models import ScoreLog
+    by_user = ScoreLog.query.filter(ScoreLog.user_id == user_id)
+    return [
+        ("latest", "score_summary.sync（upload / 詳細解析）",
+         by_user.order_by(ScoreLog.timestamp.desc()).limit(1)),
+        ("earliest", "score_summary.sync",
+         by_user.order_by(ScoreLog.timestamp.asc()).limit(1)),
+        ("baseline_first5", "score_summary.sync",
+         by_user.order_by(ScoreLog.timestamp.asc()).limit(5)),
+        ("history", "export_csv / result",
+         by_user.order_by(ScoreLog.timestamp.asc())),
+        ("history_page", "api_scores / api_score_history（?cursor=）",
+         by_user.filter(tuple_(ScoreLog.timestamp, ScoreLog.id) < (datetime(2000, 1, 1, tzinfo=timezone.utc), 0))
+                .order_by(ScoreLog.timestamp.desc(), ScoreLog.id.desc()).limit(1001)),
+        ("history_since", "api_scores / api_score_history（?since=）",
+         by_user.filter(tuple_(ScoreLog.updated_at, ScoreLog.id) > (datetime(2000, 1, 1, tzinfo=timezone.utc), 0))
+                .order_by(ScoreLog.updated_at.asc(), ScoreLog.id.asc()).limit(1001)),
+        ("history_latest", "api_scores / api_score_history（latest_cursor）",
+         by_user.filter(ScoreLog.updated_at.isnot(None))
+                .order_by(ScoreLog.updated_at.desc(), ScoreLog.id.desc()).limit(1)),
+        ("recent_rms", "upload（ベースライン RMS）",
+         by_user.filter(ScoreLog.volume_std.isnot(None)).order_by(ScoreLog.timestamp.desc()).limit(5)),
+        ("by_filename", "detailed_worker / job_status",
+         by_user.filter(ScoreLog.filename == "user0_20000101_000000_normalized.wav")
+                .order_by(ScoreLog.timestamp.desc()).limit(1)),
+    ]
+
+
+def _walk(node):
+    yield node
+    for child in node.get("Plans", []) or []:
+        yield from _walk(child)
+
+
+def _scans(plan, table="score_log"):
+    """plan の中で table を読んでいるノード（Node Type, Index Name）"""
+    out = []
+    for node in _walk(plan):
+        if node.get("Relation Name") == table:
+            out.append((node.get("Node Type"), node.get("Index Name")))
+    return out
+
+
+def explain(query, natural=False):
+    """query の実行計画（EXPLAIN FORMAT JSON の Plan）"""
+    sql = str(query.statement.compile(dialect=db.engine.dialect, compile_kwargs={"literal_binds": True}))
+    with db.engine.connect() as conn:
+        with conn.begin():
+            if not natural:
+                conn.execute(text("SET LOCAL enable_seqscan = off"))
+            doc = conn.execute(text("EXPLAIN (FORMAT JSON) " + sql)).scalar()
+    if isinstance(doc, str):
+        import json
+        doc = json.loads(doc)
+    return doc[0]["Plan"]
+
+
+def check(user_id, natural=False, log=print):
+    """
+    すべてのホットクエリを EXPLAIN して score_log の読み方を表示する。
+    Seq Scan が 1 つでもあれば False。PostgreSQL 以外では None（チェックしない）。
+    """
+    if db.engine.dialect.name != "postgresql":
+        log(f"⚠️ EXPLAIN チェックは PostgreSQL のみ（現在: {db.engine.dialect.name}）")
+        return None
+    ok = True
+    for name, used_by, query in hot_queries(user_id):
+        scans = _scans(explain(query, natural=natural))
+        seq = any(node_type == "Seq Scan" for node_type, _ in scans)
+        ok = ok and not seq
+        desc = ", ".join(f"{t}{f' using {i}' if i else ''}" for t, i in scans) or "(score_log を読まない)"
+        log(f"{'❌' if seq else '✅'} {name:16s} {desc}  ← {used_by}")
+    return ok
@@ -0,0 +1,68 @@
+# utils/recordings.py
+"""
+録音 1 件の軽量スコアを ScoreLog に登録する手順。
+/api/upload（リクエスト内）と /api/upload/complete のジョブ（tasks.process_uploaded_recording）の共通部分。
+
+  quick_score(pipeline, user_id) … 直近 RMS_BASELINE_N 件の volume_std を基準に軽量スコア
+  save(...)                      … 上書きならその日（JST）の行を消し、ScoreLog 追加・要約更新を
+                                   1 トランザクションで commit する
+
+save() は詳細解析ジョブを積む前に呼ぶこと（ジョブは filename で ScoreLog の行を探して上書きする）。
+"""
+from app_instance import db
+
+RMS_BASELINE_N = 5
+
+
+def baseline_rms(user_id, raw_rms):
+    """直近の録音の volume_std の平均（履歴が無ければ今回の raw_rms）"""
+    from models import ScoreLog
+    recent = (
+        ScoreLog.query
+        .filter_by(user_id=user_id)
+        .filter(ScoreLog.volume_std.isnot(None))
+        .order_by(ScoreLog.timestamp.desc())
+        .limit(RMS_BASELINE_N)
+        .all()
+    )
+    return (sum(x.volume_std for x in recent) / len(recent)) if recent else raw_rms
+
+
+def quick_score(pipeline, user_id):
+    """(quick_score, is_fallback)"""
+    raw_rms = pipeline.raw_rms
+    return pipeline.light_analyze(raw_rms=raw_rms, rms_baseline=baseline_rms(user_id, raw_rms))
+
+
+def save(user_id, timestamp, score, raw_rms, normalized_filename, overwrite=False):
+    """
+    軽量スコアの ScoreLog を登録して commit。返り値は追加した行。
+    overwrite=True なら timestamp と同じ JST の日の行を先に消す（要約の件数も同じトランザクションで）。
+    """
+    from models import ScoreLog, jst_date
+    from utils import score_summary
+
+    try:
+        removed = 0
+        if overwrite:
+            removed = (ScoreLog.query
+                       .filter_by(user_id=user_id)
+                       .filter(ScoreLog.local_date == jst_date(timestamp))
+                       .delete(synchronize_session=False))
+
+        log = ScoreLog(
+            user_id=user_id,
+            timestamp=timestamp,
+            score=score,
+            is_fallback=True,
+            filename=normalized_filename,
+            volume_std=raw_rms,
+        )
+        db.session.add(log)
+        score_summary.sync(user_id, delta=1 - removed, deleted=removed)
+
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return log
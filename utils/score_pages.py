@@ -0,0 +1,147 @@
+# utils/score_pages.py
+"""
+スコア履歴のキーセット（カーソル）ページング。
+
+  limit / cursor / since のどれも無い … 従来どおり全件（古い→新しい順。旧クライアント互換）
+  limit・cursor  … 新しい方から limit 件（返す配列は古い→新しい順）。キーは (timestamp, id)。
+                   続き（さらに古い分）は next_cursor を ?cursor= に渡す。
+  since=<cursor> … そのカーソルより後に書き込まれた（追加・更新された）行を書き込み順に limit 件。
+                   キーは録音時刻ではなく (updated_at, id) なので、過去の日時で登録された録音や
+                   詳細解析でスコアが差し替わった行も拾える（クライアントは id で置き換える）。
+                   まだ残っていれば next_cursor を ?since= に渡して続きを取る。
+
+最初のページ（cursor 無し）と since は latest_cursor（次回 ?since= に渡す）を返す。
+since のカーソルにはそのユーザーの削除数（UserScoreSummary.deletions）が入っていて、
+上書き録音などで行が消えていたら reset=True（何も返さない）。クライアントは手元を捨てて取り直す。
+書き込みから SINCE_SETTLE_SEC 秒以内の行の手前で latest_cursor を止めるので、コミットが前後した行も
+次回の差分に入る（その分は 2 回返ることがある）。
+OFFSET を使わず索引を途中から読むだけなので、1 リクエストの DB 時間とレスポンスの大きさは limit で決まる。
+"""
+import os
+import base64
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import tuple_
+
+DEFAULT_LIMIT = int(os.getenv("SCORE_PAGE_DEFAULT", "1000"))  # cursor / since だけ渡されたときの件数（0 で無制限）
+MAX_LIMIT     = int(os.getenv("SCORE_PAGE_MAX", "1000"))
+SETTLE_SEC    = float(os.getenv("SCORE_SINCE_SETTLE_SEC", "5"))
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _b64(raw):
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _unb64(cursor):
+    return base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+
+
+def _aware(ts):
+    return ts.replace(tzinfo=timezone.utc) if ts is not None and ts.tzinfo is None else ts
+
+
+def encode_cursor(log):
+    return _b64(f"{log.timestamp.isoformat()}|{log.id}")
+
+
+def decode_cursor(cursor):
+    """(timestamp, id)。壊れていれば ValueError"""
+    try:
+        ts, log_id = _unb64(cursor).rsplit("|", 1)
+        return datetime.fromisoformat(ts), int(log_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"bad cursor: {cursor!r}") from e
+
+
+def encode_since(updated_at, log_id, deletions):
+    return _b64(f"s|{_aware(updated_at).isoformat()}|{log_id}|{deletions}")
+
+
+def decode_since(since):
+    """
+    (updated_at, id, deletions)。
+    旧形式（(timestamp, id) のカーソル）なら None（reset 扱い）。壊れていれば ValueError
+    """
+    try:
+        raw = _unb64(since)
+        if not raw.startswith("s|"):
+            decode_cursor(since)  # 旧形式として読めなければ ValueError
+            return None
+        _, ts, log_id, deletions = raw.split("|")
+        return _aware(datetime.fromisoformat(ts)), int(log_id), int(deletions)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"bad cursor: {since!r}") from e
+
+
+def parse_limit(value, paged=True):
+    """
+    ?limit= の値。範囲外・非数値は ValueError。
+    省略時は paged（cursor / since がある）なら DEFAULT_LIMIT（0 なら None）、無ければ None＝無制限。
+    """
+    if value in (None, ""):
+        return (DEFAULT_LIMIT or None) if paged else None
+    n = int(value)
+    if n < 1 or n > MAX_LIMIT:
+        raise ValueError(f"limit must be 1..{MAX_LIMIT}")
+    return n
+
+
+def _settled(key, floor=None):
+    """latest_cursor のキー。SETTLE_SEC 以内に書かれた行の手前で止める（floor より前には戻さない）"""
+    limit = (datetime.now(timezone.utc) - timedelta(seconds=SETTLE_SEC), 0)
+    key = (_aware(key[0]), key[1])
+    if key > limit:
+        key = limit
+    if floor is not None and floor > key:
+        key = floor
+    return key
+
+
+def _head(query):
+    """いま一番最後に書き込まれた行の (updated_at, id)。無ければ (1970-01-01, 0)"""
+    from models import ScoreLog
+    row = (query.filter(ScoreLog.updated_at.isnot(None))
+           .order_by(ScoreLog.updated_at.desc(), ScoreLog.id.desc())
+           .with_entities(ScoreLog.updated_at, ScoreLog.id)
+           .first())
+    return (row[0], row[1]) if row else (_EPOCH, 0)
+
+
+def page(query, limit=None, cursor=None, since=None, deletions=0):
+    """
+    query（ScoreLog を user_id などで絞ったもの）の 1 ページ。
+    deletions: そのユーザーの UserScoreSummary.deletions
+    返り値: (logs, next_cursor, latest_cursor, reset)
+      logs は cursor 系なら古い→新しい順、since なら書き込み順
+    """
+    from models import ScoreLog
+
+    if since:
+        parsed = decode_since(since)
+        if parsed is None or parsed[2] != deletions:
+            return [], None, None, True
+        floor = parsed[:2]
+        query = (query.filter(tuple_(ScoreLog.updated_at, ScoreLog.id) > floor)
+                 .order_by(ScoreLog.updated_at.asc(), ScoreLog.id.asc()))
+        logs = query.limit(limit + 1).all() if limit else query.all()
+        if limit and len(logs) > limit:
+            logs = logs[:limit]
+            return logs, encode_since(logs[-1].updated_at, logs[-1].id, deletions), None, False
+        last = (logs[-1].updated_at, logs[-1].id) if logs else floor
+        return logs, None, encode_since(*_settled(last, floor), deletions), False
+
+    # 最初のページは先に「いまの最後の書き込み」を押さえてから読む（読んでいる間の書き込みは次回の差分に入る）
+    latest_cursor = None if cursor else encode_since(*_settled(_head(query)), deletions)
+    if cursor:
+        query = query.filter(tuple_(ScoreLog.timestamp, ScoreLog.id) < decode_cursor(cursor))
+    query = query.order_by(ScoreLog.timestamp.desc(), ScoreLog.id.desc())
+
+    # 1 件多く取って「続きがあるか」を判定する
+    logs = query.limit(limit + 1).all() if limit else query.all()
+    has_more = bool(limit) and len(logs) > limit
+    logs = logs[:limit] if limit else logs
+    next_cursor = encode_cursor(logs[-1]) if has_more else None
+    logs.reverse()
+    return logs, next_cursor, latest_cursor, False
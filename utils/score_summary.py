@@ -0,0 +1,135 @@
+# utils/score_summary.py
+"""
+ユーザーごとのスコア要約（models.UserScoreSummary）の更新と読み出し。
+
+  sync(user_id, delta)  … ScoreLog を書いたトランザクションの中で呼ぶ（commit は呼び出し側）。
+                          要約行を FOR UPDATE で押さえ、件数は delta（追加 +1 / 削除 -n）で足し引き、
+                          最初・最新・baseline・きょうは (user_id, timestamp) / (user_id, local_date) の
+                          索引で LIMIT 付きに引き直す（履歴の長さに比例する読みはしない）。
+  get(user_id)          … 読み出し（主キー参照 1 回）。まだ行が無ければその場で作る。
+  rebuild(user_id=None) … 全件数えて作り直す（`flask rebuild-score-summary`）。ずれた行の数を返す。
+"""
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError
+
+from app_instance import db
+
+BASELINE_N = 5  # baseline = 全期間の『最初の最大5回』の平均
+
+FIELDS = ("count", "first_score", "first_at", "latest_score", "latest_at", "latest_is_fallback",
+          "baseline", "today_date", "today_score")
+
+
+def _lock_row(user_id):
+    """要約行を行ロック付きで取る。無ければ作って (row, True)"""
+    from models import UserScoreSummary
+    row = UserScoreSummary.query.filter_by(user_id=user_id).with_for_update().first()
+    if row is not None:
+        return row, False
+    try:
+        # 同じユーザーの初回が同時に来たら片方は主キー重複 → 相手の行を使う
+        with db.session.begin_nested():
+            row = UserScoreSummary(user_id=user_id, count=0)
+            db.session.add(row)
+    except IntegrityError:
+        return UserScoreSummary.query.filter_by(user_id=user_id).with_for_update().first(), False
+    return row, True
+
+
+def _count_logs(user_id):
+    from models import ScoreLog
+    return ScoreLog.query.filter(ScoreLog.user_id == user_id).count()
+
+
+def _fill(row, user_id):
+    """件数以外の項目を ScoreLog から引き直す（どれも索引の先頭から数行だけ読む）"""
+    from models import ScoreLog, jst_date
+    by_user = ScoreLog.query.filter(ScoreLog.user_id == user_id)
+
+    first = by_user.order_by(ScoreLog.timestamp.asc()).limit(BASELINE_N).all()
+    latest = by_user.order_by(ScoreLog.timestamp.desc()).first()
+    if not latest:
+        for f in FIELDS[1:]:
+            setattr(row, f, None)
+        return
+
+    row.first_score = first[0].score
+    row.first_at    = first[0].timestamp
+    scored = [x.score for x in first if x.score is not None]
+    row.baseline    = round(sum(scored) / len(scored), 1) if scored else None
+
+    row.latest_score       = latest.score
+    row.latest_at          = latest.timestamp
+    row.latest_is_fallback = latest.is_fallback
+
+    # 最新の記録日（JST）のうち、スコアのある最新の 1 件
+    day = latest.local_date or jst_date(latest.timestamp)
+    day_log = (by_user
+               .filter(ScoreLog.local_date == day, ScoreLog.score.isnot(None))
+               .order_by(ScoreLog.timestamp.desc())
+               .first())
+    row.today_date  = day
+    row.today_score = day_log.score if day_log else None
+
+
+def sync(user_id, delta=0, deleted=0):
+    """
+    ScoreLog を追加（delta=+1）・削除（delta=-n）・更新（delta=0）したあと、commit の前に呼ぶ。
+    deleted: 消した行数（上書きで 1 消して 1 足すと delta=0, deleted=1）。deletions に足す。
+    行が無かったときは件数を数え直す。
+    """
+    row, created = _lock_row(user_id)
+    row.count = _count_logs(user_id) if created else max(0, (row.count or 0) + delta)
+    if deleted:
+        row.deletions = (row.deletions or 0) + deleted
+    _fill(row, user_id)
+    return row
+
+
+def get(user_id):
+    """要約行（主キー参照）。まだ無ければ作って commit する"""
+    from models import UserScoreSummary
+    row = db.session.get(UserScoreSummary, user_id)
+    if row is not None:
+        return row
+    try:
+        row = sync(user_id)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return row
+
+
+def today_score(row, today=None):
+    """row.today_score が JST のきょうの分なら返す（日付が変わったら None）"""
+    from models import JST
+    today = today or datetime.now(JST).date()
+    return row.today_score if row is not None and row.today_date == today else None
+
+
+def rebuild(user_id=None, commit_every=500, log=print):
+    """要約を全件数え直して作り直す。{'users': 処理数, 'drifted': 値が変わった行数}"""
+    from models import User
+    if user_id is not None:
+        ids = [user_id]
+    else:
+        ids = [uid for (uid,) in db.session.query(User.id).order_by(User.id)]
+
+    stats = {"users": 0, "drifted": 0}
+    for uid in ids:
+        row, created = _lock_row(uid)
+        before = None if created else tuple(getattr(row, f) for f in FIELDS)
+        row.count = _count_logs(uid)
+        _fill(row, uid)
+        after = tuple(getattr(row, f) for f in FIELDS)
+        if before is not None and before != after:
+            stats["drifted"] += 1
+            log(f"⚠️ score summary drift: user_id={uid} {dict(zip(FIELDS, before))} → {dict(zip(FIELDS, after))}")
+        stats["users"] += 1
+        if stats["users"] % commit_every == 0:
+            db.session.commit()
+            log(f"  … {stats['users']} users")
+    db.session.commit()
+    return stats
@@ -0,0 +1,342 @@
+# utils/scratch.py
+"""
+一時ファイルとキャッシュ的な成果物のディスク管理。
+
+  1) 作業ディレクトリ（Workspace）
+     リクエスト／ジョブごとに SCRATCH_DIR/<prefix>-<pid>-XXXX を作り、終わったら丸ごと消す。
+     バックグラウンドの S3 アップロードなど、まだファイルを読んでいる Future は hold() しておけば
+     それが全部終わった時点で消す。
+  2) スイーパ（sweep / start_sweeper）
+     - 持ち主のプロセスが死んだ作業ディレクトリ（SCRATCH_ORPHAN_SEC 以上前のもの）を消す
+     - uploads/raw/（デバッグ用）と uploads/*_normalized.wav（永続コピー）の合計を
+       SCRATCH_ARTIFACT_MAX_BYTES 以下に保つ（mtime が古い順に追い出す LRU）。
+       SCRATCH_ARTIFACT_DIRS の各項目はディレクトリ（直下の全ファイル）か glob。
+       uploads/ 直下には git 管理のサンプル音声があるので、ディレクトリごとは対象にしない
+     - 旧実装が /tmp 直下に残したファイル（/tmp/uploads, /tmp/diary, /tmp/transcode, /tmp/user*_*.wav など）を消す
+     スイーパのスレッドはホストに 1 本（SCRATCH_DIR/.sweeper.lock を flock で持ち続けたプロセスだけが回す）。
+     他のプロセスは SWEEP_INTERVAL ごとにロックを取り直してみるだけなので、持ち主が落ちたら引き継ぐ。
+"""
+import os
+import glob
+import stat
+import time
+import fcntl
+import shutil
+import tempfile
+import threading
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCRATCH_DIR        = os.getenv("SCRATCH_DIR", "/tmp/koekarte-scratch")
+ARTIFACT_DIRS      = [d.strip() for d in os.getenv(
+    "SCRATCH_ARTIFACT_DIRS",
+    f"{os.path.join(ROOT_DIR, 'uploads', 'raw')},{os.path.join(ROOT_DIR, 'uploads', '*_normalized.wav')}").split(",")
+    if d.strip()]
+ARTIFACT_MAX_BYTES = int(os.getenv("SCRATCH_ARTIFACT_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))  # 2GB
+ORPHAN_SEC         = int(os.getenv("SCRATCH_ORPHAN_SEC", "3600"))
+SWEEP_INTERVAL     = int(os.getenv("SCRATCH_SWEEP_INTERVAL", "300"))
+
+# 旧実装が /tmp に置きっぱなしにしていたもの（ORPHAN_SEC より古ければ消す）
+LEGACY_GLOBS = [
+    "/tmp/uploads/*",
+    "/tmp/diary/*",
+    "/tmp/transcode/*",
+    "/tmp/*_normalized.wav",
+    "/tmp/user*_*.wav",
+    "/tmp/user*_*.mp3",
+]
+
+_lock = threading.Lock()
+_counters = {"workspaces_opened": 0, "workspaces_closed": 0, "orphans_removed": 0,
+             "evicted_files": 0, "evicted_bytes": 0, "legacy_removed": 0, "sweeps": 0}
+_live = set()            # このプロセスで開いている Workspace のパス
+_last_sweep = None
+_sweeper_pid = None
+_leader_lock = None      # スイーパの担当を示すロックファイル（持っている間は開いたまま）
+
+
+def _count(field, n=1):
+    with _lock:
+        _counters[field] += n
+
+
+def _rmtree(path):
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def _tree_bytes(path):
+    total = 0
+    for dirpath, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+
+# ────────── 作業ディレクトリ ──────────
+class Workspace:
+    """
+    with scratch.workspace("upload") as ws:
+        path = ws.path("input.m4a")
+        ...
+        ws.hold(future)   # この Future が終わるまでは消さない
+    """
+
+    def __init__(self, prefix="work"):
+        os.makedirs(SCRATCH_DIR, exist_ok=True)
+        self.dir = tempfile.mkdtemp(prefix=f"{prefix}-{os.getpid()}-", dir=SCRATCH_DIR)
+        self._held = []
+        self._closed = False
+        with _lock:
+            _live.add(self.dir)
+        _count("workspaces_opened")
+
+    def path(self, name):
+        return os.path.join(self.dir, os.path.basename(name))
+
+    def hold(self, future):
+        self._held.append(future)
+        return future
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        pending = [f for f in self._held if not f.done()]
+        if not pending:
+            self._remove()
+            return
+        # 残りの Future がすべて終わったら消す（どのスレッドで終わっても 1 回だけ）
+        remaining = [len(pending)]
+        guard = threading.Lock()
+
+        def _done(_):
+            with guard:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                self._remove()
+        for f in pending:
+            f.add_done_callback(_done)
+
+    def _remove(self):
+        _rmtree(self.dir)
+        with _lock:
+            _live.discard(self.dir)
+        _count("workspaces_closed")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def workspace(prefix="work"):
+    return Workspace(prefix)
+
+
+# ────────── スイーパ ──────────
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _sweep_orphans(now):
+    removed = 0
+    try:
+        entries = list(os.scandir(SCRATCH_DIR))
+    except OSError:
+        return 0
+    for e in entries:
+        if not e.is_dir(follow_symlinks=False):
+            continue
+        try:
+            age = now - e.stat().st_mtime
+        except OSError:
+            continue
+        if age < ORPHAN_SEC:
+            continue
+        # <prefix>-<pid>-XXXX。持ち主が生きていて 1 日以内なら長いジョブとみなして残す
+        parts = e.name.rsplit("-", 2)
+        pid = int(parts[1]) if len(parts) == 3 and parts[1].isdigit() else None
+        if pid is not None and _pid_alive(pid) and age < 86400:
+            continue
+        with _lock:
+            if e.path in _live:
+                continue
+        _rmtree(e.path)
+        removed += 1
+    return removed
+
+
+def _artifact_paths(entry):
+    if glob.has_magic(entry):
+        return glob.glob(entry)
+    try:
+        return [e.path for e in os.scandir(entry)]
+    except OSError:
+        return []
+
+
+def _artifact_files():
+    files = []
+    for entry in ARTIFACT_DIRS:
+        for path in _artifact_paths(entry):
+            try:
+                st = os.lstat(path)
+            except OSError:
+                continue
+            if stat.S_ISREG(st.st_mode):
+                files.append((st.st_mtime, st.st_size, path))
+    return files
+
+
+def _sweep_artifacts():
+    files = _artifact_files()
+    total = sum(size for _, size, _ in files)
+    if total <= ARTIFACT_MAX_BYTES:
+        return 0, 0
+    # 古い順に上限の 9 割まで削る
+    files.sort()
+    target = ARTIFACT_MAX_BYTES * 0.9
+    n = freed = 0
+    for _, size, path in files:
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        freed += size
+        n += 1
+    return n, freed
+
+
+def _sweep_legacy(now):
+    removed = 0
+    for pattern in LEGACY_GLOBS:
+        for path in glob.glob(pattern):
+            try:
+                if not os.path.isfile(path) or now - os.path.getmtime(path) < ORPHAN_SEC:
+                    continue
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+def sweep():
+    """1 回分の掃除。他のプロセスが掃除中なら何もしないで None"""
+    global _last_sweep
+    os.makedirs(SCRATCH_DIR, exist_ok=True)
+    with open(os.path.join(SCRATCH_DIR, ".sweep.lock"), "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return None
+        started = time.monotonic()
+        now = time.time()
+        orphans = _sweep_orphans(now)
+        evicted, freed = _sweep_artifacts()
+        legacy = _sweep_legacy(now)
+
+    _count("sweeps")
+    _count("orphans_removed", orphans)
+    _count("evicted_files", evicted)
+    _count("evicted_bytes", freed)
+    _count("legacy_removed", legacy)
+    result = {"orphans_removed": orphans, "evicted_files": evicted, "evicted_bytes": freed,
+              "legacy_removed": legacy, "seconds": round(time.monotonic() - started, 3),
+              "at": time.strftime("%Y-%m-%dT%H:%M:%S%z")}
+    _last_sweep = result
+    if orphans or evicted or legacy:
+        print(f"🧹 scratch sweep: orphans={orphans} evicted={evicted} ({freed / 1e6:.1f}MB) legacy={legacy}")
+    return result
+
+
+def _take_leader():
+    """ホストのスイーパ担当を取る（取れたらロックファイルを開いたまま持つ）"""
+    global _leader_lock
+    if _leader_lock is not None and _sweeper_pid == os.getpid():
+        return True
+    os.makedirs(SCRATCH_DIR, exist_ok=True)
+    f = open(os.path.join(SCRATCH_DIR, ".sweeper.lock"), "w")
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return False
+    _leader_lock = f
+    return True
+
+
+def _drop_leader_in_child():
+    # fork した子（ワーカーの子・解析プール・work-horse）は担当のロックを持ち越さない。
+    # 持ち越すと親が落ちてもロックが外れず、誰も掃除しなくなる
+    global _leader_lock
+    if _leader_lock is not None:
+        try:
+            _leader_lock.close()
+        except OSError:
+            pass
+        _leader_lock = None
+
+
+os.register_at_fork(after_in_child=_drop_leader_in_child)
+
+
+def start_sweeper():
+    """
+    バックグラウンドで SWEEP_INTERVAL 秒ごとに sweep()。ホストで担当を取れたプロセスだけが掃除し、
+    他は担当が空くのを待つ（プロセスごとにスレッドは 1 本。fork 後は作り直す）。
+    """
+    global _sweeper_pid
+    if SWEEP_INTERVAL <= 0 or _sweeper_pid == os.getpid():
+        return
+    _sweeper_pid = os.getpid()
+
+    def _loop():
+        leader = False
+        while True:
+            try:
+                if _take_leader():
+                    if not leader:
+                        print(f"🧹 scratch sweeper 担当 (pid={os.getpid()})")
+                        leader = True
+                    sweep()
+            except Exception as e:
+                print(f"⚠️ scratch sweep failed: {e}")
+            time.sleep(SWEEP_INTERVAL)
+
+    threading.Thread(target=_loop, name="scratch-sweeper", daemon=True).start()
+
+
+def stats():
+    with _lock:
+        local = dict(_counters)
+        live = list(_live)
+    try:
+        all_ws = [e.path for e in os.scandir(SCRATCH_DIR) if e.is_dir(follow_symlinks=False)]
+    except OSError:
+        all_ws = []
+    artifacts = _artifact_files()
+    return {
+        "process": local,
+        "workspaces": {"open_in_process": len(live), "on_disk": len(all_ws),
+                       "bytes": sum(_tree_bytes(p) for p in all_ws)},
+        "artifacts": {"files": len(artifacts), "bytes": sum(size for _, size, _ in artifacts),
+                      "max_bytes": ARTIFACT_MAX_BYTES, "dirs": ARTIFACT_DIRS},
+        "last_sweep": _last_sweep,
+        "dir": SCRATCH_DIR,
+    }
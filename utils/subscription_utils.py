@@ -3,9 +3,6 @@ import os
 from datetime import datetime, timezone
 
 BILLING_ENABLED = os.getenv("BILLING_ENABLED", "0").lower() in ("1","true","yes")
-if BILLING_ENABLED:
-    import stripe
-    stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
 
 def sync_subscription_from_stripe(user):
     from app_instance import db  # ←OK（関数内importで循環回避）
@@ -14,6 +11,9 @@ def sync_subscription_from_stripe(user):
     if not BILLING_ENABLED:
         return True, "disabled"
 
+    import stripe  # 課金有効時のみ（起動時には読まない）
+    stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
+
     cust_id = getattr(user, "stripe_customer_id", None)
     cust = None
 
@@ -0,0 +1,352 @@
+# utils/transcode_service.py
+"""
+ホスト内共有のトランスコードサービス。
+
+gunicorn の各ワーカーが毎回 ffmpeg プロセスを起動する代わりに、
+常駐プロセス（transcoder.py）がローカルの UNIX ソケットで要求を受け、
+固定数の常駐ワーカースレッドでデコード／エンコードする。
+
+- PyAV（av, requirements.txt に入っている）でプロセス内の libav を使ってデコード／エンコード（ffmpeg 起動なし）
+- import できないときだけ ffmpeg サブプロセスにフォールバック（1 件ごとに ffmpeg を起動するので、
+  起動時と毎回のフォールバックで警告ログを出す。本番でこのログが出たら av のインストールを確認する）
+- キューは上限付き。満杯なら即 busy を返し、クライアントは従来のサブプロセスで処理する
+
+クライアント側 API（decode_pcm / encode_mp3 / transcode_file / get_stats）は
+TRANSCODER_SOCKET 未設定・接続失敗・busy のとき None / False を返すので、
+呼び出し側（utils/audio_utils.py）はそのまま従来処理へフォールバックできる。
+"""
+import os
+import json
+import time
+import queue
+import socket
+import struct
+import threading
+import subprocess
+
+import numpy as np
+
+SOCKET_PATH   = os.getenv("TRANSCODER_SOCKET")  # 例: /tmp/koekarte-transcoder.sock
+WORKERS       = int(os.getenv("TRANSCODER_WORKERS", str(os.cpu_count() or 2)))
+QUEUE_MAX     = int(os.getenv("TRANSCODER_QUEUE_MAX", str(WORKERS * 4)))
+CLIENT_TIMEOUT = float(os.getenv("TRANSCODER_TIMEOUT", "60"))
+# サーバが読み書きしてよいディレクトリ（ソケット経由で任意のパスを開かせない）
+ALLOWED_DIRS  = [os.path.realpath(d.strip()) for d in os.getenv(
+    "TRANSCODER_ALLOWED_DIRS",
+    os.getenv('SCRATCH_DIR', '/tmp/koekarte-scratch')).split(",") if d.strip()]
+
+try:
+    import av  # PyAV
+except ImportError as e:
+    av = None
+    print(f"🚨 PyAV を import できません（{e}）。トランスコードは 1 件ごとに ffmpeg を起動します。"
+          f"pip install -r requirements.txt を確認してください")
+
+
+# ────────── ワイヤプロトコル ──────────
+# [4byte ヘッダ長][JSON ヘッダ][payload_len バイトのペイロード]
+def _recv_exact(sock, n):
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(min(n - len(buf), 1 << 20))
+        if not chunk:
+            raise ConnectionError("socket closed")
+        buf.extend(chunk)
+    return bytes(buf)
+
+
+def _send_msg(sock, header, payload=b""):
+    header = dict(header, payload_len=len(payload))
+    raw = json.dumps(header).encode("utf-8")
+    sock.sendall(struct.pack(">I", len(raw)) + raw)
+    if payload:
+        sock.sendall(payload)
+
+
+def _recv_msg(sock):
+    (n,) = struct.unpack(">I", _recv_exact(sock, 4))
+    header = json.loads(_recv_exact(sock, n).decode("utf-8"))
+    size = int(header.get("payload_len") or 0)
+    payload = _recv_exact(sock, size) if size else b""
+    return header, payload
+
+
+# ────────── バックエンド（PyAV / ffmpeg） ──────────
+def _ffmpeg_exe():
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return "ffmpeg"
+
+
+def _warn_fallback(op, path):
+    print(f"🚨 transcoder: PyAV が無いので ffmpeg サブプロセスで処理します op={op} path={path}")
+
+
+def _bitrate_int(bitrate):
+    b = str(bitrate).lower()
+    return int(float(b[:-1]) * 1000) if b.endswith("k") else int(b)
+
+
+def decode_to_pcm(path, sr=16000):
+    """任意の音声ファイル → mono int16 ndarray（sr Hz）"""
+    if av is not None:
+        with av.open(path) as container:
+            stream = container.streams.audio[0]
+            resampler = av.AudioResampler(format="s16", layout="mono", rate=sr)
+            parts = []
+            for frame in container.decode(stream):
+                for out in resampler.resample(frame):
+                    parts.append(out.to_ndarray().reshape(-1))
+            for out in resampler.resample(None):
+                parts.append(out.to_ndarray().reshape(-1))
+        return np.concatenate(parts).astype(np.int16) if parts else np.zeros(0, np.int16)
+
+    _warn_fallback("decode", path)
+    cmd = [_ffmpeg_exe(), "-nostdin", "-y", "-i", path,
+           "-acodec", "pcm_s16le", "-ac", "1", "-ar", str(sr), "-f", "s16le", "pipe:1"]
+    res = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if res.returncode != 0:
+        raise RuntimeError(f"ffmpeg decode failed: {res.stderr[-300:]!r}")
+    return np.frombuffer(res.stdout, dtype="<i2")
+
+
+def encode_pcm_to_mp3(pcm, sr, out_path, bitrate="192k"):
+    """mono int16 ndarray → MP3 ファイル"""
+    pcm = np.asarray(pcm, dtype=np.int16)
+    if av is not None:
+        with av.open(out_path, mode="w", format="mp3") as container:
+            stream = container.add_stream("mp3", rate=sr)
+            stream.layout = "mono"
+            stream.bit_rate = _bitrate_int(bitrate)
+            frame = av.AudioFrame.from_ndarray(pcm.reshape(1, -1), format="s16", layout="mono")
+            frame.sample_rate = sr
+            for packet in stream.encode(frame):
+                container.mux(packet)
+            for packet in stream.encode(None):
+                container.mux(packet)
+        return out_path
+
+    _warn_fallback("encode_mp3", out_path)
+    cmd = [_ffmpeg_exe(), "-nostdin", "-y", "-f", "s16le", "-ar", str(sr), "-ac", "1",
+           "-i", "pipe:0", "-b:a", bitrate, "-f", "mp3", out_path]
+    res = subprocess.run(cmd, input=pcm.astype("<i2").tobytes(),
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if res.returncode != 0:
+        raise RuntimeError(f"ffmpeg encode failed: {res.stderr[-300:]!r}")
+    return out_path
+
+
+def transcode_to_mp3(src_path, out_path, bitrate="128k"):
+    """ファイル → MP3（サンプルレート・チャンネルは元のまま。pydub の export と同等）"""
+    if av is not None:
+        with av.open(src_path) as src, av.open(out_path, mode="w", format="mp3") as dst:
+            in_stream = src.streams.audio[0]
+            out_stream = dst.add_stream("mp3", rate=in_stream.rate)
+            out_stream.layout = "stereo" if in_stream.channels > 1 else "mono"
+            out_stream.bit_rate = _bitrate_int(bitrate)
+            for frame in src.decode(in_stream):
+                frame.pts = None
+                for packet in out_stream.encode(frame):
+                    dst.mux(packet)
+            for packet in out_stream.encode(None):
+                dst.mux(packet)
+        return out_path
+
+    _warn_fallback("transcode", src_path)
+    cmd = [_ffmpeg_exe(), "-nostdin", "-y", "-i", src_path, "-vn",
+           "-b:a", bitrate, "-f", "mp3", out_path]
+    res = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if res.returncode != 0:
+        raise RuntimeError(f"ffmpeg transcode failed: {res.stderr[-300:]!r}")
+    return out_path
+
+
+# ────────── サーバ ──────────
+def _allowed_path(path):
+    """ALLOWED_DIRS の下のパスなら実パスを返す（シンボリックリンク・.. も解決してから判定）。外なら ValueError"""
+    real = os.path.realpath(str(path))
+    for root in ALLOWED_DIRS:
+        if os.path.commonpath([real, root]) == root:
+            return real
+    raise ValueError(f"path not allowed: {path}")
+
+
+class _Job:
+    __slots__ = ("header", "payload", "enqueued", "done", "reply", "reply_payload")
+
+    def __init__(self, header, payload):
+        self.header = header
+        self.payload = payload
+        self.enqueued = time.monotonic()
+        self.done = threading.Event()
+        self.reply = None
+        self.reply_payload = b""
+
+
+class TranscodeServer:
+    def __init__(self, socket_path=None, workers=None, queue_max=None):
+        self.socket_path = socket_path or SOCKET_PATH or "/tmp/koekarte-transcoder.sock"
+        self.workers = workers or WORKERS
+        self.jobs = queue.Queue(maxsize=queue_max or QUEUE_MAX)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._counters = {
+            "submitted": 0, "completed": 0, "failed": 0, "rejected": 0,
+            "wait_ms_total": 0.0, "service_ms_total": 0.0,
+        }
+
+    # ---------- メトリクス ----------
+    def stats(self):
+        with self._lock:
+            c = dict(self._counters)
+            in_flight = self._in_flight
+        done = max(c["completed"] + c["failed"], 1)
+        return {
+            "backend": "pyav" if av is not None else "ffmpeg",
+            "workers": self.workers,
+            "queue_max": self.jobs.maxsize,
+            "queue_depth": self.jobs.qsize(),
+            "in_flight": in_flight,
+            "submitted": c["submitted"],
+            "completed": c["completed"],
+            "failed": c["failed"],
+            "rejected": c["rejected"],
+            "avg_wait_ms": round(c["wait_ms_total"] / done, 2),
+            "avg_service_ms": round(c["service_ms_total"] / done, 2),
+        }
+
+    def _count(self, key, value=1):
+        with self._lock:
+            self._counters[key] += value
+
+    # ---------- ワーカー ----------
+    def _run(self, job):
+        h = job.header
+        op = h.get("op")
+        if op == "decode":
+            sr = int(h.get("sr") or 16000)
+            pcm = decode_to_pcm(_allowed_path(h["path"]), sr)
+            return {"ok": True, "sr": sr}, pcm.astype("<i2").tobytes()
+        if op == "encode_mp3":
+            pcm = np.frombuffer(job.payload, dtype="<i2")
+            encode_pcm_to_mp3(pcm, int(h["sr"]), _allowed_path(h["path"]), h.get("bitrate") or "192k")
+            return {"ok": True}, b""
+        if op == "transcode":
+            transcode_to_mp3(_allowed_path(h["src"]), _allowed_path(h["dst"]), h.get("bitrate") or "128k")
+            return {"ok": True}, b""
+        return {"ok": False, "error": "unknown_op"}, b""
+
+    def _worker_loop(self):
+        while True:
+            job = self.jobs.get()
+            started = time.monotonic()
+            with self._lock:
+                self._in_flight += 1
+                self._counters["wait_ms_total"] += (started - job.enqueued) * 1000
+            try:
+                job.reply, job.reply_payload = self._run(job)
+                self._count("completed")
+            except Exception as e:
+                print(f"❌ transcoder job failed: op={job.header.get('op')} err={e}")
+                job.reply = {"ok": False, "error": "failed", "detail": str(e)[:300]}
+                self._count("failed")
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+                    self._counters["service_ms_total"] += (time.monotonic() - started) * 1000
+                job.done.set()
+
+    # ---------- 接続処理 ----------
+    def _handle(self, conn):
+        try:
+            with conn:
+                header, payload = _recv_msg(conn)
+                if header.get("op") == "stats":
+                    _send_msg(conn, {"ok": True, "stats": self.stats()})
+                    return
+                try:
+                    for k in ("path", "src", "dst"):
+                        if k in header:
+                            _allowed_path(header[k])
+                except ValueError as e:
+                    self._count("rejected")
+                    _send_msg(conn, {"ok": False, "error": "forbidden_path", "detail": str(e)})
+                    return
+                job = _Job(header, payload)
+                try:
+                    self.jobs.put_nowait(job)
+                except queue.Full:
+                    self._count("rejected")
+                    _send_msg(conn, {"ok": False, "error": "busy"})
+                    return
+                self._count("submitted")
+                job.done.wait()
+                _send_msg(conn, job.reply, job.reply_payload)
+        except Exception as e:
+            print(f"⚠️ transcoder connection error: {e}")
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o660)
+        sock.listen(128)
+
+        for _ in range(self.workers):
+            threading.Thread(target=self._worker_loop, daemon=True).start()
+
+        print(f"✅ transcoder 起動: socket={self.socket_path} workers={self.workers} "
+              f"queue_max={self.jobs.maxsize} backend={'pyav' if av is not None else 'ffmpeg'}")
+        if av is None:
+            print("🚨 transcoder: PyAV 無しで起動しました。全ジョブが ffmpeg サブプロセスになります")
+        while True:
+            conn, _ = sock.accept()
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+
+# ────────── クライアント ──────────
+def _request(header, payload=b""):
+    """サービスへ 1 リクエスト。未設定・接続不可・busy・失敗は None。"""
+    if not SOCKET_PATH:
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(CLIENT_TIMEOUT)
+            sock.connect(SOCKET_PATH)
+            _send_msg(sock, header, payload)
+            reply, data = _recv_msg(sock)
+    except Exception as e:
+        print(f"⚠️ transcoder unavailable ({header.get('op')}): {e}")
+        return None
+    if not reply.get("ok"):
+        print(f"⚠️ transcoder {header.get('op')} rejected: {reply.get('error')}")
+        return None
+    return reply, data
+
+
+def decode_pcm(path, sr=16000):
+    res = _request({"op": "decode", "path": os.path.abspath(path), "sr": sr})
+    if res is None:
+        return None
+    return np.frombuffer(res[1], dtype="<i2")
+
+
+def encode_mp3(pcm, sr, out_path, bitrate="192k"):
+    pcm = np.asarray(pcm, dtype=np.int16)
+    res = _request({"op": "encode_mp3", "path": os.path.abspath(out_path),
+                    "sr": sr, "bitrate": bitrate}, pcm.astype("<i2").tobytes())
+    return res is not None
+
+
+def transcode_file(src_path, out_path, bitrate="128k"):
+    res = _request({"op": "transcode", "src": os.path.abspath(src_path),
+                    "dst": os.path.abspath(out_path), "bitrate": bitrate})
+    return res is not None
+
+
+def get_stats():
+    res = _request({"op": "stats"})
+    return res[0]["stats"] if res else None
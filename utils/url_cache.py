@@ -0,0 +1,219 @@
+# utils/url_cache.py
+"""
+署名付き GET URL のキャッシュ。
+
+同じオブジェクト・同じ有効期間（expires）の URL は、残り寿命が URL_CACHE_MIN_REMAINING（割合）より
+多いあいだは作り直さずに同じものを返す。署名の CPU を省くだけでなく、URL が毎回変わらないので
+クライアントや CDN のキャッシュが効く。
+
+  1) プロセス内（OrderedDict の LRU, 上限 URL_CACHE_LOCAL_MAX 件）
+  2) Redis（REDIS_URL, urlcache:<expires>:<key>。TTL = 再利用できる残り時間なので自然に消える）
+
+の順に引き、Redis ヒット時はプロセス内にも入れる。
+
+同じキーに上書きアップロードされうるオブジェクト（日記 diary/<user_id>/<日付>.m4a など）は、
+呼び出し側が version（DiaryEntry / DerivedAsset の updated_at など）を渡す。version はキャッシュキーに入るので、
+上書きされると全プロセスで別枠になり新しい URL を署名する（古い URL をクライアントや CDN が
+前の音声のキャッシュに結び付けたまま返し続けない）。
+ヒット／ミス数はプロセス内と Redis（urlcache:stats）の両方に数える。
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+
+ENABLED       = os.getenv("URL_CACHE", "1").lower() in ("1", "true", "yes")
+LOCAL_MAX     = int(os.getenv("URL_CACHE_LOCAL_MAX", "10000"))
+MIN_REMAINING = float(os.getenv("URL_CACHE_MIN_REMAINING", "0.5"))  # 寿命の何割が残っていれば再利用するか
+
+REDIS_PREFIX = "urlcache:"
+REDIS_STATS  = "urlcache:stats"
+
+_lock = threading.Lock()
+_local = OrderedDict()   # cache_key -> (url, reuse_until)
+_counters = {"hits_local": 0, "hits_redis": 0, "misses": 0}
+_redis = None
+_redis_failed = False
+
+
+def _cache_key(s3_key, expires, version=None):
+    # 有効期間ごとに別枠（1h の URL を 24h の要求に返さない）。version が変われば別枠
+    if version is None:
+        return f"{int(expires)}:{s3_key}"
+    if hasattr(version, "timestamp"):
+        version = f"{version.timestamp():.6f}"
+    return f"{int(expires)}:{version}:{s3_key}"
+
+
+# ────────── カウンタ ──────────
+def _count(delta):
+    """delta: {'hits_local': n, ...}。Redis へはまとめて 1 往復"""
+    delta = {k: v for k, v in delta.items() if v}
+    if not delta:
+        return
+    with _lock:
+        for k, v in delta.items():
+            _counters[k] += v
+    r = _get_redis()
+    if r is not None:
+        try:
+            pipe = r.pipeline()
+            for k, v in delta.items():
+                pipe.hincrby(REDIS_STATS, k, v)
+            pipe.execute()
+        except Exception:
+            pass
+
+
+def _hit_rate(c):
+    lookups = c.get("hits_local", 0) + c.get("hits_redis", 0) + c.get("misses", 0)
+    return round((c.get("hits_local", 0) + c.get("hits_redis", 0)) / lookups, 4) if lookups else None
+
+
+def stats():
+    with _lock:
+        local = dict(_counters)
+        local_entries = len(_local)
+    local["hit_rate"] = _hit_rate(local)
+
+    shared = None
+    r = _get_redis()
+    if r is not None:
+        try:
+            shared = {k.decode(): int(v) for k, v in r.hgetall(REDIS_STATS).items()}
+            shared["hit_rate"] = _hit_rate(shared)
+        except Exception:
+            shared = None
+    return {"process": local, "shared": shared, "local_entries": local_entries,
+            "local_max": LOCAL_MAX, "min_remaining": MIN_REMAINING, "enabled": ENABLED}
+
+
+# ────────── Redis ──────────
+def _get_redis():
+    global _redis, _redis_failed
+    if _redis is not None or _redis_failed:
+        return _redis
+    url = os.getenv("REDIS_URL")
+    if not url:
+        _redis_failed = True
+        return None
+    try:
+        import redis
+        _redis = redis.from_url(url, socket_timeout=1.0, socket_connect_timeout=1.0)
+    except Exception as e:
+        print(f"⚠️ url cache: redis 無効 ({e})")
+        _redis_failed = True
+    return _redis
+
+
+def _redis_get_many(ckeys):
+    r = _get_redis()
+    if r is None or not ckeys:
+        return [None] * len(ckeys)
+    try:
+        return r.mget([REDIS_PREFIX + k for k in ckeys])
+    except Exception as e:
+        print(f"⚠️ url cache redis get failed: {e}")
+        return [None] * len(ckeys)
+
+
+def _redis_put_many(entries):
+    """entries: [(cache_key, url, reuse_until), ...]"""
+    r = _get_redis()
+    if r is None or not entries:
+        return
+    now = time.time()
+    try:
+        pipe = r.pipeline()
+        for ckey, url, reuse_until in entries:
+            ttl = int(reuse_until - now)
+            if ttl > 0:
+                pipe.set(REDIS_PREFIX + ckey, f"{reuse_until:.0f}|{url}", ex=ttl)
+        pipe.execute()
+    except Exception as e:
+        print(f"⚠️ url cache redis put failed: {e}")
+
+
+# ────────── プロセス内 ──────────
+def _local_get(ckey, now):
+    with _lock:
+        hit = _local.get(ckey)
+        if hit is None:
+            return None
+        if hit[1] <= now:
+            del _local[ckey]
+            return None
+        _local.move_to_end(ckey)
+        return hit[0]
+
+
+def _local_put(ckey, url, reuse_until):
+    with _lock:
+        _local[ckey] = (url, reuse_until)
+        _local.move_to_end(ckey)
+        while len(_local) > LOCAL_MAX:
+            _local.popitem(last=False)
+
+
+# ────────── 公開 API ──────────
+def signed_urls(s3_keys, expires=3600, versions=None):
+    """
+    s3_keys の署名付き URL を {key: url} で返す（失敗したものは None）。
+    versions: {key: version}（上書きされうるキーの版。datetime なら updated_at として扱う）
+    Redis は 1 回の MGET と 1 回のパイプラインで済ませる（diary_list のような一覧向け）。
+    """
+    from s3_utils import signed_url as _sign
+    keys = list(dict.fromkeys(k for k in s3_keys if k))
+    if not ENABLED:
+        return {k: _sign(k, expires=expires) for k in keys}
+
+    versions = versions or {}
+    ckeys = {k: _cache_key(k, expires, versions.get(k)) for k in keys}
+    now = time.time()
+    out, missing = {}, []
+    hits_local = hits_redis = 0
+    for k in keys:
+        url = _local_get(ckeys[k], now)
+        if url is not None:
+            out[k] = url
+            hits_local += 1
+        else:
+            missing.append(k)
+
+    to_sign = []
+    if missing:
+        raws = _redis_get_many([ckeys[k] for k in missing])
+        for k, raw in zip(missing, raws):
+            if raw is not None:
+                try:
+                    reuse_until, url = raw.decode().split("|", 1)
+                    if float(reuse_until) > now:
+                        out[k] = url
+                        _local_put(ckeys[k], url, float(reuse_until))
+                        hits_redis += 1
+                        continue
+                except ValueError:
+                    pass
+            to_sign.append(k)
+
+    fresh = []
+    for k in to_sign:
+        url = _sign(k, expires=expires)
+        out[k] = url
+        if url:
+            # 残り寿命が MIN_REMAINING を切るまで再利用する
+            reuse_until = now + expires * (1.0 - MIN_REMAINING)
+            _local_put(ckeys[k], url, reuse_until)
+            fresh.append((ckeys[k], url, reuse_until))
+    _redis_put_many(fresh)
+
+    _count({"hits_local": hits_local, "hits_redis": hits_redis, "misses": len(to_sign)})
+    return out
+
+
+def signed_url(s3_key, expires=3600, version=None):
+    """s3_utils.signed_url のキャッシュ付き版（version は signed_urls と同じ）"""
+    if not s3_key:
+        return None
+    return signed_urls([s3_key], expires=expires, versions={s3_key: version}).get(s3_key)
+
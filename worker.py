@@ -3,39 +3,47 @@ import os
 import time
 import traceback
 from redis import Redis
-from rq import Worker, Queue, Connection
+from rq import Worker, SimpleWorker, Queue, Connection
 from app_instance import app
 import tasks  # tasks.py を読み込んでおくことで関数エラーを防止
-import boto3
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-listen_queues = ['default']
+listen_queues = ['default', 'transcode']  # 左から優先（解析 → MP3 変換）
 redis_url = os.getenv('REDIS_URL') or 'redis://localhost:6379'
 
 # プロジェクトルートを追加（models.pyがある位置）
 sys.path.append(os.path.abspath(os.path.dirname(__file__)))
 import models  # ✅ 明示的に読み込む（重要）
 
-while True:
-    try:
-        redis_conn = Redis.from_url(redis_url)
-        with app.app_context():  # FlaskのコンテキストでDB接続等を使用可能にする
-            with Connection(redis_conn):
-                worker = Worker(map(Queue, listen_queues))
-                print("✅ Worker 起動完了。ジョブ待機中...")
-                worker.work(logging_level="INFO")
-    except Exception as e:
-        print("❌ Worker エラー:", e)
-        traceback.print_exc()
-        print("🔁 5秒後に再起動します...")
-        time.sleep(5)
+def run_worker(queues=None):
+    """
+    RQ ワーカー本体。例外で落ちたら 5 秒後に作り直す。
+    SIGTERM などで warm shutdown した（work() が正常に戻った）ら終了する。
+    """
+    queues = queues or listen_queues
+    # ジョブの作業ディレクトリの取り残し・uploads/ の掃除（RQ の work-horse ではなくこのプロセスで）
+    from utils import scratch
+    scratch.start_sweeper()
+    while True:
+        try:
+            redis_conn = Redis.from_url(redis_url)
+            with app.app_context():  # FlaskのコンテキストでDB接続等を使用可能にする
+                with Connection(redis_conn):
+                    # バッチ解析ではジョブをこのプロセスで実行する（work-horse を fork しない）。
+                    # tasks の解析プロセスプールをジョブをまたいで使い回すため
+                    worker_cls = SimpleWorker if tasks.ANALYSIS_BATCH_SIZE > 1 else Worker
+                    worker = worker_cls(map(Queue, queues))
+                    print(f"✅ Worker 起動完了 (pid={os.getpid()})。ジョブ待機中...")
+                    # with_scheduler: 処理中で入れ直したバッチ解析ジョブ（Retry の interval）を時刻どおりに戻す
+                    worker.work(logging_level="INFO", with_scheduler=True)
+            print(f"👋 Worker 終了 (pid={os.getpid()})")
+            return
+        except Exception as e:
+            print("❌ Worker エラー:", e)
+            traceback.print_exc()
+            print("🔁 5秒後に再起動します...")
+            time.sleep(5)
 
-def download_from_s3(s3_key, local_path):
-    s3 = boto3.client('s3',
-                      aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-                      aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-                      region_name='us-east-1')
-
-    s3.download_file('koekarte-uploads', s3_key, local_path)
-    print("✅ S3からファイルを取得:", local_path)
+if __name__ == '__main__':
+    run_worker()
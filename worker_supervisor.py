@@ -0,0 +1,181 @@
+# worker_supervisor.py
+# 複数の RQ ワーカーを 1 コンテナで動かすスーパーバイザ
+#   python worker_supervisor.py
+#
+# 親プロセスで librosa / numba / soundfile などの音声スタックを 1 回だけ import・ウォームアップ
+# （numba の JIT コンパイル込み）してから WORKER_PROCS 個のワーカーを fork する。
+# 子はコピーオンライトで読み込み済みのモジュールを共有するので、起動もジョブ初回もほぼ待ちがない。
+#   - 子が落ちたらバックオフ付きで再起動（すぐ落ち続ける場合は 1s → 2s → … 最大 60s）
+#   - SIGTERM / SIGINT で子に SIGTERM を送り、RQ の warm shutdown（実行中のジョブは完了させる）を待つ。
+#     WORKER_DRAIN_TIMEOUT 秒を過ぎても残る子は SIGKILL
+import os
+import sys
+import time
+import signal
+import traceback
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+WORKER_PROCS         = int(os.getenv('WORKER_PROCS', str(os.cpu_count() or 1)))
+WORKER_QUEUES        = [s.strip() for s in os.getenv('WORKER_QUEUES', 'default,transcode').split(',') if s.strip()]
+WORKER_WARMUP        = os.getenv('WORKER_WARMUP', '1').lower() in ('1', 'true', 'yes')
+WORKER_DRAIN_TIMEOUT = float(os.getenv('WORKER_DRAIN_TIMEOUT', '25'))
+
+BACKOFF_MIN    = 1.0
+BACKOFF_MAX    = 60.0
+STABLE_SECONDS = 30.0   # これ以上動いてから落ちた子はバックオフをリセット
+
+
+def preload():
+    """ジョブが使うモジュールを親で import しておく"""
+    started = time.monotonic()
+    import numpy            # noqa: F401
+    import soundfile        # noqa: F401
+    import scipy.signal     # noqa: F401
+    import librosa
+    # librosa はサブモジュールを遅延 import するので明示的に触っておく
+    librosa.feature, librosa.effects, librosa.util  # noqa: B018
+    import worker           # app_instance / tasks / models も読み込まれる  # noqa: F401
+    from utils import audio_utils, feature_engine  # noqa: F401
+    print(f"📦 preload 完了: {time.monotonic() - started:.2f}s")
+
+
+def warmup():
+    """
+    合成音声でジョブと同じ解析経路を 1 回通し、numba の JIT コンパイルと
+    librosa / scipy の初回コストを親で払っておく（特徴量キャッシュは通さない）。
+    """
+    import numpy as np
+    from utils.audio_utils import StreamingStats, _light_score
+    from utils.feature_engine import _extract_advanced_features
+
+    started = time.monotonic()
+    sr = 16000
+    t = np.arange(sr * 2) / sr
+    y = (0.3 * np.sin(2 * np.pi * 180 * t) * (1 + 0.5 * np.sin(2 * np.pi * 3 * t))).astype(np.float32)
+
+    stats = StreamingStats(sr, sr)
+    for i in range(0, y.size, sr):
+        stats.update(y[i:i + sr])
+    _light_score(stats)
+    _extract_advanced_features(y, sr)
+    # 44.1k 入力の再サンプル経路
+    try:
+        _extract_advanced_features(np.resize(y, 44100), 44100)
+    except Exception as e:
+        print(f"⚠️ warmup (resample) skipped: {type(e).__name__}")
+    print(f"🔥 warmup 完了: {time.monotonic() - started:.2f}s")
+
+
+def _child_main():
+    """fork 後の子プロセス：シグナルを既定に戻し、接続を作り直してワーカーを動かす"""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    code = 0
+    try:
+        from app_instance import app, db
+        # 親の DB 接続プールを子で共有しない。close=False: 親から引き継いだ接続を
+        # 子で閉じると親側のソケットまで切れるので、捨てるだけにする
+        with app.app_context():
+            db.engine.dispose(close=False)
+        import worker
+        worker.run_worker(WORKER_QUEUES)
+    except Exception:
+        traceback.print_exc()
+        code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)
+
+
+class Supervisor:
+    def __init__(self, procs=WORKER_PROCS):
+        self.procs = max(1, procs)
+        self.children = {}                       # pid -> slot
+        self.started_at = {}                     # slot -> 起動時刻
+        self.backoff = [0.0] * self.procs        # slot ごとの次回待ち時間
+        self.restart_at = {}                     # slot -> 再起動予定時刻
+        self.stopping = False
+
+    def _spawn(self, slot):
+        pid = os.fork()
+        if pid == 0:
+            _child_main()
+        self.children[pid] = slot
+        self.started_at[slot] = time.monotonic()
+        print(f"🚀 worker[{slot}] 起動 pid={pid}")
+
+    def _on_signal(self, signum, frame):
+        if self.stopping:
+            return
+        self.stopping = True
+        print(f"🛑 signal {signum} を受信。ワーカーを drain します（最大 {WORKER_DRAIN_TIMEOUT}s）")
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def _reap(self):
+        """終了した子を回収し、必要なら再起動を予約する"""
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.children.clear()
+                return
+            if pid == 0:
+                return
+            slot = self.children.pop(pid, None)
+            if slot is None:
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            if self.stopping:
+                print(f"👋 worker[{slot}] 終了 pid={pid} code={code}")
+                continue
+            uptime = time.monotonic() - self.started_at.get(slot, 0.0)
+            if uptime >= STABLE_SECONDS:
+                self.backoff[slot] = 0.0
+            self.backoff[slot] = min(BACKOFF_MAX, max(BACKOFF_MIN, self.backoff[slot] * 2))
+            self.restart_at[slot] = time.monotonic() + self.backoff[slot]
+            print(f"❌ worker[{slot}] 停止 pid={pid} code={code} uptime={uptime:.1f}s "
+                  f"→ {self.backoff[slot]:.0f}s 後に再起動")
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._on_signal)
+        signal.signal(signal.SIGINT, self._on_signal)
+
+        for slot in range(self.procs):
+            self._spawn(slot)
+        print(f"✅ supervisor 起動完了: procs={self.procs} queues={WORKER_QUEUES}")
+
+        while not self.stopping:
+            self._reap()
+            now = time.monotonic()
+            for slot, at in list(self.restart_at.items()):
+                if at <= now and not self.stopping:
+                    del self.restart_at[slot]
+                    self._spawn(slot)
+            time.sleep(0.5)
+
+        # drain: 子が warm shutdown するのを待つ
+        deadline = time.monotonic() + WORKER_DRAIN_TIMEOUT
+        while self.children and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.2)
+        for pid, slot in list(self.children.items()):
+            print(f"⚠️ worker[{slot}] が drain に間に合わないため SIGKILL pid={pid}")
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+        print("✅ supervisor 終了")
+
+
+if __name__ == '__main__':
+    preload()
+    if WORKER_WARMUP:
+        warmup()
+    Supervisor().run()